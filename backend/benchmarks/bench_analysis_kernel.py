@@ -0,0 +1,92 @@
+"""
+Benchmark the fused analysis kernel against the original float64 helpers
+
+Reports per-image latency and the temporary memory each call allocates (tracemalloc sees
+numpy buffers), for single images and for the batched N x 224 x 224 x 3 path.
+
+    cd backend
+    python benchmarks/bench_analysis_kernel.py --repeat 200 --json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from selic_kernels import AnalysisKernel
+
+
+def legacy_statistics(img_array: np.ndarray):
+    """The original _calculate_brightness + _estimate_complexity (two float64 gray planes)"""
+    gray = np.mean(img_array, axis=2)
+    brightness = float(np.mean(gray) / 255.0)
+
+    gray = np.mean(img_array, axis=2)
+    dy, dx = np.gradient(gray)
+    edge_magnitude = np.sqrt(dx**2 + dy**2)
+    complexity = min(1.0, max(0.0, np.mean(edge_magnitude) / 128.0))
+    return brightness, complexity
+
+
+def measure(fn, arg, repeat: int):
+    fn(arg)  # warm-up (also sizes the kernel's scratch buffers)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        timings.append((time.perf_counter() - start) * 1e6)
+
+    tracemalloc.start()
+    fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=32, help="Images per batched call")
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per result")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    single = rng.integers(0, 256, size=(224, 224, 3), dtype=np.uint8)
+    batch = rng.integers(0, 256, size=(args.batch, 224, 224, 3), dtype=np.uint8)
+    kernel = AnalysisKernel()
+
+    cases = [
+        ("legacy", "single", legacy_statistics, single, 1),
+        ("fused", "single", kernel.luma_statistics, single, 1),
+        ("legacy", f"loop x{args.batch}", lambda b: [legacy_statistics(a) for a in b], batch, args.batch),
+        ("fused", f"batch x{args.batch}", kernel.luma_statistics, batch, args.batch),
+    ]
+
+    results = []
+    for name, shape, fn, arg, images in cases:
+        median_us, peak_bytes = measure(fn, arg, args.repeat)
+        results.append({
+            "implementation": name,
+            "input": shape,
+            "us_per_image": round(median_us / images, 1),
+            "temp_kib_per_call": round(peak_bytes / 1024, 1),
+        })
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(f"{'impl':<8} {'input':<12} {'us/image':>10} {'temp KiB/call':>14}")
+        for r in results:
+            print(f"{r['implementation']:<8} {r['input']:<12} {r['us_per_image']:>10} {r['temp_kib_per_call']:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark analysis-path decode backends: decode time and peak RSS
+
+Each backend runs in a fresh process so peak RSS is not polluted by the others.
+
+    cd backend
+    python benchmarks/bench_decode.py                      # synthetic 24 MP JPEG
+    python benchmarks/bench_decode.py photo1.jpg photo2.png --repeat 10 --json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from selic_decode import available_backends, get_decode_backend
+from selic_processor import SELICProcessor
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def synthetic_jpeg(megapixels: float, path: str) -> None:
+    """Write a camera-like JPEG: smooth gradients plus sensor-style noise"""
+    width = int((megapixels * 1e6 * 1.5) ** 0.5)
+    height = int(width / 1.5)
+    rng = np.random.default_rng(0)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    base = np.stack(np.broadcast_arrays(180 * x + 40 * y, 120 + 60 * np.sin(6 * x + 3 * y), 200 * y), axis=2)
+    noise = rng.normal(0, 8, size=(height, width, 1)).astype(np.float32)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(path, format="JPEG", quality=92)
+
+
+def _run_backend(backend_name: str, path: str, repeat: int, queue) -> None:
+    with open(path, "rb") as f:
+        image_data = f.read()
+    decoder = get_decode_backend(backend_name)
+    processor = SELICProcessor()
+    baseline_rss = _peak_rss_mb()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        image, _ = decoder.decode_for_analysis(image_data)
+        processor.prepare_analysis_array(image)
+        timings.append((time.perf_counter() - start) * 1000)
+        del image
+
+    queue.put({
+        "backend": backend_name,
+        "input": os.path.basename(path),
+        "decode_ms_median": round(statistics.median(timings), 2),
+        "decode_ms_min": round(min(timings), 2),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "rss_growth_mb": round(_peak_rss_mb() - baseline_rss, 1),
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Input images (default: synthetic JPEG)")
+    parser.add_argument("--megapixels", type=float, default=24.0, help="Size of the synthetic JPEG")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per result")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    paths = list(args.images)
+    tmp_dir = None
+    if not paths:
+        tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp_dir.name, f"synthetic_{args.megapixels:g}mp.jpg")
+        # Generate in a child: peak RSS survives fork/exec, so the parent must stay small
+        proc = ctx.Process(target=synthetic_jpeg, args=(args.megapixels, path))
+        proc.start()
+        proc.join()
+        paths.append(path)
+
+    results = []
+    for path in paths:
+        for backend_name, available in available_backends().items():
+            if not available:
+                continue
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_run_backend, args=(backend_name, path, args.repeat, queue))
+            proc.start()
+            results.append(queue.get())
+            proc.join()
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(f"{'input':<28} {'backend':<10} {'median ms':>10} {'min ms':>8} {'peak RSS MB':>12} {'RSS growth MB':>14}")
+        for r in results:
+            print(f"{r['input']:<28} {r['backend']:<10} {r['decode_ms_median']:>10} {r['decode_ms_min']:>8} "
+                  f"{r['peak_rss_mb']:>12} {r['rss_growth_mb']:>14}")
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
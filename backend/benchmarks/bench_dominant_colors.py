@@ -0,0 +1,101 @@
+"""
+Benchmark dominant color extraction on 224x224 analysis arrays
+
+Compares the original np.unique(axis=0) approach with the quantized histogram and
+the optional mini-batch k-means mode.
+
+    cd backend
+    python benchmarks/bench_dominant_colors.py --repeat 50 --json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from selic_processor import SELICProcessor
+
+
+def unique_rows_colors(img_array: np.ndarray, n_colors: int = 5):
+    """The original implementation: lexicographic row sort over every pixel"""
+    pixels = img_array.reshape(-1, 3)
+    unique_colors, counts = np.unique(pixels, axis=0, return_counts=True)
+    sorted_indices = np.argsort(counts)[::-1]
+    return [color.tolist() for color in unique_colors[sorted_indices[:n_colors]]]
+
+
+def synthetic_arrays():
+    """224x224 RGB arrays covering natural-photo-like and flat-graphic content"""
+    rng = np.random.default_rng(0)
+    y = np.linspace(0, 1, 224)[:, None]
+    x = np.linspace(0, 1, 224)[None, :]
+
+    # Sky over grass with sensor noise
+    photo = np.zeros((224, 224, 3))
+    photo[:112] = [90, 150, 220]
+    photo[112:] = [70, 140, 60]
+    photo += 25 * np.stack(np.broadcast_arrays(x, y, x * y), axis=2)
+    photo += rng.normal(0, 6, size=photo.shape)
+
+    # Flat graphic with three solid colors
+    graphic = np.full((224, 224, 3), 245.0)
+    graphic[40:180, 40:120] = [220, 40, 40]
+    graphic[100:200, 130:210] = [30, 60, 200]
+
+    noise = rng.uniform(0, 255, size=(224, 224, 3))
+
+    return {
+        "photo": np.clip(photo, 0, 255).astype(np.uint8),
+        "graphic": graphic.astype(np.uint8),
+        "noise": noise.astype(np.uint8),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per result")
+    args = parser.parse_args()
+
+    methods = {
+        "unique": unique_rows_colors,
+        "histogram": SELICProcessor(dominant_color_method="histogram")._extract_dominant_colors,
+    }
+    try:
+        methods["kmeans"] = SELICProcessor(dominant_color_method="kmeans")._extract_dominant_colors
+    except RuntimeError as e:
+        print(f"Skipping kmeans: {e}", file=sys.stderr)
+
+    results = []
+    for content, img_array in synthetic_arrays().items():
+        for method, extract in methods.items():
+            extract(img_array)  # warm-up
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                colors = extract(img_array)
+                timings.append((time.perf_counter() - start) * 1e6)
+            results.append({
+                "content": content,
+                "method": method,
+                "median_us": round(statistics.median(timings), 1),
+                "colors": colors,
+            })
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(f"{'content':<8} {'method':<10} {'median us':>10}  top colors")
+        for r in results:
+            print(f"{r['content']:<8} {r['method']:<10} {r['median_us']:>10}  {r['colors'][:3]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark peak memory of the full-resolution preprocessing + encode path
+
+Each (size, path, stage) case runs in a fresh process on the `subject` image (see
+bench_regions) saved as JPEG. The decode happens before the RSS baseline, so `rss_growth_mb`
+is the memory preprocessing and encoding add on top of the decoded frame, and
+`growth_bytes_per_pixel` is what selic_admission's COMPRESS_BYTES_PER_PIXEL has to cover in
+addition to the decode itself. The paths force the branches of _preprocess_image that the
+synthetic bench_stages corpus does not reach:
+
+    plain        standard level, region-aware smoothing off
+    high         sharpen + contrast ("high" optimization level)
+    region       region-aware background smoothing
+    high+region  both
+
+    cd backend
+    python benchmarks/bench_memory.py --sizes 12,40 --json
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from bench_regions import subject_pixels
+from bench_stages import _peak_rss_mb
+from selic_processor import CompressionSettings, SELICProcessor
+
+PATHS = {
+    "plain": ("standard", False),
+    "high": ("high", False),
+    "region": ("standard", True),
+    "high+region": ("high", True),
+}
+STAGES = ("preprocess", "compress")
+
+
+def write_input(path: str, megapixels: float) -> None:
+    Image.fromarray(subject_pixels(megapixels)).save(path, format="JPEG", quality=92)
+
+
+def _run_case(path: str, name: str, stage: str, fmt: str, queue) -> None:
+    """Measure one case (runs in a fresh process)"""
+    level, region_aware = PATHS[name]
+    processor = SELICProcessor(region_aware=region_aware, quality_metric=False)
+    settings = CompressionSettings(
+        quality=85, format=fmt, optimization_level=level,
+        bit_allocation={"semantic_regions": 1.4}, priority_regions=[]
+    )
+    with open(path, "rb") as f:
+        image = Image.open(io.BytesIO(f.read()))
+        image.load()
+
+    baseline_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    if stage == "preprocess":
+        result = processor._preprocess_image(image, settings)
+    else:
+        result = processor.apply_optimized_compression(image, settings)[0]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    growth_mb = _peak_rss_mb() - baseline_rss
+
+    pixels = image.width * image.height
+    queue.put({
+        "input": os.path.basename(path),
+        "megapixels": round(pixels / 1e6, 2),
+        "path": name,
+        "stage": stage,
+        "format": fmt,
+        "ms": round(elapsed_ms, 1),
+        "rss_growth_mb": round(growth_mb, 1),
+        "growth_bytes_per_pixel": round(growth_mb * 1024 * 1024 / pixels, 1),
+        "output_bytes": len(result) if isinstance(result, bytes) else None,
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="12", help="Comma-separated megapixel sizes")
+    parser.add_argument("--paths", default=",".join(PATHS))
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--formats", default="JPEG")
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per result")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for megapixels in (float(size) for size in args.sizes.split(",")):
+            path = os.path.join(tmp_dir, f"subject_{megapixels:g}mp.jpeg")
+            # Generated in a child: peak RSS survives fork/exec, so the parent must stay small
+            proc = ctx.Process(target=write_input, args=(path, megapixels))
+            proc.start()
+            proc.join()
+
+            for name in args.paths.split(","):
+                for stage in args.stages.split(","):
+                    for fmt in (fmt.upper() for fmt in args.formats.split(",")):
+                        queue = ctx.Queue()
+                        proc = ctx.Process(target=_run_case, args=(path, name, stage, fmt, queue))
+                        proc.start()
+                        results.append(queue.get())
+                        proc.join()
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(f"{'input':<20} {'path':<12} {'stage':<10} {'fmt':<5} {'ms':>8} {'RSS growth MB':>13} "
+              f"{'B/pixel':>8} {'out bytes':>10}")
+        for r in results:
+            print(f"{r['input']:<20} {r['path']:<12} {r['stage']:<10} {r['format']:<5} {r['ms']:>8} "
+                  f"{r['rss_growth_mb']:>13} {r['growth_bytes_per_pixel']:>8} {str(r['output_bytes']):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark the analysis micro-batcher: throughput versus added latency
+
+Concurrent clients submit single items to a MicroBatcher in front of a model that runs one
+batch at a time (like a single accelerator). `--model standin` is a local stand-in with a
+fixed per-call overhead plus a per-item cost, the shape BLIP/BERT-style inference has;
+`--model selic` runs the real SELICProcessor.analyze_semantics_batch on 224x224 arrays.
+A window of 0 ms means no batcher: every request calls the model on its own.
+
+    cd backend
+    python benchmarks/bench_microbatch.py --clients 32 --windows 0,1,2,5,10 --json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from selic_batching import MicroBatcher
+from selic_processor import SELICProcessor
+
+
+class StandInModel:
+    """Batch cost = overhead + n * per_item (sleeps, so it releases the GIL like real inference)"""
+
+    def __init__(self, overhead_ms: float, per_item_ms: float):
+        self.overhead_ms = overhead_ms
+        self.per_item_ms = per_item_ms
+
+    def __call__(self, items):
+        time.sleep((self.overhead_ms + self.per_item_ms * len(items)) / 1000)
+        return [float(item.mean()) for item in items]
+
+
+class ProcessorModel:
+    """The real batched analysis path over prepared arrays"""
+
+    def __init__(self):
+        self.processor = SELICProcessor()
+
+    def __call__(self, items):
+        return self.processor.analyze_semantics_batch(items, [(4000, 3000)] * len(items))
+
+
+async def run_case(model, window_ms: float, max_batch: int, clients: int, requests_per_client: int, items):
+    # One batch at a time, as on a single accelerator
+    executor = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+
+    async def run_batch(batch):
+        return await loop.run_in_executor(executor, model, batch)
+
+    batcher = MicroBatcher(run_batch, max_batch_size=max_batch, max_wait_ms=window_ms) if window_ms > 0 else None
+    latencies = []
+
+    async def client(client_id: int):
+        for i in range(requests_per_client):
+            item = items[(client_id + i) % len(items)]
+            start = time.perf_counter()
+            if batcher is not None:
+                await batcher.submit(item)
+            else:
+                await run_batch([item])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(clients)))
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+
+    p50, p99 = np.percentile(latencies, [50, 99])
+    stats = batcher.stats() if batcher is not None else {"mean_batch_size": 1.0}
+    return {
+        "window_ms": window_ms,
+        "max_batch": max_batch if batcher is not None else 1,
+        "clients": clients,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms_p50": round(float(p50), 2),
+        "latency_ms_p99": round(float(p99), 2),
+        "latency_ms_mean": round(statistics.fmean(latencies), 2),
+        "mean_batch_size": stats["mean_batch_size"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=("standin", "selic"), default="standin")
+    parser.add_argument("--overhead-ms", type=float, default=8.0, help="Stand-in model per-call cost")
+    parser.add_argument("--per-item-ms", type=float, default=0.5, help="Stand-in model per-item cost")
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent closed-loop clients")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client")
+    parser.add_argument("--windows", default="0,1,2,5,10", help="Batch windows in ms (0 = no batching)")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per result")
+    args = parser.parse_args()
+
+    if args.model == "standin":
+        model = StandInModel(args.overhead_ms, args.per_item_ms)
+    else:
+        model = ProcessorModel()
+    rng = np.random.default_rng(0)
+    items = [rng.integers(0, 256, size=(224, 224, 3), dtype=np.uint8) for _ in range(64)]
+
+    results = []
+    for window_ms in (float(w) for w in args.windows.split(",")):
+        results.append(asyncio.run(run_case(
+            model, window_ms, args.max_batch, args.clients, args.requests, items
+        )))
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(f"{'window ms':>9} {'max batch':>9} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'mean batch':>10}")
+        for r in results:
+            print(f"{r['window_ms']:>9} {r['max_batch']:>9} {r['throughput_rps']:>8} {r['latency_ms_p50']:>8} "
+                  f"{r['latency_ms_p99']:>8} {r['mean_batch_size']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark region-aware encoding: bytes saved at equal quality in the salient regions
+
+For each synthetic image the same settings are encoded twice, uniformly and with the
+non-salient blocks smoothed first (SELICProcessor._smooth_background). PSNR against the source is
+reported separately over salient blocks (where the region mask keeps full detail) and the
+background. `equal-bytes` re-encodes the uniform image at the highest quality that fits in
+the region-aware size, showing what the salient regions would have lost without region
+awareness. The `subject` image (a detailed subject on a grainy, soft background) is the
+case the pass is for; the bench_stages contents check that it stays out of the way elsewhere.
+
+    cd backend
+    python benchmarks/bench_regions.py --sizes 2,12 --qualities 75,85 --json
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from bench_stages import CONTENTS, synthetic_pixels
+from selic_processor import CompressionSettings, SELICProcessor
+
+
+def subject_pixels(megapixels: float) -> np.ndarray:
+    """Textured elliptical subject over a soft gradient background with sensor-like grain"""
+    width = int((megapixels * 1e6 * 1.5) ** 0.5)
+    height = int(width / 1.5)
+    rng = np.random.default_rng([99, int(megapixels * 1000)])
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+
+    background = np.stack([120 + 60 * x / width, 140 + 40 * y / height, 170 - 50 * x / width], axis=2)
+    background += rng.normal(0, 4, size=(height, width, 3)).astype(np.float32)
+    texture = 128 + (60 * np.sin(x / 3.0) * np.cos(y / 5.0))[..., None]
+    texture = texture + rng.normal(0, 20, size=(height, width, 3)).astype(np.float32)
+
+    inside = ((y - height / 2) / (0.3 * height)) ** 2 + ((x - width / 2) / (0.2 * width)) ** 2 < 1
+    return np.clip(np.where(inside[..., None], texture, background), 0, 255).astype(np.uint8)
+
+
+def psnr(reference: np.ndarray, decoded: np.ndarray, mask: np.ndarray) -> float:
+    if not mask.any():
+        return float("nan")
+    error = (reference.astype(np.float32) - decoded.astype(np.float32)) ** 2
+    mse = float(error[mask].mean())
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def decode(data: bytes) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+def run_case(processor: SELICProcessor, name: str, pixels: np.ndarray, fmt: str, quality: int):
+    image = Image.fromarray(pixels)
+    settings = CompressionSettings(
+        quality=quality, format=fmt, optimization_level="standard",
+        bit_allocation={"semantic_regions": 1.4}, priority_regions=[]
+    )
+
+    start = time.perf_counter()
+    smoothed = processor._smooth_background(image, settings)
+    region_ms = (time.perf_counter() - start) * 1000
+    mask = processor.region_mask(image, settings)
+    salient = np.asarray(mask) == 255 if mask is not None else np.ones(pixels.shape[:2], dtype=bool)
+
+    uniform = processor._encode(image, fmt, quality)
+    region = processor._encode(smoothed, fmt, quality)
+
+    # Highest uniform quality that fits in the region-aware size
+    low, high = 1, quality
+    if mask is None:
+        low = high
+    while low < high:
+        mid = (low + high + 1) // 2
+        if len(processor._encode(image, fmt, mid)) <= len(region):
+            low = mid
+        else:
+            high = mid - 1
+    equal_bytes = processor._encode(image, fmt, low)
+
+    uniform_pixels, region_pixels, equal_pixels = decode(uniform), decode(region), decode(equal_bytes)
+    return {
+        "input": name,
+        "megapixels": round(image.width * image.height / 1e6, 2),
+        "format": fmt,
+        "quality": quality,
+        "salient_fraction": round(float(salient.mean()), 3),
+        "uniform_bytes": len(uniform),
+        "region_bytes": len(region),
+        "bytes_saved_percent": round((1 - len(region) / len(uniform)) * 100, 1),
+        "salient_psnr_uniform": round(psnr(pixels, uniform_pixels, salient), 2),
+        "salient_psnr_region": round(psnr(pixels, region_pixels, salient), 2),
+        "background_psnr_uniform": round(psnr(pixels, uniform_pixels, ~salient), 2),
+        "background_psnr_region": round(psnr(pixels, region_pixels, ~salient), 2),
+        "equal_bytes_quality": low,
+        "salient_psnr_equal_bytes": round(psnr(pixels, equal_pixels, salient), 2),
+        "region_pass_ms": round(region_ms, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="2", help="Comma-separated megapixel sizes")
+    parser.add_argument("--contents", default=",".join(("subject",) + CONTENTS))
+    parser.add_argument("--formats", default="JPEG,WEBP")
+    parser.add_argument("--qualities", default="85")
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per result")
+    args = parser.parse_args()
+
+    processor = SELICProcessor()
+    results = []
+    for megapixels in (float(size) for size in args.sizes.split(",")):
+        for content in args.contents.split(","):
+            if content == "subject":
+                pixels = subject_pixels(megapixels)
+            else:
+                pixels = synthetic_pixels(content, megapixels)
+            for fmt in (fmt.upper() for fmt in args.formats.split(",")):
+                for quality in (int(q) for q in args.qualities.split(",")):
+                    results.append(run_case(processor, f"{content}_{megapixels:g}mp", pixels, fmt, quality))
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(f"{'input':<16} {'fmt':<5} {'q':>3} {'salient':>7} {'uniform B':>10} {'region B':>10} {'saved':>7} "
+              f"{'sal PSNR u/r':>13} {'bg PSNR u/r':>13} {'eq-bytes q':>10} {'sal PSNR eq':>11} {'pass ms':>8}")
+        for r in results:
+            print(f"{r['input']:<16} {r['format']:<5} {r['quality']:>3} {r['salient_fraction']:>7} "
+                  f"{r['uniform_bytes']:>10} {r['region_bytes']:>10} {r['bytes_saved_percent']:>6}% "
+                  f"{r['salient_psnr_uniform']:>6}/{r['salient_psnr_region']:<6} "
+                  f"{r['background_psnr_uniform']:>6}/{r['background_psnr_region']:<6} "
+                  f"{r['equal_bytes_quality']:>10} {r['salient_psnr_equal_bytes']:>11} {r['region_pass_ms']:>8}")
+
+
+if __name__ == "__main__":
+    main()
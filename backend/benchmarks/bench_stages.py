@@ -0,0 +1,227 @@
+"""
+Benchmark SELICProcessor stages over a deterministic synthetic corpus
+
+The corpus crosses content (gradient, noise, text-like edges, flat graphic), size in
+megapixels and input format (JPEG / PNG / WEBP). Every (image, stage) pair runs in a fresh
+process: prerequisites (decode, analysis, settings) are computed first, then the stage is
+timed, so `rss_growth_mb` is the peak memory that stage adds on top of its inputs.
+
+    cd backend
+    python benchmarks/bench_stages.py --sizes 0.3,2,12,48 --repeat 5 --json > run.jsonl
+    python benchmarks/bench_stages.py --compare run.jsonl      # median deltas against a saved run
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from selic_processor import SELICProcessor
+
+CONTENTS = ("gradient", "noise", "text", "flat")
+FORMATS = ("JPEG", "PNG", "WEBP")
+STAGES = ("decode", "analyze_semantics", "optimize_compression", "preprocess", "compress")
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def synthetic_pixels(content: str, megapixels: float) -> np.ndarray:
+    """Deterministic 3:2 RGB test image (seeded by content and size)"""
+    width = int((megapixels * 1e6 * 1.5) ** 0.5)
+    height = int(width / 1.5)
+    rng = np.random.default_rng([CONTENTS.index(content), int(megapixels * 1000)])
+
+    if content == "gradient":
+        x = np.linspace(0, 255, width, dtype=np.float32).astype(np.uint8)[None, :]
+        y = np.linspace(0, 255, height, dtype=np.float32).astype(np.uint8)[:, None]
+        diagonal = ((x.astype(np.uint16) + y) // 2).astype(np.uint8)
+        return np.ascontiguousarray(np.stack(np.broadcast_arrays(x, y, diagonal), axis=2))
+
+    if content == "noise":
+        return rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+    if content == "text":
+        # Dark glyph-like strokes in lines on a light page, built on one tile and repeated
+        tile = np.full((96, 512), 245, dtype=np.uint8)
+        for line_top in range(8, 96 - 24, 32):
+            x = 8
+            while x < 500:
+                glyph_width = int(rng.integers(3, 10))
+                glyph_height = int(rng.integers(10, 20))
+                tile[line_top + 20 - glyph_height:line_top + 20, x:x + glyph_width] = 20
+                x += glyph_width + int(rng.integers(2, 12))
+        page = np.tile(tile, (height // 96 + 1, width // 512 + 1))[:height, :width]
+        return np.repeat(page[:, :, None], 3, axis=2)
+
+    # flat: solid shapes on a plain background
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[:] = (240, 236, 228)
+    pixels[height // 6:height * 4 // 5, width // 6:width // 2] = (220, 40, 40)
+    pixels[height // 2:height * 9 // 10, width * 3 // 5:width * 9 // 10] = (30, 60, 200)
+    pixels[height // 10:height // 3, width * 5 // 8:width * 7 // 8] = (250, 200, 30)
+    return pixels
+
+
+def write_corpus(corpus_dir: str, sizes, contents, formats) -> None:
+    """Generate every (content, size, format) file that is not already present"""
+    for megapixels in sizes:
+        for content in contents:
+            pending = [fmt for fmt in formats if not os.path.exists(corpus_path(corpus_dir, content, megapixels, fmt))]
+            if not pending:
+                continue
+            image = Image.fromarray(synthetic_pixels(content, megapixels))
+            for fmt in pending:
+                save_options = {"JPEG": {"quality": 92}, "WEBP": {"quality": 90}, "PNG": {}}[fmt]
+                image.save(corpus_path(corpus_dir, content, megapixels, fmt), format=fmt, **save_options)
+
+
+def corpus_path(corpus_dir: str, content: str, megapixels: float, fmt: str) -> str:
+    return os.path.join(corpus_dir, f"{content}_{megapixels:g}mp.{fmt.lower()}")
+
+
+def _run_stage(path: str, stage: str, repeat: int, queue) -> None:
+    """Time one stage on one corpus file (runs in a fresh process)"""
+    with open(path, "rb") as f:
+        image_data = f.read()
+    # The compress stage is preprocessing + encode; MS-SSIM scoring is left out as before
+    processor = SELICProcessor(quality_metric=False)
+
+    def decode():
+        image = Image.open(io.BytesIO(image_data))
+        image.load()
+        return image
+
+    # Prerequisites for the stage under test, computed before the RSS baseline
+    image = decode()
+    semantics = processor.analyze_semantics(image) if stage != "decode" else None
+    settings = processor.optimize_compression(image, semantics) if semantics is not None else None
+
+    run = {
+        "decode": decode,
+        "analyze_semantics": lambda: processor.analyze_semantics(image),
+        "optimize_compression": lambda: processor.optimize_compression(image, semantics),
+        "preprocess": lambda: processor._preprocess_image(image, settings),
+        "compress": lambda: processor.apply_optimized_compression(image, settings)[0],
+    }[stage]
+
+    baseline_rss = _peak_rss_mb()
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        timings.append((time.perf_counter() - start) * 1000)
+        if stage != "compress":
+            result = None
+
+    megapixels = image.width * image.height / 1e6
+    p50, p90, p99 = np.percentile(timings, [50, 90, 99])
+    queue.put({
+        "input": os.path.basename(path),
+        "format": image.format,
+        "megapixels": round(megapixels, 2),
+        "stage": stage,
+        "ms_p50": round(float(p50), 2),
+        "ms_p90": round(float(p90), 2),
+        "ms_p99": round(float(p99), 2),
+        "mp_per_s": round(megapixels / (float(p50) / 1000), 1),
+        "input_bytes": len(image_data),
+        "output_bytes": len(result) if isinstance(result, bytes) else None,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "rss_growth_mb": round(_peak_rss_mb() - baseline_rss, 1),
+    })
+
+
+def print_comparison(results, baseline_path: str) -> None:
+    """Median latency and output size deltas against a previous --json run"""
+    with open(baseline_path) as f:
+        baseline = {(r["input"], r["stage"]): r for r in (json.loads(line) for line in f if line.strip())}
+
+    print(f"{'input':<24} {'stage':<22} {'p50 ms':>9} {'before':>9} {'delta':>8} {'out bytes delta':>16}")
+    for r in results:
+        before = baseline.get((r["input"], r["stage"]))
+        if before is None:
+            continue
+        delta = (r["ms_p50"] - before["ms_p50"]) / before["ms_p50"] * 100 if before["ms_p50"] else 0.0
+        bytes_delta = ""
+        if r["output_bytes"] is not None and before.get("output_bytes"):
+            bytes_delta = f"{(r['output_bytes'] - before['output_bytes']) / before['output_bytes'] * 100:+.1f}%"
+        print(f"{r['input']:<24} {r['stage']:<22} {r['ms_p50']:>9} {before['ms_p50']:>9} "
+              f"{delta:>+7.1f}% {bytes_delta:>16}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="0.3,2,12", help="Comma-separated megapixel sizes (up to 48)")
+    parser.add_argument("--contents", default=",".join(CONTENTS))
+    parser.add_argument("--formats", default=",".join(FORMATS))
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--corpus-dir", help="Keep the generated corpus here and reuse it across runs")
+    parser.add_argument("--compare", metavar="RUN_JSONL", help="Print deltas against a previous --json run")
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per result")
+    args = parser.parse_args()
+
+    sizes = [float(size) for size in args.sizes.split(",")]
+    contents = args.contents.split(",")
+    formats = [fmt.upper() for fmt in args.formats.split(",")]
+    stages = args.stages.split(",")
+
+    ctx = multiprocessing.get_context("spawn")
+    tmp_dir = None
+    corpus_dir = args.corpus_dir
+    if corpus_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        corpus_dir = tmp_dir.name
+    os.makedirs(corpus_dir, exist_ok=True)
+
+    # Generate in a child: peak RSS survives fork/exec, so the parent must stay small
+    proc = ctx.Process(target=write_corpus, args=(corpus_dir, sizes, contents, formats))
+    proc.start()
+    proc.join()
+
+    results = []
+    for megapixels in sizes:
+        for content in contents:
+            for fmt in formats:
+                path = corpus_path(corpus_dir, content, megapixels, fmt)
+                for stage in stages:
+                    queue = ctx.Queue()
+                    proc = ctx.Process(target=_run_stage, args=(path, stage, args.repeat, queue))
+                    proc.start()
+                    results.append(queue.get())
+                    proc.join()
+
+    if args.compare:
+        print_comparison(results, args.compare)
+    elif args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(f"{'input':<24} {'stage':<22} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'MP/s':>7} "
+              f"{'out bytes':>10} {'RSS growth MB':>14}")
+        for r in results:
+            output_bytes = r["output_bytes"] if r["output_bytes"] is not None else "-"
+            print(f"{r['input']:<24} {r['stage']:<22} {r['ms_p50']:>9} {r['ms_p90']:>9} {r['ms_p99']:>9} "
+                  f"{r['mp_per_s']:>7} {output_bytes:>10} {r['rss_growth_mb']:>14}")
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark peak memory of compress_task in memory versus in strips
+
+Inputs are panoramas: the `subject` image (see bench_regions) at 12 MP, repeated side by side
+`--widths` times and saved as JPEG. Each (input, cap) case runs the whole of compress_task -
+decode, "high" sharpen/contrast, region-aware smoothing, encode and MS-SSIM - in a fresh
+process, with the RSS baseline taken before the decode. Cap 0 is the in-memory path; any other
+cap sets SELIC_STRIP_MEMORY_BYTES, so `rss_growth_mb` should stay under it (plus the encoded
+output) whatever the input size. `max_diff` compares the strip output's decoded pixels with the
+in-memory output's.
+
+    cd backend
+    python benchmarks/bench_strips.py --widths 1,4,8 --caps 0,64,256 --json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from bench_regions import subject_pixels
+from bench_stages import _peak_rss_mb
+
+TILE_MEGAPIXELS = 12
+SETTINGS = dict(quality=85, format="JPEG", optimization_level="high",
+                bit_allocation={"semantic_regions": 1.4}, priority_regions=[])
+
+
+def write_input(path: str, tiles: int) -> None:
+    tile = Image.fromarray(subject_pixels(TILE_MEGAPIXELS))
+    panorama = Image.new("RGB", (tile.width * tiles, tile.height))
+    for i in range(tiles):
+        panorama.paste(tile, (i * tile.width, 0))
+    panorama.save(path, format="JPEG", quality=92)
+
+
+def _run_case(path: str, cap_mb: int, output_path: str, queue) -> None:
+    """Measure one case (runs in a fresh process)"""
+    from selic_processor import CompressionSettings, SELICProcessor
+    from selic_workers import compress_task, _worker_state
+
+    _worker_state.processor = SELICProcessor(strip_memory_bytes=cap_mb * 1024 * 1024)
+    settings = CompressionSettings(**SETTINGS)
+    with Image.open(path) as header:
+        pixels = header.width * header.height
+        strips = _worker_state.processor.use_strips(header, settings)
+
+    baseline_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    output, perceptual = compress_task(path, settings)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    growth_mb = _peak_rss_mb() - baseline_rss
+    with open(output_path, "wb") as f:
+        f.write(output)
+
+    queue.put({
+        "input": os.path.basename(path),
+        "megapixels": round(pixels / 1e6, 1),
+        "cap_mb": cap_mb,
+        "strips": strips,
+        "ms": round(elapsed_ms, 1),
+        "rss_growth_mb": round(growth_mb, 1),
+        "output_bytes": len(output),
+        "ms_ssim": perceptual.ms_ssim if perceptual else None,
+        "max_diff": None,
+    })
+
+
+def _max_diff(path: str, reference_path: str, queue) -> None:
+    """Largest per-channel difference between two decoded outputs (runs in a fresh process)"""
+    with Image.open(path) as a, Image.open(reference_path) as b:
+        a.load()
+        b.load()
+        worst = 0
+        for top in range(0, a.height, 512):
+            box = (0, top, a.width, min(a.height, top + 512))
+            diff = np.abs(np.asarray(a.crop(box), dtype=np.int16) - np.asarray(b.crop(box), dtype=np.int16))
+            worst = max(worst, int(diff.max()))
+    queue.put(worst)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--widths", default="1,4", help=f"Comma-separated panorama widths, in {TILE_MEGAPIXELS} MP tiles")
+    parser.add_argument("--caps", default="0,64,256", help="Comma-separated SELIC_STRIP_MEMORY_BYTES caps in MB (0 = off)")
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per result")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for tiles in (int(width) for width in args.widths.split(",")):
+            path = os.path.join(tmp_dir, f"panorama_{tiles}x.jpeg")
+            # Generated in a child: peak RSS survives fork/exec, so the parent must stay small
+            proc = ctx.Process(target=write_input, args=(path, tiles))
+            proc.start()
+            proc.join()
+
+            reference = None
+            for cap_mb in (int(cap) for cap in args.caps.split(",")):
+                output_path = os.path.join(tmp_dir, f"out_{tiles}x_{cap_mb}.jpeg")
+                queue = ctx.Queue()
+                proc = ctx.Process(target=_run_case, args=(path, cap_mb, output_path, queue))
+                proc.start()
+                result = queue.get()
+                proc.join()
+                if cap_mb == 0:
+                    reference = output_path
+                elif reference is not None:
+                    proc = ctx.Process(target=_max_diff, args=(output_path, reference, queue))
+                    proc.start()
+                    result["max_diff"] = queue.get()
+                    proc.join()
+                results.append(result)
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(f"{'input':<20} {'MP':>6} {'cap MB':>7} {'strips':>7} {'ms':>9} {'RSS growth MB':>14} "
+              f"{'out bytes':>11} {'MS-SSIM':>8} {'max diff':>9}")
+        for r in results:
+            print(f"{r['input']:<20} {r['megapixels']:>6} {r['cap_mb']:>7} {str(r['strips']):>7} {r['ms']:>9} "
+                  f"{r['rss_growth_mb']:>14} {r['output_bytes']:>11} {str(r['ms_ssim']):>8} "
+                  f"{str(r['max_diff']):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark moving task results and arguments between the service and process workers
+
+Compares a process WorkerPool returning results through the executor's pipe (pickled) with one
+passing them through selic_transport files. Two shapes:
+
+    output   the worker returns an encoded image of `size` MB (service <- worker)
+    arrays   the service sends a micro-batch of 224x224x3 analysis arrays (service -> worker)
+
+Reports per-call latency and, from the event loop's point of view, how long the service was
+busy (CPU time of the service process per call) - the part that competes with other requests.
+
+    cd backend
+    python benchmarks/bench_transport.py --sizes 0.5,4,16 --json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from selic_workers import WorkerPool
+
+_payloads = {}
+
+
+def output_task(size: int) -> bytes:
+    """Return `size` bytes (generated once per worker, so the timing is the handoff)"""
+    if size not in _payloads:
+        _payloads[size] = np.random.default_rng(size).integers(0, 256, size, dtype=np.uint8).tobytes()
+    return _payloads[size]
+
+
+def arrays_task(arrays):
+    return len(arrays)
+
+
+async def _measure(pool: WorkerPool, fn, args, repeat: int):
+    await pool.run(fn, *args)  # warm up the worker
+    latencies, cpu = [], []
+    for _ in range(repeat):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        await pool.run(fn, *args)
+        latencies.append(time.perf_counter() - start)
+        cpu.append(time.process_time() - start_cpu)
+    return statistics.median(latencies) * 1000, statistics.median(cpu) * 1000
+
+
+async def run_cases(sizes, batch: int, repeat: int, transport_dir: str):
+    results = []
+    pools = {
+        "pickle": WorkerPool(max_workers=1, kind="process"),
+        "transport": WorkerPool(max_workers=1, kind="process", transport_dir=transport_dir),
+    }
+    arrays = [np.random.default_rng(i).random((224, 224, 3), dtype=np.float32) for i in range(batch)]
+    cases = [("output", f"{size:g} MB", output_task, (int(size * 1024 * 1024),)) for size in sizes]
+    cases.append(("arrays", f"{batch} x 224x224x3", arrays_task, (arrays,)))
+    try:
+        for pool in pools.values():
+            pool.start()
+        for shape, label, fn, args in cases:
+            for handoff, pool in pools.items():
+                ms, cpu_ms = await _measure(pool, fn, args, repeat)
+                results.append({
+                    "shape": shape,
+                    "payload": label,
+                    "handoff": handoff,
+                    "ms": round(ms, 2),
+                    "service_cpu_ms": round(cpu_ms, 2),
+                })
+        transport = pools["transport"].stats()["transport"]
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+    return results, transport
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="0.5,4,16", help="Comma-separated output sizes in MB")
+    parser.add_argument("--batch", type=int, default=16, help="Analysis arrays per micro-batch")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--dir", default=None, help="Transport directory (default: /dev/shm or temp)")
+    parser.add_argument("--json", action="store_true", help="Emit one JSON object per result")
+    args = parser.parse_args()
+
+    from selic_transport import default_transport_dir
+    transport_dir = args.dir or default_transport_dir()
+    sizes = [float(size) for size in args.sizes.split(",")]
+    results, transport = asyncio.run(run_cases(sizes, args.batch, args.repeat, transport_dir))
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        print(json.dumps({"transport": transport}))
+    else:
+        print(f"{'shape':<8} {'payload':<16} {'handoff':<10} {'ms':>8} {'service CPU ms':>15}")
+        for r in results:
+            print(f"{r['shape']:<8} {r['payload']:<16} {r['handoff']:<10} {r['ms']:>8} {r['service_cpu_ms']:>15}")
+        print(f"transport: live={transport['live']} leaked={transport['leaked']} tasks={transport['tasks']} "
+              f"({transport['directory']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Admission control for the SELIC service
+Requests are costed from the image header (pixels, estimated peak memory) before any decode and
+admitted against global budgets, with a bounded FIFO wait queue and per-client concurrency limits.
+Saturation is reported as a fast 503 with Retry-After instead of running everything at once.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from fastapi import HTTPException, Request
+from PIL import Image
+
+from selic_uploads import SpooledUpload
+
+logger = logging.getLogger(__name__)
+
+# Budgets and limits (SELIC_ADMISSION_* / SELIC_CLIENT_CONCURRENCY)
+MEMORY_BUDGET_BYTES = int(os.getenv("SELIC_ADMISSION_MEMORY_BYTES", str(2 * 1024 * 1024 * 1024)))
+PIXEL_BUDGET = int(os.getenv("SELIC_ADMISSION_PIXELS", str(200_000_000)))
+MAX_QUEUE = int(os.getenv("SELIC_ADMISSION_QUEUE", "64"))
+MAX_WAIT_SECONDS = float(os.getenv("SELIC_ADMISSION_WAIT_S", "30"))
+# Off (0) by default: behind a proxy without SELIC_CLIENT_ID_HEADER every request has the proxy's
+# address, and a per-client limit would cap the whole service
+CLIENT_CONCURRENCY = int(os.getenv("SELIC_CLIENT_CONCURRENCY", "0"))
+# Header identifying the client behind a trusted proxy (e.g. X-Forwarded-For); peer address otherwise
+CLIENT_ID_HEADER = os.getenv("SELIC_CLIENT_ID_HEADER")
+
+# Peak RSS per pixel, measured with benchmarks/bench_memory.py on 12 and 40 MP JPEGs: PIL
+# holds RGB as 4 bytes/pixel for the decode, and preprocessing materializes each full-size
+# frame once (fused sharpen/contrast output, smoothed background and its "L" mask), plus
+# the encoder's buffers: at most ~12.6 B/px on top of the decode. Analysis decodes at most
+# at full size.
+COMPRESS_BYTES_PER_PIXEL = 17
+ANALYSIS_BYTES_PER_PIXEL = 4
+REQUEST_OVERHEAD_BYTES = 8 * 1024 * 1024
+
+
+@dataclass
+class RequestCost:
+    pixels: int
+    memory_bytes: int
+
+
+def estimate_cost(upload: SpooledUpload, full_resolution: bool = True) -> RequestCost:
+    """Cost of processing an upload, from its header alone"""
+    bytes_per_pixel = COMPRESS_BYTES_PER_PIXEL if full_resolution else ANALYSIS_BYTES_PER_PIXEL
+    # Extra bands (alpha, CMYK) are carried through decode even though the output is RGB
+    band_factor = max(1.0, Image.getmodebands(upload.mode) / 3) if upload.mode else 1.0
+    return RequestCost(
+        pixels=upload.pixel_count,
+        memory_bytes=int(upload.pixel_count * bytes_per_pixel * band_factor) + REQUEST_OVERHEAD_BYTES
+    )
+
+
+def client_id(request: Request) -> Optional[str]:
+    """Key for per-client concurrency limits"""
+    if CLIENT_ID_HEADER:
+        value = request.headers.get(CLIENT_ID_HEADER)
+        if value:
+            # X-Forwarded-For style lists: the first entry is the original client
+            return value.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+@dataclass
+class _Waiter:
+    cost: RequestCost
+    future: asyncio.Future
+
+
+class AdmissionController:
+    """Pixel and memory budgets shared by all requests, with a FIFO wait queue
+
+    Waiters are admitted strictly in arrival order so a large image cannot be starved by a
+    stream of small ones. A request larger than a whole budget is clamped to it: it runs alone
+    rather than being refused forever. A `client_concurrency` of 0 disables the per-client limit.
+    """
+
+    def __init__(self, memory_budget: int = MEMORY_BUDGET_BYTES, pixel_budget: int = PIXEL_BUDGET,
+                 max_queue: int = MAX_QUEUE, max_wait: float = MAX_WAIT_SECONDS,
+                 client_concurrency: int = CLIENT_CONCURRENCY):
+        self.memory_budget = memory_budget
+        self.pixel_budget = pixel_budget
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.client_concurrency = client_concurrency
+
+        self.memory_in_use = 0
+        self.pixels_in_use = 0
+        self.active = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._per_client: Dict[str, int] = {}
+        # Smoothed time requests hold their admission, for Retry-After
+        self._hold_seconds = 1.0
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.rejected_client_limit = 0
+
+    def _clamp(self, cost: RequestCost) -> RequestCost:
+        return RequestCost(min(cost.pixels, self.pixel_budget), min(cost.memory_bytes, self.memory_budget))
+
+    def _fits(self, cost: RequestCost) -> bool:
+        return (self.memory_in_use + cost.memory_bytes <= self.memory_budget
+                and self.pixels_in_use + cost.pixels <= self.pixel_budget)
+
+    def _take(self, cost: RequestCost) -> None:
+        self.memory_in_use += cost.memory_bytes
+        self.pixels_in_use += cost.pixels
+        self.active += 1
+
+    def _release(self, cost: RequestCost) -> None:
+        self.memory_in_use -= cost.memory_bytes
+        self.pixels_in_use -= cost.pixels
+        self.active -= 1
+        self._drain()
+
+    def _drain(self) -> None:
+        """Wake waiters in order while the head of the queue fits"""
+        while self._waiters:
+            head = self._waiters[0]
+            if head.future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(head.cost):
+                break
+            self._waiters.popleft()
+            self._take(head.cost)
+            head.future.set_result(None)
+
+    def _waiting(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.future.done())
+
+    def retry_after(self) -> int:
+        """Seconds a rejected client should wait: roughly how long the queue ahead takes to drain"""
+        parallel = max(1, self.active)
+        return max(1, math.ceil(self._hold_seconds * (self._waiting() + 1) / parallel))
+
+    def _reject(self, detail: str, status_code: int = 503) -> HTTPException:
+        return HTTPException(
+            status_code=status_code, detail=detail, headers={"Retry-After": str(self.retry_after())}
+        )
+
+    @asynccontextmanager
+    async def admit(self, cost: RequestCost, client_id: Optional[str] = None) -> AsyncIterator[None]:
+        """Hold a share of the budgets for the duration of the block
+
+        Raises HTTPException 429 when the client is at its concurrency limit and 503 when the wait
+        queue is full or the wait times out (both with Retry-After).
+        """
+        if self.client_concurrency <= 0:
+            client_id = None
+        if client_id is not None:
+            if self._per_client.get(client_id, 0) >= self.client_concurrency:
+                self.rejected_client_limit += 1
+                raise self._reject(
+                    f"Too many concurrent requests from this client (limit {self.client_concurrency})",
+                    status_code=429
+                )
+            self._per_client[client_id] = self._per_client.get(client_id, 0) + 1
+
+        cost = self._clamp(cost)
+        self._drain()
+        try:
+            if not self._waiters and self._fits(cost):
+                self._take(cost)
+            else:
+                await self._wait(cost)
+        except BaseException:
+            self._release_client(client_id)
+            raise
+
+        self.admitted += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.perf_counter() - started)
+            self._release(cost)
+            self._release_client(client_id)
+
+    async def _wait(self, cost: RequestCost) -> None:
+        if self._waiting() >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise self._reject("Server busy: admission queue is full")
+
+        waiter = _Waiter(cost, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                # Admitted just as the timeout fired; keep the slot
+                return
+            waiter.future.cancel()
+            self._drain()
+            self.rejected_timeout += 1
+            raise self._reject(f"Server busy: not admitted within {self.max_wait:g}s")
+        except BaseException:
+            # Cancelled while queued: hand back the budget if we were admitted in the meantime
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(cost)
+            else:
+                waiter.future.cancel()
+                self._drain()
+            raise
+
+    def _release_client(self, client_id: Optional[str]) -> None:
+        if client_id is None:
+            return
+        remaining = self._per_client.get(client_id, 0) - 1
+        if remaining > 0:
+            self._per_client[client_id] = remaining
+        else:
+            self._per_client.pop(client_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "waiting": self._waiting(),
+            "memory_in_use": self.memory_in_use,
+            "memory_budget": self.memory_budget,
+            "pixels_in_use": self.pixels_in_use,
+            "pixel_budget": self.pixel_budget,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "rejected_client_limit": self.rejected_client_limit,
+        }
@@ -0,0 +1,135 @@
+"""
+Micro-batching scheduler for the SELIC service
+Concurrent single-item requests are held for up to a short window (or until a batch fills),
+run through a batch function once, and the results are fanned back out to each caller
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, Set, TypeVar
+
+from selic_metrics import add_request_timings, record_stage, start_request_timings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass
+class _Pending(Generic[T]):
+    item: T
+    future: asyncio.Future
+    submitted_at: float
+    dispatched_at: Optional[float] = None
+    batch_timings: Dict[str, float] = field(default_factory=dict)
+
+
+class MicroBatcher(Generic[T, R]):
+    """Coalesce `submit()` calls into `run_batch(items)` calls
+
+    A batch is dispatched when `max_batch_size` items are waiting or `max_wait_ms` after the
+    first one arrived, whichever comes first. `run_batch` returns one result per item, in order;
+    an exception instance in that list fails only its own caller.
+    """
+
+    def __init__(self, run_batch: Callable[[List[T]], Awaitable[List[Any]]],
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0, name: str = "batch"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+        self._pending: List[_Pending[T]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.full_batches = 0
+
+    async def submit(self, item: T) -> R:
+        """Queue one item and wait for its result from the next batch"""
+        loop = asyncio.get_running_loop()
+        entry = _Pending(item, loop.create_future(), time.perf_counter())
+        self._pending.append(entry)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._dispatch)
+
+        result = await entry.future
+        # Time spent waiting for the window, plus this caller's view of the shared batch stages
+        record_stage(f"{self.name}_wait", entry.dispatched_at - entry.submitted_at)
+        add_request_timings(entry.batch_timings)
+        return result
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        # Callers that were cancelled while waiting are dropped from the batch
+        batch = [entry for entry in self._pending if not entry.future.done()]
+        self._pending = []
+        if not batch:
+            return
+
+        dispatched_at = time.perf_counter()
+        for entry in batch:
+            entry.dispatched_at = dispatched_at
+
+        self.batches += 1
+        self.items += len(batch)
+        if len(batch) >= self.max_batch_size:
+            self.full_batches += 1
+
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[_Pending[T]]) -> None:
+        # Stages recorded while the batch runs belong to every caller, not to whichever
+        # request's context happened to start the timer
+        timings = start_request_timings()
+        try:
+            results = await self.run_batch([entry.item for entry in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name}: expected {len(batch)} results, got {len(results)}")
+        except Exception as e:
+            logger.error(f"{self.name} of {len(batch)} failed: {e}")
+            for entry in batch:
+                if not entry.future.done():
+                    entry.future.set_exception(e)
+            return
+
+        for entry, result in zip(batch, results):
+            if entry.future.done():
+                continue
+            entry.batch_timings = timings
+            if isinstance(result, BaseException):
+                entry.future.set_exception(result)
+            else:
+                entry.future.set_result(result)
+
+    async def close(self) -> None:
+        """Dispatch anything still waiting and let running batches finish"""
+        if self._pending:
+            self._dispatch()
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "waiting": len(self._pending),
+            "running_batches": len(self._running),
+            "batches": self.batches,
+            "items": self.items,
+            "full_batches": self.full_batches,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,195 @@
+"""
+Content-addressed result cache for the SELIC service
+Bounded in-memory LRU tier with an optional on-disk tier, itself bounded by bytes and pruned
+least recently used first (file mtimes are refreshed on every disk hit)
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A full disk tier is pruned to this fraction of its budget, so pruning (a directory scan) is
+# not repeated on every write
+DISK_PRUNE_TARGET = 0.9
+
+
+def cache_key(digest: str, *parts: str) -> str:
+    """Derive a cache key from a content hash plus extra parts (processor version, settings)"""
+    if not parts:
+        return digest
+    suffix = hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+    return f"{digest}-{suffix}"
+
+
+class ResultCache:
+    """Two-tier cache storing opaque byte values under content-hash keys"""
+
+    def __init__(self, namespace: str, max_entries: int = 256,
+                 max_bytes: int = 256 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 max_disk_bytes: int = 1024 * 1024 * 1024):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = os.path.join(disk_dir, namespace) if disk_dir else None
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        # Disk tier occupancy, kept up to date by writes and re-counted whenever it is pruned
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_size = sum(size for _, _, size in self._disk_entries())
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Look up a value, promoting disk hits into the memory tier"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return value
+
+        value = self._read_disk(key)
+        if value is not None:
+            with self._lock:
+                self.disk_hits += 1
+                self._store_memory(key, value)
+            return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: bytes) -> None:
+        """Store a value in memory and, if configured, on disk"""
+        with self._lock:
+            self._store_memory(key, value)
+        self._write_disk(key, value)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current occupancy"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_bytes": self._disk_size,
+                "disk_evictions": self.disk_evictions,
+            }
+
+    def _store_memory(self, key: str, value: bytes) -> None:
+        # Values larger than the whole budget only go to the disk tier
+        if len(value) > self.max_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+
+        self._entries[key] = value
+        self._size += len(value)
+
+        while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            # Mark the entry as recently used for pruning
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Cache read failed for {self.namespace}/{key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, value: bytes) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so readers never see partial entries
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Cache write failed for {self.namespace}/{key}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+
+        with self._disk_lock:
+            self._disk_size += len(value) - replaced
+            if self._disk_size > self.max_disk_bytes:
+                self._prune_disk()
+
+    def _disk_entries(self) -> List[Tuple[float, str, int]]:
+        """(mtime, path, size) of every file in the disk tier"""
+        entries = []
+        for directory, _, filenames in os.walk(self.disk_dir):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _prune_disk(self) -> None:
+        """Delete least recently used files until the disk tier is back under DISK_PRUNE_TARGET of its budget
+
+        Called with _disk_lock held. Other processes sharing the directory are accounted for by the re-count.
+        """
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, _, size in entries)
+        target = self.max_disk_bytes * DISK_PRUNE_TARGET
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Cache prune failed for {path}: {e}")
+                continue
+            total -= size
+            self.disk_evictions += 1
+        self._disk_size = total
@@ -0,0 +1,124 @@
+"""
+Decode backends for the SELIC analysis path
+Analysis only needs a 224x224 view, so these decode at reduced scale where the codec allows it
+"""
+
+import io
+import logging
+from typing import Dict, Tuple, Union
+
+from PIL import Image
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # opencv-python is optional for the service
+    cv2 = None
+
+logger = logging.getLogger(__name__)
+
+# Matches the analysis resolution used by SELICProcessor
+ANALYSIS_SIZE = (224, 224)
+
+# Backends accept a file path (spooled uploads) or in-memory bytes
+ImageSource = Union[str, bytes]
+
+
+def open_source(source: ImageSource) -> Image.Image:
+    """Lazily open an image from a path or bytes (header parse only)"""
+    return Image.open(source if isinstance(source, str) else io.BytesIO(source))
+
+
+class DecodeBackend:
+    """Full-resolution PIL decode (reference behaviour)"""
+
+    name = "pil"
+
+    def open_full(self, source: ImageSource) -> Image.Image:
+        """Open for encoding; pixels are decoded lazily at full resolution"""
+        return open_source(source)
+
+    def decode_for_analysis(self, source: ImageSource,
+                            target: Tuple[int, int] = ANALYSIS_SIZE) -> Tuple[Image.Image, Tuple[int, int]]:
+        """Return an RGB image at least `target` in size plus the original dimensions"""
+        image = open_source(source)
+        original_size = image.size
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image, original_size
+
+
+class PILDraftBackend(DecodeBackend):
+    """JPEG DCT-domain downscale via Image.draft(), box reduce() for other formats"""
+
+    name = "pil-draft"
+
+    def decode_for_analysis(self, source, target=ANALYSIS_SIZE):
+        image = open_source(source)
+        original_size = image.size
+
+        # For JPEG this makes libjpeg decode at 1/2, 1/4 or 1/8 scale; no-op for other formats
+        image.draft('RGB', target)
+
+        # Formats without draft support still decode fully, but a box reduce is far cheaper
+        # than running LANCZOS over the full frame
+        factor = min(image.size[0] // target[0], image.size[1] // target[1])
+        if factor >= 2:
+            image = image.reduce(factor)
+
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image, original_size
+
+
+class OpenCVReducedBackend(DecodeBackend):
+    """OpenCV IMREAD_REDUCED_COLOR_* decode (reduced-scale IDCT for JPEG)"""
+
+    name = "opencv"
+
+    def __init__(self):
+        if cv2 is None:
+            raise RuntimeError("opencv-python is not installed")
+
+    def decode_for_analysis(self, source, target=ANALYSIS_SIZE):
+        # Header parse only, to report the original dimensions
+        with open_source(source) as header:
+            original_size = header.size
+
+        scale = min(original_size[0] // target[0], original_size[1] // target[1])
+        if scale >= 8:
+            flag = cv2.IMREAD_REDUCED_COLOR_8
+        elif scale >= 4:
+            flag = cv2.IMREAD_REDUCED_COLOR_4
+        elif scale >= 2:
+            flag = cv2.IMREAD_REDUCED_COLOR_2
+        else:
+            flag = cv2.IMREAD_COLOR
+
+        # Ignore EXIF orientation so pixels line up with what PIL decodes
+        flag |= cv2.IMREAD_IGNORE_ORIENTATION
+        if isinstance(source, str):
+            bgr = cv2.imread(source, flag)
+        else:
+            bgr = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flag)
+        if bgr is None:
+            raise ValueError("OpenCV could not decode image")
+        return Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)), original_size
+
+
+DECODE_BACKENDS = {
+    backend.name: backend
+    for backend in (DecodeBackend, PILDraftBackend, OpenCVReducedBackend)
+}
+
+
+def get_decode_backend(name: str) -> DecodeBackend:
+    """Instantiate a decode backend by name"""
+    if name not in DECODE_BACKENDS:
+        raise ValueError(f"Unknown decode backend '{name}' (choose from {', '.join(DECODE_BACKENDS)})")
+    return DECODE_BACKENDS[name]()
+
+
+def available_backends() -> Dict[str, bool]:
+    """Which backends can be used in this environment"""
+    return {name: (name != "opencv" or cv2 is not None) for name in DECODE_BACKENDS}
@@ -0,0 +1,129 @@
+"""
+Near-duplicate index for the SELIC service
+Maps the perceptual hashes of analyzed uploads to their content digests, so burst shots and
+lightly edited re-uploads can reuse an earlier analysis. Lookups within a Hamming distance use a
+multi-index hash table: split into distance + 1 chunks, a hash within that distance of a stored
+one matches it exactly on at least one chunk, so only those candidates are compared.
+The hash is luma-only, so each entry also keeps its upload's mean colour: a candidate must match
+it too, and near-flat images (whose hash bits are noise) are neither stored nor looked up. Entries
+also carry a size class (whatever the analysis reads from the dimensions), which must be equal.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+HASH_BITS = 64
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def color_distance(a: Sequence[float], b: Sequence[float]) -> float:
+    """Largest per-channel difference of two mean colours (bounds the brightness difference too)"""
+    return max(abs(x - y) for x, y in zip(a, b))
+
+
+class NearDuplicateIndex:
+    """Bounded LRU index of 64-bit hashes, searchable within `max_distance` bits
+
+    Each distinct (hash, size class) keeps the digest and mean colour (R, G, B in 0-1) it was last
+    added with; a match must have the same size class and be within `max_color_distance` on every
+    channel. Hashes of images whose luma
+    spread is below `min_spread` are ignored. A `max_entries` of 0 disables the index: nothing is
+    stored and every lookup misses.
+    """
+
+    def __init__(self, max_distance: int = 8, max_entries: int = 16384,
+                 max_color_distance: float = 0.06, min_spread: float = 0.02):
+        if not 0 <= max_distance < HASH_BITS:
+            raise ValueError(f"max_distance must be between 0 and {HASH_BITS - 1}")
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.max_color_distance = max_color_distance
+        self.min_spread = min_spread
+
+        # Chunk (shift, mask) pairs covering all bits, widths differing by at most one
+        chunks = max_distance + 1
+        self._chunks: List[Tuple[int, int]] = []
+        shift = 0
+        for i in range(chunks):
+            width = HASH_BITS // chunks + (1 if i < HASH_BITS % chunks else 0)
+            self._chunks.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables: List[Dict[int, Set[Tuple[int, Hashable]]]] = [{} for _ in self._chunks]
+        self._entries: "OrderedDict[Tuple[int, Hashable], Tuple[str, Tuple[float, ...]]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _keys(self, value: int) -> List[int]:
+        return [(value >> shift) & mask for shift, mask in self._chunks]
+
+    def find(self, value: int, mean_color: Sequence[float], spread: float, size_class: Hashable = None,
+             exclude: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        """Digest and distance of the closest stored hash within max_distance whose mean colour
+        is within max_color_distance and whose size class is equal (ignoring `exclude`); near-flat
+        images never match"""
+        best: Optional[Tuple[str, int]] = None
+        candidates: Set[Tuple[int, Hashable]] = set()
+        if spread >= self.min_spread:
+            for table, key in zip(self._tables, self._keys(value)):
+                candidates.update(table.get(key, ()))
+        for candidate in candidates:
+            if candidate[1] != size_class:
+                continue
+            digest, candidate_color = self._entries[candidate]
+            if digest == exclude or color_distance(mean_color, candidate_color) > self.max_color_distance:
+                continue
+            distance = hamming_distance(value, candidate[0])
+            if distance <= self.max_distance and (best is None or distance < best[1]):
+                best = (digest, distance)
+
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return best
+
+    def add(self, value: int, digest: str, mean_color: Sequence[float], spread: float,
+            size_class: Hashable = None) -> None:
+        if not self.enabled or spread < self.min_spread:
+            return
+        entry_key = (value, size_class)
+        entry = (digest, tuple(mean_color))
+        if entry_key in self._entries:
+            self._entries[entry_key] = entry
+            self._entries.move_to_end(entry_key)
+            return
+        self._entries[entry_key] = entry
+        for table, key in zip(self._tables, self._keys(value)):
+            table.setdefault(key, set()).add(entry_key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, entry_key: Tuple[int, Hashable]) -> None:
+        del self._entries[entry_key]
+        for table, key in zip(self._tables, self._keys(entry_key[0])):
+            bucket = table[key]
+            bucket.discard(entry_key)
+            if not bucket:
+                del table[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "max_distance": self.max_distance,
+            "max_color_distance": self.max_color_distance,
+            "min_spread": self.min_spread,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,266 @@
+"""
+Asynchronous jobs for the SELIC service
+Large images are submitted once and processed in the background, so no HTTP connection is held
+open for the whole pipeline: clients poll the job or follow its progress events. Jobs run a
+bounded number at a time, and finished jobs are kept in a bounded store until their TTL expires.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Limits (SELIC_JOB_*)
+JOB_TTL_SECONDS = float(os.getenv("SELIC_JOB_TTL_S", "600"))
+MAX_JOBS = int(os.getenv("SELIC_MAX_JOBS", "256"))
+JOB_MAX_BYTES = int(os.getenv("SELIC_JOB_MAX_BYTES", str(256 * 1024 * 1024)))
+# Progress streams send a comment this often so proxies do not close an idle connection
+KEEPALIVE_SECONDS = 15.0
+
+JOB_STATES = ("queued", "running", "succeeded", "failed")
+FINISHED_STATES = ("succeeded", "failed")
+
+
+@dataclass
+class JobOutput:
+    """What a finished job returns: the response body (without images) and the image bytes"""
+    payload: Dict[str, Any]
+    data: bytes
+    output_format: str
+    renditions: Optional[List[Tuple[Dict[str, Any], bytes]]] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.data) + sum(len(data) for _, data in self.renditions or [])
+
+
+@dataclass
+class JobEvent:
+    seq: int
+    status: str
+    stage: str
+    progress: float
+    at: float
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        event = {"status": self.status, "stage": self.stage, "progress": self.progress, "at": self.at}
+        if self.error is not None:
+            event["error"] = self.error
+        return event
+
+
+@dataclass
+class Job:
+    id: str
+    created_at: float = field(default_factory=time.time)
+    status: str = "queued"
+    stage: str = "queued"
+    progress: float = 0.0
+    finished_at: Optional[float] = None
+    output: Optional[JobOutput] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    events: List[JobEvent] = field(default_factory=list)
+    _changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    _task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def update(self, stage: str, progress: Optional[float] = None, status: Optional[str] = None,
+               error: Optional[str] = None) -> None:
+        """Record a progress step and wake everyone following the job"""
+        self.stage = stage
+        if progress is not None:
+            self.progress = progress
+        if status is not None:
+            self.status = status
+        self.events.append(JobEvent(
+            len(self.events) + 1, self.status, stage, round(self.progress, 3), time.time(), error
+        ))
+        # Followers wait on the current event; swap in a fresh one for the next step
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        job = {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error is not None:
+            job["error"] = self.error
+        if self.timings:
+            job["timings_ms"] = {stage: round(seconds * 1000, 1) for stage, seconds in self.timings.items()}
+        if self.output is not None:
+            job["result"] = self.output.payload
+        return job
+
+    async def follow(self, after: int = 0) -> AsyncIterator[Optional[JobEvent]]:
+        """Yield events after sequence number `after` until the job finishes
+
+        Yields None after KEEPALIVE_SECONDS without progress, so the caller can keep an idle
+        stream alive.
+        """
+        while True:
+            changed = self._changed
+            while after < len(self.events):
+                after += 1
+                yield self.events[after - 1]
+            if self.finished:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class JobStoreFull(Exception):
+    pass
+
+
+class JobStore:
+    """Bounded, TTL-evicting store of background jobs, running at most `concurrency` at once
+
+    Finished jobs are dropped once their TTL passes, or earlier (oldest first) when the store
+    needs room for a new job or their outputs exceed `max_bytes`. Unfinished jobs are never
+    evicted: when every slot holds one, `submit` raises JobStoreFull.
+    """
+
+    def __init__(self, concurrency: int, max_jobs: int = MAX_JOBS, ttl_seconds: float = JOB_TTL_SECONDS,
+                 max_bytes: int = JOB_MAX_BYTES):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        # Created on first use, in the running event loop
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.bytes_held = 0
+
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.evicted = 0
+        self.rejected_full = 0
+
+    def submit(self, work: Callable[[Job], Awaitable[JobOutput]],
+               cleanup: Optional[Callable[[], None]] = None) -> Job:
+        """Queue `work(job)` in the background; `cleanup` runs when it ends, however it ends"""
+        self._evict(room_for=1)
+        if len(self._jobs) >= self.max_jobs:
+            self.rejected_full += 1
+            raise JobStoreFull(f"{len(self._jobs)} jobs are still running or queued")
+
+        job = Job(id=uuid.uuid4().hex)
+        self._jobs[job.id] = job
+        self.submitted += 1
+        job.update("queued", 0.0)
+        job._task = asyncio.ensure_future(self._run(job, work, cleanup))
+        return job
+
+    async def _run(self, job: Job, work: Callable[[Job], Awaitable[JobOutput]],
+                   cleanup: Optional[Callable[[], None]]) -> None:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self._slots:
+                job.update("started", status="running")
+                output = await work(job)
+            job.output = output
+            job.finished_at = time.time()
+            self.bytes_held += output.size
+            self.succeeded += 1
+            job.update("done", 1.0, status="succeeded")
+            self._evict()
+        except asyncio.CancelledError:
+            self._fail(job, "Job cancelled")
+            raise
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            logger.error(f"Job {job.id} failed: {detail}")
+            self._fail(job, str(detail))
+        finally:
+            if cleanup is not None:
+                cleanup()
+
+    def _fail(self, job: Job, error: str) -> None:
+        job.error = error
+        job.finished_at = time.time()
+        self.failed += 1
+        job.update("failed", status="failed", error=error)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._evict()
+        return self._jobs.get(job_id)
+
+    def remove(self, job_id: str) -> Optional[Job]:
+        """Drop a job, cancelling it if it has not finished"""
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return None
+        if job.finished:
+            self._forget(job)
+        elif job._task is not None:
+            job._task.cancel()
+        return job
+
+    def _forget(self, job: Job) -> None:
+        if job.output is not None:
+            self.bytes_held -= job.output.size
+            # Followers may still hold the job; the bytes are what needs freeing
+            job.output = None
+
+    def _evict(self, room_for: int = 0) -> None:
+        """Drop expired finished jobs, then the oldest finished ones while over the limits"""
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished:
+            over_count = len(self._jobs) + room_for > self.max_jobs
+            over_bytes = self.bytes_held > self.max_bytes
+            if not (over_count or over_bytes or now - job.finished_at > self.ttl_seconds):
+                continue
+            del self._jobs[job.id]
+            self._forget(job)
+            self.evicted += 1
+
+    async def close(self) -> None:
+        """Cancel unfinished jobs (on shutdown)"""
+        tasks = [job._task for job in self._jobs.values() if job._task is not None and not job._task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._slots = None
+
+    def stats(self) -> Dict[str, Any]:
+        counts = {state: 0 for state in JOB_STATES}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return {
+            "jobs": len(self._jobs),
+            "max_jobs": self.max_jobs,
+            "concurrency": self.concurrency,
+            "ttl_seconds": self.ttl_seconds,
+            "bytes_held": self.bytes_held,
+            "max_bytes": self.max_bytes,
+            "by_status": counts,
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "evicted": self.evicted,
+            "rejected_full": self.rejected_full,
+        }
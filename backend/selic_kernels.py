@@ -0,0 +1,240 @@
+"""
+Fused numpy kernels for SELIC semantic analysis and output quality
+One float32 grayscale pass feeds brightness, gradients and complexity, using scratch
+buffers that are reused across calls (one kernel per worker, never shared between threads)
+"""
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# MS-SSIM scale weights (Wang, Simoncelli & Bovik 2003) and the SSIM stabilizers for 8-bit input
+MS_SSIM_WEIGHTS = (0.0448, 0.2856, 0.3001, 0.2363, 0.1333)
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Perceptual hash: the 8x8 lowest DCT frequencies of a 32x32 luma thumbnail (64 bits)
+PHASH_THUMBNAIL = 32
+PHASH_FREQUENCIES = 8
+_PHASH_DCT = np.cos(
+    np.pi * np.outer(np.arange(PHASH_FREQUENCIES), 2 * np.arange(PHASH_THUMBNAIL) + 1) / (2 * PHASH_THUMBNAIL)
+).astype(np.float32)
+
+
+class AnalysisKernel:
+    """Reusable-buffer implementation of the per-image analysis statistics"""
+
+    def __init__(self, histogram_bits: int = 4):
+        self.histogram_bits = histogram_bits
+        self._luma_scratch: Dict[Tuple[int, ...], Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._keys_scratch: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _luma_buffers(self, shape: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        buffers = self._luma_scratch.get(shape)
+        if buffers is None:
+            # Keep only the most recent shape so a one-off large batch is not pinned forever
+            self._luma_scratch.clear()
+            buffers = tuple(np.empty(shape, dtype=np.float32) for _ in range(3))
+            self._luma_scratch[shape] = buffers
+        return buffers
+
+    def luma_statistics(self, img_array: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Brightness and complexity for an (..., H, W, 3) uint8 array
+
+        Same definitions as before (channel mean, np.gradient edge magnitude / 128), computed in
+        float32 in place. Returns arrays shaped like the leading dimensions (0-d for one image).
+        """
+        gray, dx, dy = self._luma_buffers(img_array.shape[:-1])
+
+        self._fill_gray(img_array, gray)
+
+        brightness = gray.mean(axis=(-2, -1)) / 255.0
+
+        self._edge_magnitude(gray, dx, dy)
+
+        complexity = np.clip(dx.mean(axis=(-2, -1)) / 128.0, 0.0, 1.0)
+        return brightness, complexity
+
+    def block_saliency(self, img_array: np.ndarray, block: int,
+                       margins: Tuple[int, int] = (0, 0)) -> np.ndarray:
+        """Mean edge magnitude (same gradient as complexity) over `block` x `block` cells of an RGB image
+
+        Edge cells are padded by repetition. Returns a (ceil(H / block), ceil(W / block)) float32 map.
+        `margins` rows at the top and bottom (a strip's overlap with its neighbours) only feed
+        the gradient and are left out of the cells.
+        """
+        gray, dx, dy = self._luma_buffers(img_array.shape[:-1])
+        self._fill_gray(img_array, gray)
+        self._edge_magnitude(gray, dx, dy)
+
+        dx = dx[margins[0]:dx.shape[0] - margins[1]]
+        height, width = dx.shape
+        padded = np.pad(dx, ((0, -height % block), (0, -width % block)), mode="edge")
+        rows, cols = padded.shape[0] // block, padded.shape[1] // block
+        return padded.reshape(rows, block, cols, block).mean(axis=(1, 3))
+
+    def perceptual_hash(self, img_array: np.ndarray) -> np.ndarray:
+        """64-bit pHash of an (..., H, W, 3) uint8 array, as uint64 shaped like the leading dimensions
+
+        The luma plane is box-averaged to 32x32 (H and W at least 32), its 8x8 lowest DCT
+        frequencies are taken, and each becomes one bit: set when above their median. Small
+        edits, recompression and brightness or contrast changes flip few bits.
+        """
+        gray = self._luma_buffers(img_array.shape[:-1])[0]
+        self._fill_gray(img_array, gray)
+
+        size = PHASH_THUMBNAIL
+        fy, fx = gray.shape[-2] // size, gray.shape[-1] // size
+        cells = gray[..., :fy * size, :fx * size].reshape(gray.shape[:-2] + (size, fy, size, fx))
+        thumbnail = cells.mean(axis=(-3, -1), dtype=np.float32)
+
+        frequencies = (_PHASH_DCT @ thumbnail @ _PHASH_DCT.T).reshape(gray.shape[:-2] + (-1,))
+        bits = frequencies > np.median(frequencies, axis=-1, keepdims=True)
+        return np.packbits(bits, axis=-1).view(">u8")[..., 0].astype(np.uint64)
+
+    def colour_statistics(self, img_array: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Mean R, G, B and luma standard deviation (all 0-1) of an (..., H, W, 3) uint8 array
+
+        What the luma-only perceptual hash cannot see: colour and overall brightness. A spread near
+        zero marks a flat image, whose hash bits are decided by noise. Shaped like the leading
+        dimensions (plus a trailing 3 for the mean colour).
+        """
+        mean_color = img_array.mean(axis=(-3, -2), dtype=np.float32) / 255.0
+        gray = self._luma_buffers(img_array.shape[:-1])[0]
+        self._fill_gray(img_array, gray)
+        spread = gray.std(axis=(-2, -1)) / 255.0
+        return mean_color, spread
+
+    @staticmethod
+    def _fill_gray(img_array: np.ndarray, gray: np.ndarray) -> None:
+        """Grayscale plane, built once: (R + G + B) / 3"""
+        np.add(img_array[..., 0], img_array[..., 1], out=gray, dtype=np.float32)
+        np.add(gray, img_array[..., 2], out=gray)
+        gray *= np.float32(1.0 / 3.0)
+
+    @staticmethod
+    def _edge_magnitude(gray: np.ndarray, dx: np.ndarray, dy: np.ndarray) -> None:
+        """np.gradient edge magnitude of `gray`, written into dx (dy is scratch)"""
+        # np.gradient: central differences inside, one-sided differences on the borders
+        np.subtract(gray[..., :, 2:], gray[..., :, :-2], out=dx[..., :, 1:-1])
+        dx[..., :, 1:-1] *= np.float32(0.5)
+        np.subtract(gray[..., :, 1], gray[..., :, 0], out=dx[..., :, 0])
+        np.subtract(gray[..., :, -1], gray[..., :, -2], out=dx[..., :, -1])
+
+        np.subtract(gray[..., 2:, :], gray[..., :-2, :], out=dy[..., 1:-1, :])
+        dy[..., 1:-1, :] *= np.float32(0.5)
+        np.subtract(gray[..., 1, :], gray[..., 0, :], out=dy[..., 0, :])
+        np.subtract(gray[..., -1, :], gray[..., -2, :], out=dy[..., -1, :])
+
+        # Edge magnitude, accumulated into dx
+        np.multiply(dx, dx, out=dx)
+        np.multiply(dy, dy, out=dy)
+        np.add(dx, dy, out=dx)
+        np.sqrt(dx, out=dx)
+
+    def dominant_colors(self, img_array: np.ndarray, n_colors: int = 5) -> List[List[int]]:
+        """Quantized color histogram: pack each pixel into a `3 * bits` integer key and bincount"""
+        bits = self.histogram_bits
+        pixels = img_array.reshape(-1, 3)
+        n_bins = 1 << (3 * bits)
+
+        keys, channel = self._keys_scratch.get(len(pixels), (None, None))
+        if keys is None:
+            self._keys_scratch.clear()
+            keys = np.empty(len(pixels), dtype=np.intp)
+            channel = np.empty(len(pixels), dtype=np.intp)
+            self._keys_scratch[len(pixels)] = (keys, channel)
+
+        shift = 8 - bits
+        np.right_shift(pixels[:, 0], shift, out=keys, casting="unsafe")
+        keys <<= 2 * bits
+        np.right_shift(pixels[:, 1], shift, out=channel, casting="unsafe")
+        channel <<= bits
+        keys |= channel
+        np.right_shift(pixels[:, 2], shift, out=channel, casting="unsafe")
+        keys |= channel
+
+        counts = np.bincount(keys, minlength=n_bins)
+
+        # Top N non-empty bins by pixel count
+        top = np.argpartition(counts, -n_colors)[-n_colors:]
+        top = top[np.argsort(-counts[top], kind="stable")]
+        top = top[counts[top] > 0]
+
+        # Report the mean color of each bin rather than its corner
+        sums = np.stack([
+            np.bincount(keys, weights=pixels[:, c], minlength=n_bins)[top]
+            for c in range(3)
+        ], axis=1)
+        colors = np.rint(sums / counts[top, None]).astype(int)
+
+        return colors.tolist()
+
+
+def _cell_sums(planes: np.ndarray) -> np.ndarray:
+    """Sums over 4x4 cells of the last two axes (sizes must be multiples of 4)"""
+    rows = planes[..., 0::4, :] + planes[..., 1::4, :]
+    rows += planes[..., 2::4, :]
+    rows += planes[..., 3::4, :]
+    cells = rows[..., 0::4] + rows[..., 1::4]
+    cells += rows[..., 2::4]
+    cells += rows[..., 3::4]
+    return cells
+
+
+def _window_means(cells: np.ndarray) -> np.ndarray:
+    """Means over 8x8 windows at a stride of 4, from 4x4 cell sums"""
+    pairs = cells[..., :, :-1] + cells[..., :, 1:]
+    return (pairs[..., :-1, :] + pairs[..., 1:, :]) * np.float32(1.0 / 64.0)
+
+
+def _ssim_terms(x: np.ndarray, y: np.ndarray, product: np.ndarray) -> Tuple[float, float, float]:
+    """Mean luminance, contrast-structure and SSIM over 8x8 windows (stride 4, as in x264)"""
+    sums = [_cell_sums(x), _cell_sums(y)]
+    for a, b in ((x, x), (y, y), (x, y)):
+        np.multiply(a, b, out=product)
+        sums.append(_cell_sums(product))
+    mean_x, mean_y, mean_xx, mean_yy, mean_xy = (_window_means(cells) for cells in sums)
+
+    mean_x_y = mean_x * mean_y
+    mean_x_sq = mean_x * mean_x
+    mean_y_sq = mean_y * mean_y
+    luminance = (2 * mean_x_y + SSIM_C1) / (mean_x_sq + mean_y_sq + SSIM_C1)
+    contrast_structure = (2 * (mean_xy - mean_x_y) + SSIM_C2) / (
+        (mean_xx - mean_x_sq) + (mean_yy - mean_y_sq) + SSIM_C2
+    )
+    return float(luminance.mean()), float(contrast_structure.mean()), float((luminance * contrast_structure).mean())
+
+
+def ms_ssim(reference: np.ndarray, distorted: np.ndarray) -> Tuple[float, float]:
+    """MS-SSIM and single-scale SSIM of (..., H, W) uint8 luma planes (e.g. a stack of tiles)
+
+    Windows are 8x8 box windows at a stride of 4, computed from 4x4 cell sums, so each scale
+    costs a few passes over the pixels. Scales stop once a plane is smaller than two cells;
+    their weights are renormalized.
+    """
+    x = reference.astype(np.float32)
+    y = distorted.astype(np.float32)
+    scales = 1
+    while scales < len(MS_SSIM_WEIGHTS) and min(x.shape[-2:]) >> scales >= 8:
+        scales += 1
+    weights = np.array(MS_SSIM_WEIGHTS[:scales]) / sum(MS_SSIM_WEIGHTS[:scales])
+
+    score = 1.0
+    ssim = 0.0
+    for scale, weight in enumerate(weights):
+        height, width = x.shape[-2] // 4 * 4, x.shape[-1] // 4 * 4
+        x, y = x[..., :height, :width], y[..., :height, :width]
+        luminance, contrast_structure, scale_ssim = _ssim_terms(x, y, np.empty_like(x))
+        if scale == 0:
+            ssim = scale_ssim
+        if scale == scales - 1:
+            score *= max(luminance * contrast_structure, 0.0) ** weight
+            break
+        score *= max(contrast_structure, 0.0) ** weight
+        # 2x2 average pooling to the next scale
+        x = x[..., :height // 2 * 2, :width // 2 * 2]
+        y = y[..., :height // 2 * 2, :width // 2 * 2]
+        x = (x[..., 0::2, 0::2] + x[..., 1::2, 0::2] + x[..., 0::2, 1::2] + x[..., 1::2, 1::2]) * np.float32(0.25)
+        y = (y[..., 0::2, 0::2] + y[..., 1::2, 0::2] + y[..., 0::2, 1::2] + y[..., 1::2, 1::2]) * np.float32(0.25)
+    return float(score), ssim
@@ -0,0 +1,195 @@
+"""
+Stage timing and Prometheus-format metrics for the SELIC service
+Kept free of FastAPI (and of prometheus_client) so the timing hooks can run inside worker processes
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Seconds; covers sub-millisecond analysis through multi-second WebP encodes
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Worker side: stage durations for the task currently running on this thread
+_collector = threading.local()
+
+# Service side: stage durations for the request currently being handled
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "selic_request_timings", default=None
+)
+
+
+@contextmanager
+def collect_timings() -> Iterator[Dict[str, float]]:
+    """Collect `timed()` stages run on this thread into a dict of seconds"""
+    timings: Dict[str, float] = {}
+    previous = getattr(_collector, "timings", None)
+    _collector.timings = timings
+    try:
+        yield timings
+    finally:
+        _collector.timings = previous
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Add the block's duration to `stage` (repeated stages accumulate); no-op outside collection"""
+    timings = getattr(_collector, "timings", None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts..., count, sum
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            series[bisect.bisect_left(self.buckets, value)] += 1  # index len(buckets) is +Inf
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            label_text = _format_labels(self.label_names, labels)
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.label_names + ("le",), labels + (le,))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative:g}")
+            lines.append(f"{self.name}_count{label_text} {cumulative:g}")
+            lines.append(f"{self.name}_sum{label_text} {series[-1]:.6f}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for labels, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value:g}")
+        return lines
+
+
+def render_samples(name: str, help_text: str, metric_type: str, values: Dict[Tuple[str, ...], float],
+                   label_names: Tuple[str, ...] = ()) -> List[str]:
+    """Render values read at scrape time (queue depth, cache counters) that are tracked elsewhere"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in sorted(values.items()):
+        lines.append(f"{name}{_format_labels(label_names, labels)} {value:g}")
+    return lines
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+# Service-wide metrics
+STAGE_DURATION = Histogram(
+    "selic_stage_duration_seconds", "Time spent per processing stage", ("stage",)
+)
+REQUEST_DURATION = Histogram(
+    "selic_request_duration_seconds", "End-to-end request latency until response headers", ("path",)
+)
+STREAM_EVENT_LATENCY = Histogram(
+    "selic_stream_event_seconds", "Time from request arrival to each streamed /process-image event", ("event",)
+)
+REQUESTS = Counter("selic_requests_total", "Requests handled", ("path", "status"))
+BYTES_IN = Counter("selic_bytes_in_total", "Request body bytes received (from Content-Length)")
+BYTES_OUT = Counter("selic_bytes_out_total", "Response body bytes sent")
+PASSTHROUGH_DECISIONS = Counter(
+    "selic_passthrough_total",
+    "Compressions by pass-through outcome: skipped (upload returned without encoding), "
+    "kept_original (encoded, upload no larger) or encoded",
+    ("outcome",)
+)
+
+
+def start_request_timings() -> Dict[str, float]:
+    """Begin collecting stage timings for the current request context"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def current_request_timings() -> Optional[Dict[str, float]]:
+    """The current request's stage timings, for streamed responses that report them after the headers"""
+    return _request_timings.get()
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Observe a stage duration and add it to the current request's Server-Timing, if any"""
+    STAGE_DURATION.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def record_stages(timings: Dict[str, float]) -> None:
+    for stage, seconds in timings.items():
+        record_stage(stage, seconds)
+
+
+def add_request_timings(timings: Dict[str, float]) -> None:
+    """Add already-observed stages (e.g. a shared batch) to the current request's Server-Timing only"""
+    request_timings = _request_timings.get()
+    if request_timings is not None:
+        for stage, seconds in timings.items():
+            request_timings[stage] = request_timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed_request_stage(stage: str) -> Iterator[None]:
+    """Time a service-side stage (e.g. base64) into the request timings and histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def server_timing_header(timings: Dict[str, float], total_seconds: float) -> str:
+    """Format timings as a Server-Timing header value (durations in milliseconds)"""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
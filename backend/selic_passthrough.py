@@ -0,0 +1,140 @@
+"""
+Pass-through detection for JPEG uploads
+Re-encoding a JPEG at or above the quality it was saved at cannot bring back detail; once its
+entropy coding is already optimized it cannot save bytes either, only spend CPU. The source's
+quality is estimated from its quantization tables against the IJG tables libjpeg scales by
+quality, and together with its chroma sampling, Huffman tables and metadata markers that
+decides from the header alone whether the upload can be returned untouched.
+"""
+
+from dataclasses import dataclass
+from typing import BinaryIO, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, JpegImagePlugin
+
+from selic_processor import CompressionSettings
+
+# IJG (JPEG Annex K) base tables in natural order, as PIL reports `quantization`
+STANDARD_LUMINANCE = (
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+)
+STANDARD_CHROMINANCE = (
+    17, 18, 24, 47, 99, 99, 99, 99,
+    18, 21, 26, 66, 99, 99, 99, 99,
+    24, 26, 56, 99, 99, 99, 99, 99,
+    47, 66, 99, 99, 99, 99, 99, 99,
+) + (99,) * 32
+# Code-length counts of the Annex K Huffman tables that libjpeg writes unless asked to optimize
+# (DC luminance, DC chrominance, AC luminance, AC chrominance)
+STANDARD_HUFFMAN_COUNTS = {
+    (0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0),
+    (0, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0),
+    (0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 125),
+    (0, 2, 1, 2, 4, 4, 3, 4, 7, 5, 4, 4, 0, 1, 2, 119),
+}
+# Tables further than this (mean relative deviation) from every IJG scaling get no estimate
+QUALITY_FIT_TOLERANCE = 0.1
+# Markers a re-encode keeps: JFIF and the Adobe colour transform flag
+KEPT_MARKERS = ("APP0", "APP14")
+# JpegImagePlugin.get_sampling value of the encoder's default (4:2:0), what a re-encode produces
+ENCODER_SAMPLING = 2
+SOURCE_MODES = ("RGB", "L")
+
+
+@dataclass(frozen=True)
+class JpegSource:
+    """What a JPEG upload's header says about how it was encoded"""
+    quality: Optional[int]  # IJG-equivalent quality; None when the tables match no IJG scaling
+    subsampled: bool  # Chroma already at the encoder's 4:2:0 (or no chroma at all)
+    optimized: bool  # Progressive or with its own Huffman tables: no entropy-coding gain left
+    metadata: Tuple[str, ...]  # Markers a re-encode would drop (EXIF, ICC profile, XMP, comments)
+
+
+def ijg_table(base: Tuple[int, ...], quality: int) -> List[int]:
+    """libjpeg's jpeg_set_quality scaling of a base table (baseline-clamped, as PIL encodes)"""
+    scale = 5000 // quality if quality < 50 else 200 - 2 * quality
+    return [min(255, max(1, (value * scale + 50) // 100)) for value in base]
+
+
+# Every IJG scaling of the base tables, one row per quality 1-100 (built once at import)
+_IJG_LUMINANCE = np.array([ijg_table(STANDARD_LUMINANCE, quality) for quality in range(1, 101)], dtype=np.int32)
+_IJG_CHROMINANCE = np.array([ijg_table(STANDARD_CHROMINANCE, quality) for quality in range(1, 101)], dtype=np.int32)
+
+
+def estimate_quality(quantization: dict) -> Optional[int]:
+    """IJG quality whose tables are closest to `quantization` (PIL's table id -> 64 values)
+
+    Ties go to the higher quality, so a borderline source is re-encoded rather than passed
+    through. None if no quality comes within QUALITY_FIT_TOLERANCE.
+    """
+    tables = [(quantization[0], _IJG_LUMINANCE)]
+    if 1 in quantization:
+        tables.append((quantization[1], _IJG_CHROMINANCE))
+    if any(len(table) != 64 for table, _ in tables):
+        return None
+
+    # Summed absolute error and table total per candidate quality
+    error = sum(np.abs(scaled - np.asarray(table, dtype=np.int32)).sum(axis=1) for table, scaled in tables)
+    total = sum(scaled.sum(axis=1) for _, scaled in tables)
+    best = len(error) - 1 - int(np.argmin(error[::-1]))
+    return best + 1 if error[best] <= QUALITY_FIT_TOLERANCE * total[best] else None
+
+
+def _huffman_counts(fp: BinaryIO) -> List[Tuple[int, ...]]:
+    """Code-length counts of every Huffman table defined before the first scan"""
+    fp.seek(2)  # SOI
+    counts = []
+    while True:
+        marker = fp.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+            return counts
+        length = int.from_bytes(fp.read(2), "big")
+        segment = fp.read(length - 2)
+        if marker[1] != 0xC4:
+            continue
+        offset = 0
+        while offset + 17 <= len(segment):
+            table = tuple(segment[offset + 1:offset + 17])
+            counts.append(table)
+            offset += 17 + sum(table)
+
+
+def describe_jpeg(image: Image.Image) -> Optional[JpegSource]:
+    """JpegSource of a lazily opened image (header only), None if it is not an RGB or L JPEG"""
+    if image.format != "JPEG" or image.mode not in SOURCE_MODES:
+        return None
+    progressive = bool(image.info.get("progressive"))
+    optimized = progressive or any(
+        counts not in STANDARD_HUFFMAN_COUNTS for counts in _huffman_counts(image.fp)
+    )
+    return JpegSource(
+        quality=estimate_quality(image.quantization),
+        subsampled=image.mode == "L" or JpegImagePlugin.get_sampling(image) == ENCODER_SAMPLING,
+        optimized=optimized,
+        metadata=tuple(sorted({marker for marker, _ in image.applist if marker not in KEPT_MARKERS}))
+    )
+
+
+def can_substitute(source: Optional[JpegSource], settings: CompressionSettings) -> bool:
+    """Whether the original bytes can stand in for the output: JPEG out, and nothing in them
+    (location, orientation, colour profile) that the output would not carry"""
+    return source is not None and settings.format == "JPEG" and not source.metadata
+
+
+def skips_encode(source: Optional[JpegSource], settings: CompressionSettings) -> bool:
+    """Whether the header alone shows a re-encode at settings.quality could not beat the original"""
+    return (
+        can_substitute(source, settings)
+        and source.quality is not None
+        and source.quality <= settings.quality
+        and source.subsampled
+        and source.optimized
+    )
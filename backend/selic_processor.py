@@ -0,0 +1,1035 @@
+"""
+SELIC processor: semantic analysis and compression stages
+Kept free of FastAPI so it can be loaded inside worker processes
+"""
+
+from PIL import Image, ImageFilter, ImageMode
+import io
+import math
+import time
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+from dataclasses import dataclass
+import logging
+
+from selic_kernels import AnalysisKernel, ms_ssim
+from selic_metrics import timed
+from selic_strips import (
+    FULL_FRAME_BYTES_PER_PIXEL, STRIP_MODES, MappedFrame, StripSaliency, decode_frame, encode_jpeg, map_strips,
+    strip_rows, strips
+)
+
+# For semantic analysis (mock implementation - would use actual models in production)
+# from transformers import BlipProcessor, BlipForConditionalGeneration, BertTokenizer, BertModel
+# import torch
+
+logger = logging.getLogger(__name__)
+
+class SELICProcessingError(Exception):
+    """Raised when a processing stage fails (picklable across worker processes)"""
+
+# Images over this many pixels get a slightly lower quality target
+HIGH_RES_PIXELS = 4000000
+
+
+def size_class(size: Tuple[int, int]) -> Tuple[str, bool]:
+    """What the analysis heuristics read from the dimensions: orientation and whether over HIGH_RES_PIXELS"""
+    orientation = "landscape" if size[0] > size[1] else "portrait" if size[1] > size[0] else "square"
+    return orientation, size[0] * size[1] > HIGH_RES_PIXELS
+
+# Bump whenever analysis or compression heuristics change so cached results are not reused
+PROCESSOR_VERSION = "selic-inspired-8"
+
+@dataclass
+class SemanticAnalysis:
+    description: str
+    confidence: float
+    complexity: float
+    brightness: float
+    dominant_colors: List[List[int]]
+    estimated_quality: float
+    # 64-bit pHash of the analysis array, as 16 hex digits
+    perceptual_hash: Optional[str] = None
+    # Mean R, G, B and luma standard deviation (0-1) of the analysis array, the colour and
+    # flatness the hash cannot see; both must agree before a near-duplicate's analysis is reused
+    mean_color: Optional[List[float]] = None
+    luma_spread: Optional[float] = None
+    # Set by the service when this analysis was reused from a near-duplicate upload (Hamming distance only)
+    near_duplicate: Optional[Dict[str, Any]] = None
+
+@dataclass
+class CompressionSettings:
+    quality: int
+    format: str
+    optimization_level: str
+    bit_allocation: Dict[str, float]
+    priority_regions: List[Dict[str, Any]]
+
+@dataclass
+class RateControlResult:
+    target_bytes: int
+    achieved_bytes: int
+    quality: int
+    target_met: bool
+    iterations: int
+    proxy_iterations: int
+    elapsed_ms: float
+
+@dataclass
+class PerceptualQuality:
+    ms_ssim: float
+    ssim: float  # Finest scale only; more sensitive to block artifacts than MS-SSIM
+
+@dataclass
+class MinQualityResult:
+    target_ms_ssim: float
+    ms_ssim: float
+    ssim: float
+    quality: int
+    target_met: bool
+    iterations: int
+    proxy_iterations: int
+    elapsed_ms: float
+
+@dataclass
+class Rendition:
+    width: int
+    height: int
+    format: str
+    quality: int
+    size: int
+
+# Rate control: quality bounds, encode budgets and the ~1 MP proxy used for trial encodes
+RATE_CONTROL_MIN_QUALITY = 10
+RATE_CONTROL_MAX_QUALITY = 95
+RATE_CONTROL_MAX_ENCODES = 4  # Full-resolution trials
+RATE_CONTROL_PROXY_ENCODES = 6
+RATE_CONTROL_PROXY_PIXELS = 1_000_000
+RATE_CONTROL_TOLERANCE = 0.9  # Accept outputs within 10% under the budget
+RATE_CONTROL_OVERSHOOT = 1.25  # Step multiplier while every trial is on the same side of the budget
+RATE_CONTROL_DEFAULT_SLOPE = 0.04  # Typical d log(size) / d quality before any trials are measured
+
+@dataclass(frozen=True)
+class EffortTier:
+    name: str
+    webp_method: int
+    jpeg_optimize: bool
+    jpeg_progressive: bool
+    preprocess: bool  # Run the sharpening / contrast passes and region smoothing
+    # Rough single-core encode cost used to pick a tier under a deadline (refined per worker)
+    webp_ns_per_pixel: float
+    jpeg_ns_per_pixel: float
+
+# Fastest first; archival is the original encoder configuration
+EFFORT_TIERS = {tier.name: tier for tier in (
+    EffortTier("interactive", webp_method=0, jpeg_optimize=False, jpeg_progressive=False, preprocess=False,
+               webp_ns_per_pixel=55, jpeg_ns_per_pixel=6),
+    EffortTier("standard", webp_method=4, jpeg_optimize=True, jpeg_progressive=False, preprocess=True,
+               webp_ns_per_pixel=190, jpeg_ns_per_pixel=17),
+    EffortTier("archival", webp_method=6, jpeg_optimize=True, jpeg_progressive=True, preprocess=True,
+               webp_ns_per_pixel=560, jpeg_ns_per_pixel=28),
+)}
+DEFAULT_EFFORT = "archival"
+PREPROCESS_NS_PER_PIXEL = 21  # Fused sharpen + contrast pass
+
+# "high" optimization level: ImageEnhance.Sharpness(1.1) then Contrast(1.05), folded into one
+# 3x3 kernel with an offset so the frame is filtered once into a single output buffer
+SHARPEN_FACTOR = 1.1
+CONTRAST_FACTOR = 1.05
+ENHANCE_MODES = ("RGB", "RGBA", "L", "LA")  # Modes the kernel filters band by band
+REGION_NS_PER_PIXEL = 27  # Saliency map + background smoothing, when there is background to smooth
+
+# Region-aware encoding: JPEG and WebP take one quantizer per frame, so bytes are moved toward
+# salient regions by low-passing the rest before the encode. Saliency is the complexity gradient,
+# averaged over blocks of a 4x-reduced copy.
+REGION_BLOCK = 16  # Block size in source pixels
+REGION_SALIENCY_RATIO = 0.5  # Blocks under this fraction of the mean saliency count as background
+REGION_FLAT_SALIENCY = 0.25  # Blocks this smooth (e.g. synthetic flat fills) gain nothing from smoothing
+REGION_MIN_BACKGROUND = 0.05  # Skip the pass unless this fraction of the frame would be smoothed
+REGION_MODES = ("RGB", "RGBA", "L", "LA")  # Modes reduce() and composite() handle directly
+
+# Perceptual quality: MS-SSIM of full-resolution luma over tiles sampled on a grid. Downscaling
+# hides exactly the block artifacts being measured, so pixels are sampled instead. Tiles sit on
+# the 16 px JPEG MCU grid, so a mosaic of them encodes to the same luma as those blocks of the
+# full frame (exactly for JPEG, approximately for WebP); the minimum-quality search encodes that.
+# JPEG outputs are scored the same way: the mosaic re-encoded with the output's quantization
+# tables decodes to the output's luma at those tiles, so the full frame is never decoded.
+QUALITY_TILE = 128
+QUALITY_MAX_TILES = 64
+QUALITY_MOSAIC_COLUMNS = 8
+# Modes scored from a mosaic (RGBX: a strip-mode frame); others decode the whole output
+QUALITY_MOSAIC_MODES = ("RGB", "RGBX", "L")
+MIN_QUALITY_PROXY_ENCODES = 7  # Enough to bisect 10..95 down to one quality step
+MIN_QUALITY_MAX_ENCODES = 3  # Full-resolution encodes
+MIN_QUALITY_STEP = 3  # Quality added when the full frame misses a target its mosaic met
+
+@dataclass
+class EffortReport:
+    requested: str
+    used: str
+    budget_ms: Optional[float]  # Remaining deadline budget when encoding started
+    estimated_ms: float
+    elapsed_ms: float
+    fell_back: bool
+
+class SELICProcessor:
+    """SELIC-inspired image processor"""
+    
+    DOMINANT_COLOR_METHODS = ("histogram", "kmeans")
+    
+    def __init__(self, dominant_color_method: str = "histogram", region_aware: bool = True,
+                 quality_metric: bool = True, strip_memory_bytes: int = 0):
+        self.initialized = False
+        self.region_aware = region_aware
+        # Measure MS-SSIM on every output (measure_quality returns None when disabled)
+        self.quality_metric = quality_metric
+        # Working-memory cap for compress_task; larger images are processed in strips (0 = off)
+        self.strip_memory_bytes = strip_memory_bytes
+        if dominant_color_method not in self.DOMINANT_COLOR_METHODS:
+            raise ValueError(f"Unknown dominant color method: {dominant_color_method}")
+        self.dominant_color_method = dominant_color_method
+        # Scratch buffers are reused across calls, so each worker needs its own processor
+        self.kernel = AnalysisKernel()
+        self._kmeans_cls = None
+        # Measured / estimated encode time per (tier, format), so tier selection adapts to this machine
+        self._effort_scale: Dict[Tuple[str, str], float] = {}
+        if dominant_color_method == "kmeans":
+            # Imported lazily: scikit-learn is slow to load and only needed for this mode
+            try:
+                from sklearn.cluster import MiniBatchKMeans
+            except ImportError:
+                raise RuntimeError("scikit-learn is required for k-means dominant colors")
+            self._kmeans_cls = MiniBatchKMeans
+        # In production, initialize actual ML models here
+        # self.blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
+        # self.blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+        # self.bert_tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+        # self.bert_model = BertModel.from_pretrained('bert-base-uncased')
+        self.initialized = True
+        logger.info("SELIC processor initialized")
+
+    def analyze_semantics(self, image: Image.Image, 
+                          original_size: Optional[Tuple[int, int]] = None) -> SemanticAnalysis:
+        """Extract semantic information from image
+        
+        `image` may be a reduced-scale decode; pass the source dimensions as `original_size`.
+        """
+        try:
+            img_array = self.prepare_analysis_array(image)
+            
+            with timed("analysis"):
+                # Basic image analysis (fused float32 pass)
+                brightness, complexity = self.kernel.luma_statistics(img_array)
+                
+                return self._build_semantics(
+                    img_array, float(brightness), float(complexity), original_size or image.size,
+                    self.image_signature(img_array)
+                )
+            
+        except Exception as e:
+            logger.error(f"Semantic analysis failed: {e}")
+            raise SELICProcessingError(f"Semantic analysis failed: {str(e)}")
+
+    def analyze_semantics_batch(self, img_arrays: List[np.ndarray], 
+                                sizes: List[Tuple[int, int]]) -> List[SemanticAnalysis]:
+        """Analyze many prepared 224x224 arrays, computing brightness/complexity in one numpy pass"""
+        try:
+            with timed("analysis"):
+                # N x 224 x 224 x 3 tensor
+                batch = np.stack(img_arrays)
+                brightness, complexity = self.kernel.luma_statistics(batch)
+                hashes = self.kernel.perceptual_hash(batch)
+                mean_colors, spreads = self.kernel.colour_statistics(batch)
+                
+                return [
+                    self._build_semantics(
+                        img_array, float(brightness[i]), float(complexity[i]), size,
+                        self._signature(hashes[i], mean_colors[i], spreads[i])
+                    )
+                    for i, (img_array, size) in enumerate(zip(img_arrays, sizes))
+                ]
+            
+        except Exception as e:
+            logger.error(f"Batch semantic analysis failed: {e}")
+            raise SELICProcessingError(f"Batch semantic analysis failed: {str(e)}")
+
+    def prepare_analysis_array(self, image: Image.Image) -> np.ndarray:
+        """Convert to RGB and resize to the analysis resolution"""
+        with timed("resize"):
+            # Convert to RGB if necessary
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            
+            # Resize for analysis (standard 224x224 for vision models)
+            analysis_size = (224, 224)
+            img_resized = image.resize(analysis_size, Image.Resampling.LANCZOS)
+            return np.asarray(img_resized)
+
+    def image_signature(self, img_array: np.ndarray) -> Dict[str, Any]:
+        """Near-duplicate lookup fields of a prepared analysis array, keyed as in SemanticAnalysis:
+        the pHash as 16 hex digits, mean colour and luma spread"""
+        mean_color, spread = self.kernel.colour_statistics(img_array)
+        return self._signature(self.kernel.perceptual_hash(img_array), mean_color, spread)
+
+    @staticmethod
+    def _signature(perceptual_hash: np.ndarray, mean_color: np.ndarray, spread: np.ndarray) -> Dict[str, Any]:
+        return {
+            "perceptual_hash": f"{int(perceptual_hash):016x}",
+            "mean_color": [round(float(value), 4) for value in mean_color],
+            "luma_spread": round(float(spread), 4),
+        }
+
+    def _build_semantics(self, img_array: np.ndarray, brightness: float, 
+                         complexity: float, size: tuple,
+                         signature: Optional[Dict[str, Any]] = None) -> SemanticAnalysis:
+        """Assemble SemanticAnalysis from per-image statistics"""
+        dominant_colors = self._extract_dominant_colors(img_array)
+        
+        # Mock semantic description (replace with actual BLIP inference)
+        description = self._generate_mock_description(
+            brightness, complexity, dominant_colors, size
+        )
+        
+        # Estimate optimal compression quality based on analysis
+        estimated_quality = self._calculate_optimal_quality(
+            brightness, complexity, size
+        )
+        
+        return SemanticAnalysis(
+            description=description,
+            confidence=0.85,  # Mock confidence
+            complexity=complexity,
+            brightness=brightness,
+            dominant_colors=dominant_colors,
+            estimated_quality=estimated_quality,
+            **(signature or {})
+        )
+
+    def _extract_dominant_colors(self, img_array: np.ndarray, n_colors: int = 5) -> List[List[int]]:
+        """Extract dominant colors using color quantization"""
+        if self.dominant_color_method == "kmeans":
+            return self._dominant_colors_kmeans(img_array, n_colors)
+        return self.kernel.dominant_colors(img_array, n_colors)
+
+    def _dominant_colors_kmeans(self, img_array: np.ndarray, n_colors: int = 5, 
+                                sample_size: int = 4096) -> List[List[int]]:
+        """Mini-batch k-means over a fixed random subsample of pixels"""
+        pixels = img_array.reshape(-1, 3)
+        rng = np.random.default_rng(0)
+        sample_idx = rng.choice(len(pixels), size=min(sample_size, len(pixels)), replace=False)
+        sample = pixels[sample_idx].astype(np.float32)
+        
+        kmeans = self._kmeans_cls(n_clusters=n_colors, n_init=3, batch_size=1024, random_state=0)
+        labels = kmeans.fit_predict(sample)
+        
+        counts = np.bincount(labels, minlength=n_colors)
+        order = np.argsort(-counts, kind="stable")
+        order = order[counts[order] > 0]
+        colors = np.rint(kmeans.cluster_centers_[order]).clip(0, 255).astype(int)
+        
+        return colors.tolist()
+
+    def _generate_mock_description(self, brightness: float, complexity: float, 
+                                 dominant_colors: List[List[int]], size: tuple) -> str:
+        """Generate mock semantic description (replace with BLIP)"""
+        brightness_term = "bright" if brightness > 0.7 else "medium-lit" if brightness > 0.3 else "dark"
+        complexity_term = "highly detailed" if complexity > 0.4 else "simple"
+        orientation, _ = size_class(size)
+        
+        # Analyze dominant color
+        if dominant_colors:
+            r, g, b = dominant_colors[0]
+            if r > g and r > b:
+                color_term = "red-toned"
+            elif g > r and g > b:
+                color_term = "green-toned"
+            elif b > r and b > g:
+                color_term = "blue-toned"
+            else:
+                color_term = "neutral-toned"
+        else:
+            color_term = "mixed-color"
+        
+        return f"A {brightness_term} {complexity_term} {orientation} {color_term} image"
+
+    def _calculate_optimal_quality(self, brightness: float, complexity: float, size: tuple) -> float:
+        """Calculate optimal compression quality based on image characteristics"""
+        base_quality = 0.85
+        
+        # Adjust for complexity
+        if complexity > 0.4:
+            base_quality += 0.1  # Higher quality for complex images
+        
+        # Adjust for brightness
+        if brightness < 0.3:
+            base_quality += 0.05  # Higher quality for dark images
+        
+        # Adjust for size
+        if size_class(size)[1]:
+            base_quality -= 0.05  # Slightly lower quality for very high-res
+        
+        return min(0.95, max(0.7, base_quality))
+
+    def optimize_compression(self, image: Optional[Image.Image], semantics: SemanticAnalysis) -> CompressionSettings:
+        """Determine optimal compression settings based on semantic analysis
+        
+        The current heuristics only read `semantics`; `image` may be None when analysis ran on
+        prepared arrays.
+        """
+        quality = int(semantics.estimated_quality * 100)
+        
+        # Format selection based on content
+        if semantics.complexity > 0.4:
+            format_type = "JPEG"  # Better for complex, natural images
+        elif len(semantics.dominant_colors) <= 3:
+            format_type = "WEBP"  # Better for simple graphics
+        else:
+            format_type = "JPEG"
+        
+        # Bit allocation strategy (SELIC-inspired)
+        bit_allocation = {
+            "high_frequency": 1.0 + semantics.complexity,
+            "mid_frequency": 1.0,
+            "low_frequency": 1.0 - semantics.complexity * 0.3,
+            "semantic_regions": 1.4  # Extra bits for important regions
+        }
+        
+        # Priority regions (mock - would use attention mechanisms in production)
+        priority_regions = []
+        if "portrait" in semantics.description:
+            priority_regions.append({
+                "region": "center",
+                "weight": 1.5,
+                "reason": "likely subject/face"
+            })
+        
+        optimization_level = "high" if semantics.complexity > 0.3 else "standard"
+        
+        return CompressionSettings(
+            quality=quality,
+            format=format_type,
+            optimization_level=optimization_level,
+            bit_allocation=bit_allocation,
+            priority_regions=priority_regions
+        )
+
+    def apply_optimized_compression(self, image: Image.Image, settings: CompressionSettings
+                                    ) -> Tuple[bytes, Optional[PerceptualQuality]]:
+        """Apply optimized compression with SELIC-inspired settings, plus the output's MS-SSIM"""
+        try:
+            # Pre-processing based on semantic analysis
+            processed_image = self._preprocess_image(image, settings)
+            
+            # Compression with optimized settings
+            output = self._encode(processed_image, settings.format, settings.quality)
+            return output, self.measure_quality(image, output, processed_image)
+            
+        except Exception as e:
+            logger.error(f"Compression failed: {e}")
+            raise SELICProcessingError(f"Compression failed: {str(e)}")
+
+    def use_strips(self, image: Image.Image, settings: CompressionSettings) -> bool:
+        """Whether the in-memory path would exceed strip_memory_bytes on this image
+        
+        Only for JPEG output: the WebP encoder needs the whole frame at once.
+        """
+        return (
+            self.strip_memory_bytes > 0
+            and settings.format == "JPEG"
+            and image.mode in STRIP_MODES
+            and image.width * image.height * FULL_FRAME_BYTES_PER_PIXEL > self.strip_memory_bytes
+        )
+
+    def apply_strip_compression(self, image: Image.Image, settings: CompressionSettings
+                                ) -> Tuple[bytes, Optional[PerceptualQuality]]:
+        """apply_optimized_compression plus measure_quality within strip_memory_bytes
+        
+        Takes the image unloaded: it is decoded into a MappedFrame and preprocessed strip by
+        strip with the same filters, then encoded as baseline JPEG.
+        """
+        try:
+            with timed("decode"):
+                frame = decode_frame(image)
+            with frame:
+                boxes = self._quality_boxes(frame.image) if self.quality_metric else []
+                # Source tiles are taken before preprocessing overwrites the frame
+                source_tiles = self._luma_tiles(frame.image, boxes) if boxes else None
+                frame.release()
+                with timed("preprocess"):
+                    self._preprocess_strips(frame, settings)
+                with timed("encode"):
+                    output = encode_jpeg(frame, settings.quality)
+                if source_tiles is None:
+                    return output, None
+                with timed("quality"):
+                    # The frame still holds the pixels just encoded, so the output needs no decode
+                    score, ssim = ms_ssim(source_tiles, self._output_tiles(output, boxes, frame.image))
+        except Exception as e:
+            logger.error(f"Compression failed: {e}")
+            raise SELICProcessingError(f"Compression failed: {str(e)}")
+        
+        return output, PerceptualQuality(ms_ssim=round(score, 5), ssim=round(ssim, 5))
+
+    def apply_compression_with_renditions(self, image: Image.Image, settings: CompressionSettings,
+                                          widths: List[int]
+                                          ) -> Tuple[bytes, List[Tuple[Rendition, bytes]], Optional[PerceptualQuality]]:
+        """Full-size output, a ladder of smaller renditions from one decode, and the full size's MS-SSIM
+        
+        Preprocessing runs once; each rendition is resized from the next larger one rather than
+        from the original, so the work shrinks with every step. Widths at or above the source
+        width are skipped (no upscaling).
+        """
+        try:
+            processed_image = self._preprocess_image(image, settings)
+            output = self._encode(processed_image, settings.format, settings.quality)
+            
+            renditions = []
+            previous = processed_image
+            for width in sorted(set(widths), reverse=True):
+                if width >= previous.width:
+                    continue
+                height = max(1, round(previous.height * width / previous.width))
+                # reducing_gap lets PIL box-reduce first, then LANCZOS over the small remainder
+                with timed("resize"):
+                    previous = previous.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+                data = self._encode(previous, settings.format, settings.quality)
+                renditions.append((
+                    Rendition(width=width, height=height, format=settings.format,
+                              quality=settings.quality, size=len(data)),
+                    data
+                ))
+            
+            return output, renditions, self.measure_quality(image, output, processed_image)
+            
+        except Exception as e:
+            logger.error(f"Rendition ladder failed: {e}")
+            raise SELICProcessingError(f"Rendition ladder failed: {str(e)}")
+
+    def apply_compression_with_effort(self, image: Image.Image, settings: CompressionSettings,
+                                      effort: str = DEFAULT_EFFORT,
+                                      deadline: Optional[float] = None
+                                      ) -> Tuple[bytes, EffortReport, Optional[PerceptualQuality]]:
+        """Compress at a named effort tier, dropping to faster tiers if `deadline` (epoch seconds) is near
+        
+        Tiers are tried from the requested one down to the fastest; the first whose estimated
+        preprocessing + encode time fits the remaining budget is used (the fastest if none do).
+        """
+        try:
+            start = time.perf_counter()
+            pixels = image.width * image.height
+            budget_ms = (deadline - time.time()) * 1000 if deadline is not None else None
+            
+            tiers = list(EFFORT_TIERS.values())
+            requested = EFFORT_TIERS[effort]
+            candidates = tiers[:tiers.index(requested) + 1][::-1]
+            tier = candidates[-1]
+            for candidate in candidates:
+                if budget_ms is None or self._effort_estimate_ms(candidate, settings, pixels) <= budget_ms:
+                    tier = candidate
+                    break
+            estimated_ms = self._effort_estimate_ms(tier, settings, pixels)
+            
+            processed_image = self._preprocess_image(image, settings, tier)
+            output = self._encode(processed_image, settings.format, settings.quality, tier)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            
+            # Move this tier's correction factor toward what was actually measured
+            key = (tier.name, settings.format)
+            scale = self._effort_scale.get(key, 1.0)
+            self._effort_scale[key] = 0.7 * scale + 0.3 * scale * elapsed_ms / max(estimated_ms, 1e-3)
+            
+            return output, EffortReport(
+                requested=requested.name,
+                used=tier.name,
+                budget_ms=round(budget_ms, 1) if budget_ms is not None else None,
+                estimated_ms=round(estimated_ms, 1),
+                elapsed_ms=round(elapsed_ms, 1),
+                fell_back=tier is not requested
+            ), self.measure_quality(image, output, processed_image)
+            
+        except Exception as e:
+            logger.error(f"Compression failed: {e}")
+            raise SELICProcessingError(f"Compression failed: {str(e)}")
+
+    def _effort_estimate_ms(self, tier: EffortTier, settings: CompressionSettings, pixels: int) -> float:
+        """Expected preprocessing + encode time for a tier, scaled by what this worker has measured"""
+        ns_per_pixel = tier.webp_ns_per_pixel if settings.format == "WEBP" else tier.jpeg_ns_per_pixel
+        if tier.preprocess and settings.optimization_level == "high":
+            ns_per_pixel += PREPROCESS_NS_PER_PIXEL
+        if tier.preprocess and self.region_aware:
+            ns_per_pixel += REGION_NS_PER_PIXEL
+        return pixels * ns_per_pixel / 1e6 * self._effort_scale.get((tier.name, settings.format), 1.0)
+
+    def apply_rate_controlled_compression(self, image: Image.Image, settings: CompressionSettings,
+                                          target_bytes: int
+                                          ) -> Tuple[bytes, RateControlResult, Optional[PerceptualQuality]]:
+        """Encode at the highest quality whose output fits in `target_bytes`
+        
+        Quality is searched on a downscaled proxy first (seeded from the heuristic quality), then
+        refined with a few full-resolution trial encodes using secant steps in log(size).
+        """
+        try:
+            start = time.perf_counter()
+            processed_image = self._preprocess_image(image, settings)
+            
+            quality, slope, proxy_iterations = self._estimate_quality_on_proxy(
+                processed_image, settings.format, settings.quality, target_bytes
+            )
+            
+            trials: Dict[int, int] = {}
+            outputs: Dict[int, bytes] = {}
+            while len(trials) < RATE_CONTROL_MAX_ENCODES:
+                data = self._encode(processed_image, settings.format, quality)
+                trials[quality] = len(data)
+                outputs[quality] = data
+                
+                # Close enough under the budget, or already at a quality bound
+                if target_bytes * RATE_CONTROL_TOLERANCE <= len(data) <= target_bytes:
+                    break
+                if (len(data) <= target_bytes and quality >= RATE_CONTROL_MAX_QUALITY) or \
+                        (len(data) > target_bytes and quality <= RATE_CONTROL_MIN_QUALITY):
+                    break
+                
+                next_quality = self._next_quality(trials, target_bytes, slope)
+                if next_quality in trials:
+                    break
+                quality = next_quality
+            
+            fitting = [q for q, size in trials.items() if size <= target_bytes]
+            # When nothing fits, fall back to the smallest output we produced
+            best_quality = max(fitting) if fitting else min(trials, key=trials.get)
+            output = outputs[best_quality]
+            
+            return output, RateControlResult(
+                target_bytes=target_bytes,
+                achieved_bytes=len(output),
+                quality=best_quality,
+                target_met=len(output) <= target_bytes,
+                iterations=len(trials),
+                proxy_iterations=proxy_iterations,
+                elapsed_ms=round((time.perf_counter() - start) * 1000, 1)
+            ), self.measure_quality(image, output, processed_image)
+            
+        except Exception as e:
+            logger.error(f"Rate-controlled compression failed: {e}")
+            raise SELICProcessingError(f"Rate-controlled compression failed: {str(e)}")
+
+    def _estimate_quality_on_proxy(self, image: Image.Image, output_format: str, seed_quality: int,
+                                   target_bytes: int) -> Tuple[int, float, int]:
+        """Search quality on a ~1 MP proxy, with the budget scaled by the pixel ratio
+        
+        Returns the starting quality for full-resolution trials, the measured d log(size) / d quality
+        slope and the number of proxy encodes.
+        """
+        factor = int((image.width * image.height / RATE_CONTROL_PROXY_PIXELS) ** 0.5)
+        if factor < 2:
+            # Already proxy-sized; the full-resolution trials are just as cheap
+            return seed_quality, RATE_CONTROL_DEFAULT_SLOPE, 0
+        
+        proxy = image.reduce(factor)
+        proxy_target = target_bytes * (proxy.width * proxy.height) / (image.width * image.height)
+        
+        trials: Dict[int, int] = {}
+        quality = seed_quality
+        while len(trials) < RATE_CONTROL_PROXY_ENCODES:
+            trials[quality] = len(self._encode(proxy, output_format, quality))
+            next_quality = self._next_quality(trials, proxy_target, RATE_CONTROL_DEFAULT_SLOPE)
+            if next_quality in trials:
+                break
+            quality = next_quality
+        
+        fitting = [q for q, size in trials.items() if size <= proxy_target]
+        best_quality = max(fitting) if fitting else min(trials)
+        return best_quality, self._log_size_slope(trials), len(trials)
+
+    def _next_quality(self, trials: Dict[int, int], target_bytes: float, slope: float) -> int:
+        """Secant step in log(size) toward the budget, kept inside the current bracket"""
+        fits = [q for q, size in trials.items() if size <= target_bytes]
+        over = [q for q, size in trials.items() if size > target_bytes]
+        low = max(fits) if fits else RATE_CONTROL_MIN_QUALITY - 1
+        high = min(over) if over else RATE_CONTROL_MAX_QUALITY + 1
+        if high - low <= 1:
+            # Bracket closed: the best fitting quality is already known
+            return max(fits) if fits else min(over)
+        
+        if len(trials) >= 2:
+            slope = self._log_size_slope(trials)
+        
+        # Aim for the middle of the acceptance band, stepping from the trial closest to it;
+        # until the budget is bracketed, overshoot a little so the next trial lands across it
+        aim = target_bytes * (1 + RATE_CONTROL_TOLERANCE) / 2
+        anchor = min(trials, key=lambda q: abs(np.log(trials[q] / aim)))
+        step = np.log(aim / trials[anchor]) / slope
+        if not fits or not over:
+            step *= RATE_CONTROL_OVERSHOOT
+        quality = int(np.floor(anchor + step))
+        return min(max(quality, low + 1), high - 1)
+
+    @staticmethod
+    def _log_size_slope(trials: Dict[int, int]) -> float:
+        """d log(size) / d quality from the two trials closest together in quality"""
+        qualities = sorted(trials)
+        if len(qualities) < 2:
+            return RATE_CONTROL_DEFAULT_SLOPE
+        q_a, q_b = min(zip(qualities, qualities[1:]), key=lambda pair: pair[1] - pair[0])
+        slope = (np.log(trials[q_b]) - np.log(trials[q_a])) / (q_b - q_a)
+        # Size is monotone in quality; a flat or negative slope is noise, not signal
+        return float(slope) if slope > 1e-3 else RATE_CONTROL_DEFAULT_SLOPE
+
+    def apply_min_quality_compression(self, image: Image.Image, settings: CompressionSettings,
+                                      min_ms_ssim: float) -> Tuple[bytes, MinQualityResult]:
+        """Encode at the lowest quality whose output still reaches `min_ms_ssim` against the source
+        
+        Quality is bisected on a mosaic of sampled tiles, then confirmed (and stepped up if the
+        full frame falls short) with full-resolution encodes.
+        """
+        try:
+            start = time.perf_counter()
+            processed_image = self._preprocess_image(image, settings)
+            boxes = self._quality_boxes(image)
+            if not boxes:
+                raise ValueError("Image too small to measure perceptual quality")
+            reference = self._luma_tiles(image, boxes)
+            mosaic = self._mosaic(processed_image, boxes)
+            
+            # Lowest passing quality on the mosaic; the maximum is used if nothing passes
+            low, high = RATE_CONTROL_MIN_QUALITY, RATE_CONTROL_MAX_QUALITY
+            proxy_iterations = 0
+            while low < high and proxy_iterations < MIN_QUALITY_PROXY_ENCODES:
+                mid = (low + high) // 2
+                data = self._encode(mosaic, settings.format, mid)
+                score, _ = ms_ssim(reference, self._mosaic_tiles(data, len(boxes)))
+                proxy_iterations += 1
+                if score >= min_ms_ssim:
+                    high = mid
+                else:
+                    low = mid + 1
+            quality = high
+            
+            iterations = 0
+            while True:
+                output = self._encode(processed_image, settings.format, quality)
+                with timed("quality"):
+                    score, ssim = ms_ssim(reference, self._output_tiles(output, boxes, processed_image))
+                iterations += 1
+                if score >= min_ms_ssim or quality >= RATE_CONTROL_MAX_QUALITY or \
+                        iterations >= MIN_QUALITY_MAX_ENCODES:
+                    break
+                quality = min(RATE_CONTROL_MAX_QUALITY, quality + MIN_QUALITY_STEP)
+            
+            return output, MinQualityResult(
+                target_ms_ssim=min_ms_ssim,
+                ms_ssim=round(score, 5),
+                ssim=round(ssim, 5),
+                quality=quality,
+                target_met=score >= min_ms_ssim,
+                iterations=iterations,
+                proxy_iterations=proxy_iterations,
+                elapsed_ms=round((time.perf_counter() - start) * 1000, 1)
+            )
+            
+        except Exception as e:
+            logger.error(f"Minimum-quality compression failed: {e}")
+            raise SELICProcessingError(f"Minimum-quality compression failed: {str(e)}")
+
+    def measure_quality(self, image: Image.Image, data: bytes,
+                        processed: Optional[Image.Image] = None) -> Optional[PerceptualQuality]:
+        """MS-SSIM / SSIM of an encoded output against its (pre-preprocessing) source, on sampled luma tiles
+        
+        `processed` is the image the output was encoded from; with it, JPEG outputs are scored
+        from a re-encoded mosaic instead of a full decode.
+        """
+        if not self.quality_metric:
+            return None
+        with timed("quality"):
+            boxes = self._quality_boxes(image)
+            if not boxes:
+                return None
+            score, ssim = ms_ssim(self._luma_tiles(image, boxes), self._output_tiles(data, boxes, processed))
+            return PerceptualQuality(ms_ssim=round(score, 5), ssim=round(ssim, 5))
+
+    def _output_tiles(self, data: bytes, boxes: List[Tuple[int, int, int, int]],
+                      processed: Optional[Image.Image] = None) -> np.ndarray:
+        """Luma of an encoded output at `boxes`, without decoding the frame when that is exact"""
+        output = Image.open(io.BytesIO(data))
+        if processed is None or output.format != "JPEG" or processed.mode not in QUALITY_MOSAIC_MODES:
+            return self._luma_tiles(self._open_output(data), boxes)
+        mosaic = self._mosaic(processed, boxes)
+        if mosaic.mode == "RGBX":
+            mosaic = mosaic.convert("RGB")
+        # Luma depends only on the pixels and the luma table, not on subsampling or entropy coding
+        buffer = io.BytesIO()
+        mosaic.save(buffer, format="JPEG", qtables=output.quantization)
+        return self._mosaic_tiles(buffer.getvalue(), len(boxes))
+
+    @staticmethod
+    def _quality_boxes(image: Image.Image) -> List[Tuple[int, int, int, int]]:
+        """Up to QUALITY_MAX_TILES tile boxes spread evenly over the frame, aligned to 16 px"""
+        tile = min(QUALITY_TILE, image.width // 16 * 16, image.height // 16 * 16)
+        if tile < 16:
+            return []
+        columns = max(1, min(image.width // tile, round((QUALITY_MAX_TILES * image.width / image.height) ** 0.5)))
+        rows = max(1, min(image.height // tile, QUALITY_MAX_TILES // columns))
+        
+        def offsets(count: int, extent: int) -> List[int]:
+            if count == 1:
+                return [(extent - tile) // 2 // 16 * 16]
+            return [(i * (extent - tile) // (count - 1)) // 16 * 16 for i in range(count)]
+        
+        return [(x, y, x + tile, y + tile) for y in offsets(rows, image.height) for x in offsets(columns, image.width)]
+
+    @staticmethod
+    def _luma_tiles(image: Image.Image, boxes: List[Tuple[int, int, int, int]]) -> np.ndarray:
+        """(N, tile, tile) uint8 luma, one plane per box"""
+        return np.stack([np.asarray(image.crop(box).convert("L")) for box in boxes])
+
+    @staticmethod
+    def _open_output(data: bytes) -> Image.Image:
+        output = Image.open(io.BytesIO(data))
+        if output.format == "JPEG":
+            # Decode the Y component only: no chroma upsampling or color conversion
+            output.draft("L", output.size)
+        output.load()
+        return output
+
+    @staticmethod
+    def _mosaic(image: Image.Image, boxes: List[Tuple[int, int, int, int]]) -> Image.Image:
+        """The boxes' pixels packed into a grid, QUALITY_MOSAIC_COLUMNS wide"""
+        tile = boxes[0][2] - boxes[0][0]
+        columns = min(len(boxes), QUALITY_MOSAIC_COLUMNS)
+        rows = -(-len(boxes) // columns)
+        mosaic = Image.new(image.mode, (columns * tile, rows * tile))
+        for i, box in enumerate(boxes):
+            mosaic.paste(image.crop(box), (i % columns * tile, i // columns * tile))
+        return mosaic
+
+    def _mosaic_tiles(self, data: bytes, count: int) -> np.ndarray:
+        """Luma tiles back out of an encoded mosaic, in box order"""
+        mosaic = self._open_output(data)
+        columns = min(count, QUALITY_MOSAIC_COLUMNS)
+        tile = mosaic.width // columns
+        boxes = [(i % columns * tile, i // columns * tile, i % columns * tile + tile, i // columns * tile + tile)
+                 for i in range(count)]
+        return self._luma_tiles(mosaic, boxes)
+
+    def _encode(self, image: Image.Image, output_format: str, quality: int,
+                effort: Optional[EffortTier] = None) -> bytes:
+        """Encode with the service's encoder settings (archival effort unless a tier is given)"""
+        effort = effort or EFFORT_TIERS[DEFAULT_EFFORT]
+        output_buffer = io.BytesIO()
+        
+        with timed("encode"):
+            if output_format == "WEBP":
+                image.save(
+                    output_buffer,
+                    format="WEBP",
+                    quality=quality,
+                    method=effort.webp_method,  # 6 = maximum compression effort
+                    optimize=True
+                )
+            else:
+                image.save(
+                    output_buffer,
+                    format="JPEG",
+                    quality=quality,
+                    optimize=effort.jpeg_optimize,
+                    progressive=effort.jpeg_progressive
+                )
+        
+        return output_buffer.getvalue()
+
+    def _preprocess_image(self, image: Image.Image, settings: CompressionSettings,
+                          effort: Optional[EffortTier] = None) -> Image.Image:
+        """Apply semantic-guided preprocessing (skipped by effort tiers that trade it for speed)"""
+        if effort is not None and not effort.preprocess:
+            # Nothing downstream modifies the image, so no defensive copy either
+            return image
+        
+        with timed("preprocess"):
+            # PIL operations return new images, so the input is never modified and needs no copy;
+            # each step below materializes at most one full-resolution frame
+            processed = image
+            
+            # Semantic-aware enhancements: subtle sharpening and contrast for complex images
+            if settings.optimization_level == "high" and processed.mode in ENHANCE_MODES:
+                processed = self._sharpen_and_stretch(processed)
+            
+            if self.region_aware:
+                processed = self._smooth_background(processed, settings)
+        
+        return processed
+
+    def _sharpen_and_stretch(self, image: Image.Image) -> Image.Image:
+        """ImageEnhance Sharpness(1.1) then Contrast(1.05) in a single filter pass"""
+        kernel, lut = self._enhancement_filter(image.getbands(), image.histogram())
+        return self._apply_enhancement(image, kernel, lut)
+
+    @staticmethod
+    def _enhancement_filter(bands: Tuple[str, ...], histogram: List[int]
+                            ) -> Tuple[ImageFilter.Kernel, List[int]]:
+        """The fused kernel and border lookup table for a frame with this histogram
+        
+        Sharpness blends toward ImageFilter.SMOOTH and Contrast toward the mean luma; both are
+        linear, so they fold into one 3x3 kernel plus an offset. The mean comes from the band
+        histograms instead of an "L" copy of the frame.
+        """
+        pixels = max(1, sum(histogram[:256]))
+        band_means = [
+            sum(i * count for i, count in enumerate(histogram[256 * b:256 * (b + 1)])) / pixels
+            for b in range(len(bands))
+        ]
+        # Same luma weights as convert("L")
+        luma_mean = band_means[0] if bands[0] == "L" else (
+            band_means[0] * 0.299 + band_means[1] * 0.587 + band_means[2] * 0.114
+        )
+        mean = int(luma_mean + 0.5)
+        offset = (1 - CONTRAST_FACTOR) * mean
+        
+        _, smooth_scale, _, smooth_weights = ImageFilter.SMOOTH.filterargs
+        weights = [(1 - SHARPEN_FACTOR) * w / smooth_scale for w in smooth_weights]
+        weights[4] += SHARPEN_FACTOR
+        kernel = ImageFilter.Kernel((3, 3), [CONTRAST_FACTOR * w for w in weights], scale=1, offset=offset)
+        
+        curve = [min(255, max(0, int(CONTRAST_FACTOR * v + offset + 0.5))) for v in range(256)]
+        lut = []
+        for band in bands:
+            lut.extend(range(256) if band == "A" else curve)
+        return kernel, lut
+
+    @staticmethod
+    def _apply_enhancement(image: Image.Image, kernel: ImageFilter.Kernel, lut: List[int]) -> Image.Image:
+        """Run the fused kernel from _enhancement_filter
+        
+        Kernel filters leave the one-pixel border untouched, so the border strips get the
+        contrast curve as a lookup table.
+        """
+        width, height = image.size
+        if width < 3 or height < 3:
+            return image.point(lut)
+        
+        processed = image.filter(kernel)
+        if "A" in image.getbands():
+            # The kernel also ran over alpha; ImageEnhance leaves it unchanged
+            processed.putalpha(image.getchannel("A"))
+        for box in ((0, 0, width, 1), (0, height - 1, width, height),
+                    (0, 1, 1, height - 1), (width - 1, 1, width, height - 1)):
+            processed.paste(image.crop(box).point(lut), box[:2])
+        return processed
+
+    def region_mask(self, image: Image.Image, settings: CompressionSettings) -> Optional[Image.Image]:
+        """Full-size "L" mask: 255 where detail is kept, falling to 0 over background to be smoothed
+        
+        Returns None when too little of the frame is smoothable background to be worth a pass.
+        """
+        block_reduction = REGION_BLOCK // 4
+        small = image.reduce(block_reduction).convert("RGB")
+        block_mask = self._block_mask(self.kernel.block_saliency(np.asarray(small), 4), settings)
+        if block_mask is None:
+            return None
+        return block_mask.resize(image.size, Image.Resampling.BILINEAR)
+
+    @staticmethod
+    def _block_mask(saliency: np.ndarray, settings: CompressionSettings) -> Optional[Image.Image]:
+        """region_mask at one pixel per REGION_BLOCK block, from the block saliency map"""
+        # priority_regions from optimize_compression up-weight part of the frame
+        rows, cols = saliency.shape
+        for region in settings.priority_regions:
+            if region.get("region") == "center":
+                saliency[rows // 4:rows - rows // 4, cols // 4:cols - cols // 4] *= region.get("weight", 1.0)
+        
+        threshold = max(REGION_SALIENCY_RATIO * float(saliency.mean()), 1e-6)
+        keep = np.clip(saliency / threshold, 0.0, 1.0)
+        # Flat blocks are kept as they are; one block of dilation protects subject edges
+        keep[saliency <= REGION_FLAT_SALIENCY] = 1.0
+        block_mask = Image.fromarray(np.rint(keep * 255).astype(np.uint8), "L")
+        block_mask = block_mask.filter(ImageFilter.MaxFilter(3))
+        
+        if (np.asarray(block_mask) < 255).mean() < REGION_MIN_BACKGROUND:
+            return None
+        return block_mask
+
+    @staticmethod
+    def _smoothing_factor(settings: CompressionSettings) -> int:
+        """Background downscale factor: each 0.2 of extra `semantic_regions` weight adds a step"""
+        weight = settings.bit_allocation.get("semantic_regions", 1.0)
+        return int(round(1 + 5 * (weight - 1)))
+
+    def _smooth_background(self, image: Image.Image, settings: CompressionSettings) -> Image.Image:
+        """Low-pass the non-salient blocks so the encoder spends its bytes on the salient ones
+        
+        `bit_allocation["semantic_regions"]` sets the strength (see _smoothing_factor).
+        """
+        factor = self._smoothing_factor(settings)
+        if factor < 2 or image.mode not in REGION_MODES:
+            return image
+        
+        mask = self.region_mask(image, settings)
+        if mask is None:
+            return image
+        smoothed = image.reduce(factor).resize(image.size, Image.Resampling.BILINEAR)
+        # Same result as Image.composite(image, smoothed, mask), without a third full-size frame
+        smoothed.paste(image, (0, 0), mask)
+        return smoothed
+
+    def _preprocess_strips(self, frame: MappedFrame, settings: CompressionSettings) -> None:
+        """_preprocess_image over a MappedFrame in place, one strip at a time
+        
+        A read-only pass gathers the histogram for the contrast mean, the sharpen pass reads one
+        row of overlap (and feeds the saliency map), and the smoothing pass reads enough rows of
+        overlap for its reduce() and bilinear upscale to match the whole-frame result. Strips are
+        multiples of the saliency block and the smoothing factor, so reduce() cells line up too.
+        """
+        width, height = frame.size
+        enhance = settings.optimization_level == "high"
+        factor = self._smoothing_factor(settings) if self.region_aware else 1
+        if not enhance and factor < 2:
+            return
+        align = REGION_BLOCK * factor // math.gcd(REGION_BLOCK, factor) if factor >= 2 else REGION_BLOCK
+        rows = strip_rows(frame.size, self.strip_memory_bytes, align)
+        saliency = StripSaliency(self.kernel, REGION_BLOCK // 4, 4) if factor >= 2 else None
+        
+        if enhance:
+            histogram = np.zeros(256 * Image.getmodebands(frame.mode), dtype=np.int64)
+            for top, bottom in strips(height, rows):
+                histogram += frame.rows(top, bottom).histogram()
+                frame.release()
+            kernel, lut = self._enhancement_filter(ImageMode.getmode(frame.mode).bands, histogram.tolist())
+            
+            def sharpen(source: Image.Image, start: int, top: int, bottom: int) -> Image.Image:
+                strip = self._apply_enhancement(source, kernel, lut).crop((0, top - start, width, bottom - start))
+                if saliency is not None:
+                    saliency.add(strip)
+                return strip
+            
+            map_strips(frame, rows, 1, sharpen)
+        elif saliency is not None:
+            for top, bottom in strips(height, rows):
+                saliency.add(frame.rows(top, bottom))
+                frame.release()
+        
+        if saliency is None:
+            return
+        block_mask = self._block_mask(saliency.result(), settings)
+        if block_mask is None:
+            return
+        # Same scales as the whole-frame resize(), which maps size onto ceil(size / factor)
+        reduced_scale = -(-height // factor) / height
+        mask_scale = block_mask.height / height
+        
+        def smooth(source: Image.Image, start: int, top: int, bottom: int) -> Image.Image:
+            reduced = source.reduce(factor)
+            offset = start / factor
+            smoothed = reduced.resize(
+                (width, bottom - top), Image.Resampling.BILINEAR,
+                box=(0, top * reduced_scale - offset, reduced.width, bottom * reduced_scale - offset)
+            )
+            mask = block_mask.resize(
+                (width, bottom - top), Image.Resampling.BILINEAR,
+                box=(0, top * mask_scale, block_mask.width, bottom * mask_scale)
+            )
+            smoothed.paste(source.crop((0, top - start, width, bottom - start)), (0, 0), mask)
+            return smoothed
+        
+        # Output row y samples reduced row (y + 0.5) * reduced_scale, up to one row past y / factor,
+        # with one row of bilinear support either side: three reduced rows of overlap cover it
+        map_strips(frame, rows, 3 * factor, smooth)
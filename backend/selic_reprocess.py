@@ -0,0 +1,303 @@
+"""
+Offline bulk reprocessing for the SELIC service
+Runs the /process-image pipeline over a directory tree or a manifest of paths on the service's
+worker pool (all cores by default) and within its admission budgets, so memory stays bounded
+however large the library is. Each output is written under --out, named after its input with the
+output extension appended (IMG_1.png -> IMG_1.png.jpg, so inputs sharing a stem never collide),
+next to one NDJSON line per input with the fields /process-image returns.
+
+The results file is also the checkpoint: a rerun skips every input whose content hash and
+processing configuration (PROCESSOR_VERSION, worker options, renditions, effort, pass-through) match a
+successful line, so an interrupted run resumes where it stopped and a heuristics change
+reprocesses everything. Inputs whose size and mtime are unchanged keep their recorded hash
+unless --rehash is given.
+
+    cd backend
+    python selic_reprocess.py /photos --out /photos-selic
+    python selic_reprocess.py /photos --manifest paths.txt --out /photos-selic --renditions default
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+import selic_service
+from selic_admission import AdmissionController, estimate_cost
+from selic_processor import EFFORT_TIERS, PROCESSOR_VERSION
+from selic_uploads import describe_file, hash_file
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff", ".bmp", ".gif"}
+RESULTS_FILENAME = "results.ndjson"
+OUTPUT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+PROGRESS_EVERY = 100
+
+
+def iter_inputs(root: str, manifest: Optional[str], exclude: Sequence[str] = ()) -> Iterator[Tuple[str, str]]:
+    """(path, name relative to root) for every image under root, or every line of the manifest
+
+    Manifest lines are paths relative to root (or absolute); "-" reads the manifest from stdin.
+    The walk skips the paths in `exclude` (the output directory and results file, which may sit
+    under root), so a rerun does not pick up its own outputs.
+    """
+    if manifest is None:
+        excluded = {os.path.realpath(path) for path in exclude}
+        for directory, subdirs, filenames in os.walk(root):
+            subdirs[:] = sorted(
+                subdir for subdir in subdirs if os.path.realpath(os.path.join(directory, subdir)) not in excluded
+            )
+            for filename in sorted(filenames):
+                if os.path.realpath(os.path.join(directory, filename)) in excluded:
+                    continue
+                if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                    path = os.path.join(directory, filename)
+                    yield path, os.path.relpath(path, root)
+        return
+
+    lines = sys.stdin if manifest == "-" else open(manifest, encoding="utf-8")
+    try:
+        for line in lines:
+            entry = line.strip()
+            if not entry or entry.startswith("#"):
+                continue
+            path = os.path.normpath(os.path.join(root, entry))
+            name = os.path.relpath(path, root)
+            if name.startswith(os.pardir):
+                # Outside root: mirror the absolute path under --out
+                name = os.path.splitdrive(path)[1].lstrip(os.sep)
+            yield path, name
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+
+class Checkpoint:
+    """Latest result line per input, loaded from an append-only NDJSON results file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by an interrupted run
+                        continue
+                    self.records[record["path"]] = record
+        self._file = open(path, "a", encoding="utf-8")
+
+    def done(self, name: str, digest: str, config: Dict[str, Any], out_dir: str) -> bool:
+        """Whether `name` already succeeded with this content and configuration (and its output is still there)"""
+        record = self.records.get(name)
+        return (
+            record is not None
+            and record.get("success") is True
+            and record.get("digest") == digest
+            and record.get("config") == config
+            and os.path.exists(os.path.join(out_dir, record["output"]))
+        )
+
+    def known_digest(self, name: str, stat: os.stat_result) -> Optional[str]:
+        """Recorded hash of `name` if its size and mtime have not changed since"""
+        record = self.records.get(name)
+        if record is None or record.get("input_bytes") != stat.st_size or record.get("mtime_ns") != stat.st_mtime_ns:
+            return None
+        return record.get("digest")
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self.records[record["path"]] = record
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def compact(self) -> None:
+        """Rewrite the file with only the latest line per input (after a complete run)"""
+        self._file.close()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for record in self.records.values():
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class Reprocessor:
+    def __init__(self, out_dir: str, checkpoint: Checkpoint, widths: Optional[List[int]],
+                 effort: Optional[str], jobs: int, rehash: bool):
+        self.out_dir = out_dir
+        self.checkpoint = checkpoint
+        self.widths = widths
+        self.effort = effort
+        self.jobs = jobs
+        self.rehash = rehash
+        # Same budgets as the service, but inputs wait as long as they need instead of being refused
+        self.admission = AdmissionController(max_queue=jobs, max_wait=None)
+        self.config = {
+            "processor_version": PROCESSOR_VERSION,
+            "worker_config": selic_service.worker_pool.cache_tag,
+            "renditions": widths,
+            "effort": effort,
+            "passthrough": selic_service.PASSTHROUGH,
+        }
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self._started = time.perf_counter()
+
+    async def run(self, inputs: Iterator[Tuple[str, str]]) -> None:
+        slots = asyncio.Semaphore(self.jobs)
+        tasks = set()
+        for path, name in inputs:
+            await slots.acquire()
+            try:
+                stat = os.stat(path)
+                digest = None if self.rehash else self.checkpoint.known_digest(name, stat)
+                if digest is None:
+                    digest = await asyncio.to_thread(hash_file, path)
+            except OSError as e:
+                slots.release()
+                self._fail(name, None, None, f"Could not read input: {e}")
+                continue
+            if self.checkpoint.done(name, digest, self.config, self.out_dir):
+                slots.release()
+                self.skipped += 1
+                continue
+
+            task = asyncio.ensure_future(self._process(path, name, stat, digest))
+            tasks.add(task)
+            task.add_done_callback(lambda t: (tasks.discard(t), slots.release()))
+        await asyncio.gather(*tasks)
+
+    def _progress(self) -> None:
+        finished = self.processed + self.failed
+        if finished % PROGRESS_EVERY == 0:
+            rate = finished / (time.perf_counter() - self._started)
+            logger.info(f"{finished} processed ({self.failed} failed), {self.skipped} skipped, {rate:.1f} images/s")
+
+    async def _process(self, path: str, name: str, stat: os.stat_result, digest: str) -> None:
+        try:
+            upload = await asyncio.to_thread(describe_file, path, digest)
+            async with self.admission.admit(estimate_cost(upload)):
+                output = await selic_service.run_process_pipeline(upload, self.widths, self.effort)
+            payload = selic_service.build_process_response(
+                output.semantics, output.compression_settings, output.data, upload.size,
+                include_image=False, renditions=output.renditions, effort=output.effort,
+                perceptual=output.perceptual, passthrough=output.passthrough
+            )
+
+            extension = OUTPUT_EXTENSIONS.get(output.compression_settings.format, ".jpg")
+            # The input's own extension stays in the name: IMG_1.jpg and IMG_1.png get separate outputs
+            stem = name
+            writes = [(stem + extension, output.data)]
+            for meta, (_, data) in zip(payload.get("renditions", []), output.renditions or []):
+                meta["output"] = f"{stem}-{meta['width']}w{extension}"
+                writes.append((meta["output"], data))
+            for relative, data in writes:
+                await asyncio.to_thread(write_atomic, os.path.join(self.out_dir, relative), data)
+        except Exception as e:
+            self._fail(name, stat, digest, str(getattr(e, "detail", None) or e))
+            return
+
+        self.processed += 1
+        self.checkpoint.append({
+            "path": name, "input_bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest,
+            "config": self.config, "output": writes[0][0], **payload
+        })
+        self._progress()
+
+    def _fail(self, name: str, stat: Optional[os.stat_result], digest: Optional[str], error: str) -> None:
+        logger.error(f"{name}: {error}")
+        self.failed += 1
+        record: Dict[str, Any] = {"path": name, "success": False, "error": error}
+        if stat is not None:
+            record.update(input_bytes=stat.st_size, mtime_ns=stat.st_mtime_ns, digest=digest, config=self.config)
+        self.checkpoint.append(record)
+        self._progress()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", nargs="?", default=".",
+                        help="Directory to walk, and the base for relative manifest paths")
+    parser.add_argument("--manifest", help="File listing input paths, one per line ('-' for stdin)")
+    parser.add_argument("--out", required=True, help="Output directory (mirrors the input layout)")
+    parser.add_argument("--results", help=f"NDJSON results / checkpoint file (default: OUT/{RESULTS_FILENAME})")
+    parser.add_argument("--renditions", help="'default' or comma-separated widths, as for /process-image")
+    parser.add_argument("--effort", help="Effort tier, as for /process-image")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Inputs in flight at once (default: twice the worker count)")
+    parser.add_argument("--rehash", action="store_true",
+                        help="Hash every input even when its size and mtime are unchanged")
+    args = parser.parse_args()
+
+    # Outputs go straight to --out, so the memory tier of the output cache would only hold bytes nobody reads
+    selic_service.output_cache.max_entries = 0
+
+    try:
+        widths = selic_service.parse_rendition_widths(args.renditions)
+    except HTTPException as e:
+        parser.error(e.detail)
+    if args.effort is not None and args.effort not in EFFORT_TIERS:
+        parser.error(f"--effort must be one of {', '.join(EFFORT_TIERS)}")
+    if widths is not None and args.effort is not None:
+        parser.error("--effort cannot be combined with --renditions")
+
+    os.makedirs(args.out, exist_ok=True)
+    results_path = args.results or os.path.join(args.out, RESULTS_FILENAME)
+    checkpoint = Checkpoint(results_path)
+    pool = selic_service.worker_pool
+    reprocessor = Reprocessor(
+        args.out, checkpoint, widths, args.effort, args.jobs or 2 * pool.max_workers, args.rehash
+    )
+
+    async def run() -> None:
+        pool.start()
+        try:
+            await reprocessor.run(iter_inputs(args.root, args.manifest, exclude=(args.out, results_path)))
+        finally:
+            await selic_service.analysis_batcher.close()
+            pool.shutdown()
+
+    started = time.perf_counter()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        checkpoint.close()
+        logger.info(f"Interrupted: {reprocessor.processed} processed this run; rerun to resume")
+        return 130
+    checkpoint.compact()
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Done in {elapsed:.1f}s: {reprocessor.processed} processed, {reprocessor.skipped} skipped, "
+        f"{reprocessor.failed} failed ({reprocessor.processed / max(elapsed, 1e-9):.1f} images/s)"
+    )
+    return 1 if reprocessor.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,23 +3,53 @@ SELIC-Inspired Image Compression Service for Moment Backend
 Implements semantic-enhanced compression using modern Python libraries
 """
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image, ImageEnhance
-import io
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+import os
+import asyncio
+import uuid
 import base64
 import json
-from typing import Optional, Dict, Any, List
-import numpy as np
-from dataclasses import dataclass
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dataclasses import dataclass, asdict, replace
 import logging
 from datetime import datetime
 
-# For semantic analysis (mock implementation - would use actual models in production)
-# from transformers import BlipProcessor, BlipForConditionalGeneration, BertTokenizer, BertModel
-# import torch
+from selic_admission import AdmissionController, client_id, estimate_cost
+from selic_batching import MicroBatcher
+from selic_cache import ResultCache, cache_key
+from selic_dedup import NearDuplicateIndex
+from selic_jobs import FINISHED_STATES, Job, JobOutput, JobStore, JobStoreFull
+from selic_metrics import (
+    BYTES_IN, BYTES_OUT, PASSTHROUGH_DECISIONS, REQUEST_DURATION, REQUESTS, STAGE_DURATION, STREAM_EVENT_LATENCY,
+    current_request_timings, record_stage, render_samples, server_timing_header, start_request_timings,
+    timed_request_stage
+)
+from selic_passthrough import can_substitute, skips_encode
+from selic_processor import (
+    DEFAULT_EFFORT, EFFORT_TIERS, PROCESSOR_VERSION, PerceptualQuality, SemanticAnalysis, CompressionSettings,
+    size_class
+)
+from selic_uploads import MAX_UPLOAD_BYTES, SpooledUpload, spool_upload
+from selic_workers import (
+    analyze_task, analyze_batch_task, analyze_arrays_task, prepare_task, compress_task, effort_compress_task,
+    min_quality_compress_task, renditions_task, rate_controlled_compress_task, pool_from_env
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # CPU-bound stages run in the worker pool so the event loop stays responsive
+    worker_pool.start()
+    yield
+    await job_store.close()
+    await analysis_batcher.close()
+    worker_pool.shutdown()
 
-app = FastAPI(title="SELIC Image Processing Service")
+app = FastAPI(title="SELIC Image Processing Service", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,247 +57,756 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "Server-Timing", "X-SELIC-Original-Size", "X-SELIC-Compression-Ratio", "X-SELIC-Quality",
+        "X-SELIC-Format", "X-SELIC-Metadata"
+    ],
 )
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Response modes for endpoints returning a compressed image
+RESPONSE_MODES = ("json", "binary", "multipart")
+# Extra /process-image modes that send each stage's result as soon as it is ready
+STREAM_MODES = ("ndjson", "sse")
+
+# Batch endpoints: uploads per request and images per vectorized analysis call
+MAX_BATCH_FILES = int(os.getenv("SELIC_MAX_BATCH_FILES", "200"))
+BATCH_CHUNK_SIZE = int(os.getenv("SELIC_BATCH_CHUNK_SIZE", "16"))
+BATCH_PATHS = ("/analyze-images", "/process-images")
+
+# Rendition ladder widths for /process-image?renditions=default
+DEFAULT_RENDITION_WIDTHS = [
+    int(width) for width in os.getenv("SELIC_RENDITION_WIDTHS", "320,640,1280,2048").split(",")
+]
+MAX_RENDITIONS = 8
+MIN_RENDITION_WIDTH = 16
+# Time budget in ms from request arrival; encoding drops to faster effort tiers to meet it
+DEADLINE_HEADER = "X-SELIC-Deadline-Ms"
+
+@app.middleware("http")
+async def reject_oversized_requests(request: Request, call_next):
+    """Refuse bodies that cannot fit the upload limits before they are received and parsed"""
+    content_length = request.headers.get("content-length")
+    if request.method == "POST" and content_length and content_length.isdigit():
+        max_files = MAX_BATCH_FILES if request.url.path in BATCH_PATHS else 1
+        # Allow some room for multipart boundaries and part headers
+        limit = MAX_UPLOAD_BYTES * max_files + 64 * 1024 * max_files
+        if int(content_length) > limit:
+            return JSONResponse(status_code=413, content={"detail": f"Request body exceeds {limit} bytes"})
+    return await call_next(request)
+
+requests_in_flight = 0
+
+async def _count_bytes_out(body_iterator):
+    """Pass the body through, counting bytes sent; the request stops being in flight when it ends"""
+    global requests_in_flight
+    try:
+        async for chunk in body_iterator:
+            BYTES_OUT.inc(len(chunk))
+            yield chunk
+    finally:
+        requests_in_flight -= 1
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """Per-request stage timings (Server-Timing header) plus request, latency and byte metrics"""
+    global requests_in_flight
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        BYTES_IN.inc(int(content_length))
+    
+    # Worker tasks and service-side stages add to this dict through a context variable
+    timings = start_request_timings()
+    # Deadlines (X-SELIC-Deadline-Ms) count from arrival, not from when the handler starts
+    request.state.received_at = time.time()
+    start = time.perf_counter()
+    requests_in_flight += 1
+    try:
+        response = await call_next(request)
+    except BaseException:
+        requests_in_flight -= 1
+        raise
+    elapsed = time.perf_counter() - start
+    
+    # Routing has filled in the matched route by now: label by its template (/jobs/{job_id}), so
+    # metric label values stay bounded whatever paths clients send
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or "other"
+    REQUEST_DURATION.observe(elapsed, path)
+    REQUESTS.inc(1, path, str(response.status_code))
+    # Streamed responses (batch NDJSON, multipart) only report stages finished before the headers
+    response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    response.headers["Timing-Allow-Origin"] = "*"
+    response.body_iterator = _count_bytes_out(response.body_iterator)
+    return response
+
 @dataclass
-class SemanticAnalysis:
-    description: str
-    confidence: float
-    complexity: float
-    brightness: float
-    dominant_colors: List[List[int]]
-    estimated_quality: float
+class BatchUpload:
+    """One file of a batch request and its per-item results"""
+    index: int
+    filename: Optional[str]
+    upload: Optional[SpooledUpload] = None
+    semantics: Optional[SemanticAnalysis] = None
+    compression_settings: Optional[CompressionSettings] = None
+    error: Optional[str] = None
 
 @dataclass
-class CompressionSettings:
-    quality: int
-    format: str
-    optimization_level: str
-    bit_allocation: Dict[str, float]
-    priority_regions: List[Dict[str, Any]]
-
-class SELICProcessor:
-    """SELIC-inspired image processor"""
-    
-    def __init__(self):
-        self.initialized = False
-        # In production, initialize actual ML models here
-        # self.blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-        # self.blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-        # self.bert_tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-        # self.bert_model = BertModel.from_pretrained('bert-base-uncased')
-        self.initialized = True
-        logger.info("SELIC processor initialized")
-
-    def analyze_semantics(self, image: Image.Image) -> SemanticAnalysis:
-        """Extract semantic information from image"""
-        try:
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Resize for analysis (standard 224x224 for vision models)
-            analysis_size = (224, 224)
-            img_resized = image.resize(analysis_size, Image.Resampling.LANCZOS)
-            img_array = np.array(img_resized)
-            
-            # Basic image analysis
-            brightness = self._calculate_brightness(img_array)
-            complexity = self._estimate_complexity(img_array)
-            dominant_colors = self._extract_dominant_colors(img_array)
-            
-            # Mock semantic description (replace with actual BLIP inference)
-            description = self._generate_mock_description(
-                brightness, complexity, dominant_colors, image.size
-            )
-            
-            # Estimate optimal compression quality based on analysis
-            estimated_quality = self._calculate_optimal_quality(
-                brightness, complexity, image.size
-            )
-            
-            return SemanticAnalysis(
-                description=description,
-                confidence=0.85,  # Mock confidence
-                complexity=complexity,
-                brightness=brightness,
-                dominant_colors=dominant_colors,
-                estimated_quality=estimated_quality
-            )
-            
-        except Exception as e:
-            logger.error(f"Semantic analysis failed: {e}")
-            raise HTTPException(status_code=500, detail=f"Semantic analysis failed: {str(e)}")
+class ProcessOutput:
+    """Everything /process-image reports for one upload"""
+    semantics: SemanticAnalysis
+    compression_settings: CompressionSettings
+    data: bytes
+    renditions: Optional[List[Tuple[Dict[str, Any], bytes]]] = None
+    effort: Optional[Dict[str, Any]] = None
+    perceptual: Optional[Dict[str, Any]] = None
+    passthrough: Optional[Dict[str, Any]] = None
 
-    def _calculate_brightness(self, img_array: np.ndarray) -> float:
-        """Calculate average brightness of image"""
-        gray = np.mean(img_array, axis=2)
-        return float(np.mean(gray) / 255.0)
+# Worker pool running SELICProcessor stages (SELIC_WORKERS / SELIC_POOL_KIND)
+worker_pool = pool_from_env()
 
-    def _estimate_complexity(self, img_array: np.ndarray) -> float:
-        """Estimate image complexity using edge detection"""
-        gray = np.mean(img_array, axis=2)
-        
-        # Simple edge detection (Sobel-like)
-        dy, dx = np.gradient(gray)
-        edge_magnitude = np.sqrt(dx**2 + dy**2)
-        
-        # Normalize complexity score
-        complexity = np.mean(edge_magnitude) / 128.0
-        return min(1.0, max(0.0, complexity))
+# Result caches keyed on upload hash + processor version.
+# Analysis and compressed output are cached separately so analyze -> process reuses the analysis.
+CACHE_DIR = os.getenv("SELIC_CACHE_DIR")  # Optional on-disk tier
+analysis_cache = ResultCache(
+    "analysis",
+    max_entries=int(os.getenv("SELIC_ANALYSIS_CACHE_ENTRIES", "4096")),
+    max_bytes=int(os.getenv("SELIC_ANALYSIS_CACHE_BYTES", str(16 * 1024 * 1024))),
+    disk_dir=CACHE_DIR,
+    max_disk_bytes=int(os.getenv("SELIC_ANALYSIS_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+)
+output_cache = ResultCache(
+    "output",
+    max_entries=int(os.getenv("SELIC_OUTPUT_CACHE_ENTRIES", "256")),
+    max_bytes=int(os.getenv("SELIC_OUTPUT_CACHE_BYTES", str(256 * 1024 * 1024))),
+    disk_dir=CACHE_DIR,
+    max_disk_bytes=int(os.getenv("SELIC_OUTPUT_CACHE_DISK_BYTES", str(4 * 1024 * 1024 * 1024)))
+)
 
-    def _extract_dominant_colors(self, img_array: np.ndarray, n_colors: int = 5) -> List[List[int]]:
-        """Extract dominant colors using color quantization"""
-        pixels = img_array.reshape(-1, 3)
-        
-        # Simple color clustering (would use k-means in production)
-        unique_colors, counts = np.unique(pixels, axis=0, return_counts=True)
-        
-        # Sort by frequency and take top N
-        sorted_indices = np.argsort(counts)[::-1]
-        dominant = unique_colors[sorted_indices[:n_colors]]
-        
-        return [color.tolist() for color in dominant]
-
-    def _generate_mock_description(self, brightness: float, complexity: float, 
-                                 dominant_colors: List[List[int]], size: tuple) -> str:
-        """Generate mock semantic description (replace with BLIP)"""
-        brightness_term = "bright" if brightness > 0.7 else "medium-lit" if brightness > 0.3 else "dark"
-        complexity_term = "highly detailed" if complexity > 0.4 else "simple"
-        orientation = "landscape" if size[0] > size[1] else "portrait" if size[1] > size[0] else "square"
-        
-        # Analyze dominant color
-        if dominant_colors:
-            r, g, b = dominant_colors[0]
-            if r > g and r > b:
-                color_term = "red-toned"
-            elif g > r and g > b:
-                color_term = "green-toned"
-            elif b > r and b > g:
-                color_term = "blue-toned"
-            else:
-                color_term = "neutral-toned"
-        else:
-            color_term = "mixed-color"
-        
-        return f"A {brightness_term} {complexity_term} {orientation} {color_term} image"
+# Uploads whose perceptual hash is within SELIC_NEAR_DUPLICATE_DISTANCE bits of an earlier one, and
+# whose mean colour is close to its, reuse its analysis (burst shots, re-uploads of lightly edited
+# images); 0 entries disables it
+near_duplicates = NearDuplicateIndex(
+    max_distance=int(os.getenv("SELIC_NEAR_DUPLICATE_DISTANCE", "8")),
+    max_entries=int(os.getenv("SELIC_NEAR_DUPLICATE_ENTRIES", "16384")),
+    max_color_distance=float(os.getenv("SELIC_NEAR_DUPLICATE_COLOR_DISTANCE", "0.06")),
+    min_spread=float(os.getenv("SELIC_NEAR_DUPLICATE_MIN_SPREAD", "0.02"))
+)
 
-    def _calculate_optimal_quality(self, brightness: float, complexity: float, size: tuple) -> float:
-        """Calculate optimal compression quality based on image characteristics"""
-        base_quality = 0.85
-        
-        # Adjust for complexity
-        if complexity > 0.4:
-            base_quality += 0.1  # Higher quality for complex images
-        
-        # Adjust for brightness
-        if brightness < 0.3:
-            base_quality += 0.05  # Higher quality for dark images
-        
-        # Adjust for size
-        pixel_count = size[0] * size[1]
-        if pixel_count > 4000000:  # > 4MP
-            base_quality -= 0.05  # Slightly lower quality for very high-res
-        
-        return min(0.95, max(0.7, base_quality))
+# JPEG uploads that a re-encode cannot beat are returned untouched (SELIC_PASSTHROUGH=0 always re-encodes)
+PASSTHROUGH = os.getenv("SELIC_PASSTHROUGH", "1") != "0"
 
-    def optimize_compression(self, image: Image.Image, semantics: SemanticAnalysis) -> CompressionSettings:
-        """Determine optimal compression settings based on semantic analysis"""
-        quality = int(semantics.estimated_quality * 100)
-        
-        # Format selection based on content
-        if semantics.complexity > 0.4:
-            format_type = "JPEG"  # Better for complex, natural images
-        elif len(semantics.dominant_colors) <= 3:
-            format_type = "WEBP"  # Better for simple graphics
+# Pixel / memory budgets for decode-heavy work (SELIC_ADMISSION_*, SELIC_CLIENT_CONCURRENCY)
+admission = AdmissionController()
+
+# Background jobs (POST /jobs): as many run at once as there are workers (SELIC_JOB_CONCURRENCY),
+# finished ones are kept for SELIC_JOB_TTL_S (SELIC_MAX_JOBS / SELIC_JOB_MAX_BYTES)
+job_store = JobStore(concurrency=int(os.getenv("SELIC_JOB_CONCURRENCY", str(worker_pool.max_workers))))
+
+# Micro-batching for single-image analysis: decode/resize run per request, and the model step
+# runs once per batch. Off (0) by default: the current analysis is per-image numpy with no batched
+# model behind it, so the window and the extra worker round trip would only add latency.
+ANALYSIS_BATCH_SIZE = int(os.getenv("SELIC_ANALYSIS_BATCH_SIZE", "16"))
+ANALYSIS_BATCH_WAIT_MS = float(os.getenv("SELIC_ANALYSIS_BATCH_WAIT_MS", "0"))
+
+async def _analyze_prepared(prepared: List[Tuple[Any, Tuple[int, int]]]) -> List[Tuple[SemanticAnalysis, CompressionSettings]]:
+    arrays = [img_array for img_array, _ in prepared]
+    sizes = [size for _, size in prepared]
+    return await worker_pool.run(analyze_arrays_task, arrays, sizes)
+
+analysis_batcher = MicroBatcher(
+    _analyze_prepared, max_batch_size=ANALYSIS_BATCH_SIZE, max_wait_ms=ANALYSIS_BATCH_WAIT_MS,
+    name="analysis_batch"
+)
+
+def analysis_key(digest: str) -> str:
+    # Analysis depends on the worker configuration (decode backend, processor options)
+    return cache_key(digest, PROCESSOR_VERSION, worker_pool.cache_tag)
+
+def output_key(upload: SpooledUpload, settings: CompressionSettings, *parts: str) -> str:
+    # Outputs depend on the worker configuration too (region-aware smoothing, quality metric, strip cap)
+    return cache_key(
+        upload.digest, PROCESSOR_VERSION, worker_pool.cache_tag, json.dumps(asdict(settings), sort_keys=True), *parts
+    )
+
+def _encode_analysis(semantics: SemanticAnalysis, compression_settings: CompressionSettings) -> bytes:
+    return json.dumps({
+        "semantics": asdict(semantics),
+        "compression_settings": asdict(compression_settings)
+    }).encode("utf-8")
+
+def _decode_analysis(cached: bytes) -> Tuple[SemanticAnalysis, CompressionSettings]:
+    payload = json.loads(cached)
+    return (
+        SemanticAnalysis(**payload["semantics"]),
+        CompressionSettings(**payload["compression_settings"])
+    )
+
+def _index_analysis(upload: SpooledUpload, semantics: SemanticAnalysis) -> None:
+    if semantics.perceptual_hash is not None and semantics.mean_color is not None:
+        near_duplicates.add(
+            int(semantics.perceptual_hash, 16), upload.digest, semantics.mean_color, semantics.luma_spread,
+            size_class(upload.dimensions)
+        )
+
+def reuse_near_duplicate(upload: SpooledUpload, perceptual_hash: str, mean_color: List[float],
+                         luma_spread: float) -> Optional[Tuple[SemanticAnalysis, CompressionSettings]]:
+    """Cached analysis of an earlier upload within the near-duplicate distance, marked as reused
+
+    Only an upload of the same size class (orientation, high resolution or not) qualifies, since
+    the description and quality target depend on it.
+    """
+    if not near_duplicates.enabled:
+        return None
+    match = near_duplicates.find(
+        int(perceptual_hash, 16), mean_color, luma_spread, size_class(upload.dimensions), exclude=upload.digest
+    )
+    if match is None:
+        return None
+    original, distance = match
+    cached = analysis_cache.get(analysis_key(original))
+    if cached is None:
+        return None
+    semantics, compression_settings = _decode_analysis(cached)
+    # The earlier upload may be another client's, so its digest stays in the log
+    logger.info(f"Reusing analysis of {original} for near-duplicate {upload.digest} ({distance} bits)")
+    semantics = replace(
+        semantics, perceptual_hash=perceptual_hash, mean_color=mean_color, luma_spread=luma_spread,
+        near_duplicate={"distance": distance}
+    )
+    return semantics, compression_settings
+
+async def get_analysis(upload: SpooledUpload) -> Tuple[SemanticAnalysis, CompressionSettings]:
+    """Semantic analysis + compression settings, served from cache when the same bytes were seen before
+    
+    A near-duplicate of an earlier upload reuses that upload's analysis, skipping the model step.
+    """
+    key = analysis_key(upload.digest)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        semantics, compression_settings = _decode_analysis(cached)
+        _index_analysis(upload, semantics)
+        return semantics, compression_settings
+    
+    # Workers open the spooled file by path, so only the path crosses the process boundary
+    if ANALYSIS_BATCH_WAIT_MS > 0 or near_duplicates.enabled:
+        img_array, original_size, signature = await worker_pool.run(prepare_task, upload.path)
+        reused = reuse_near_duplicate(upload, **signature)
+        if reused is not None:
+            semantics, compression_settings = reused
+        elif ANALYSIS_BATCH_WAIT_MS > 0:
+            semantics, compression_settings = await analysis_batcher.submit((img_array, original_size))
         else:
-            format_type = "JPEG"
-        
-        # Bit allocation strategy (SELIC-inspired)
-        bit_allocation = {
-            "high_frequency": 1.0 + semantics.complexity,
-            "mid_frequency": 1.0,
-            "low_frequency": 1.0 - semantics.complexity * 0.3,
-            "semantic_regions": 1.4  # Extra bits for important regions
-        }
-        
-        # Priority regions (mock - would use attention mechanisms in production)
-        priority_regions = []
-        if "portrait" in semantics.description:
-            priority_regions.append({
-                "region": "center",
-                "weight": 1.5,
-                "reason": "likely subject/face"
-            })
-        
-        optimization_level = "high" if semantics.complexity > 0.3 else "standard"
-        
-        return CompressionSettings(
-            quality=quality,
-            format=format_type,
-            optimization_level=optimization_level,
-            bit_allocation=bit_allocation,
-            priority_regions=priority_regions
+            [(semantics, compression_settings)] = await worker_pool.run(
+                analyze_arrays_task, [img_array], [original_size]
+            )
+    else:
+        semantics, compression_settings = await worker_pool.run(analyze_task, upload.path)
+    analysis_cache.put(key, _encode_analysis(semantics, compression_settings))
+    _index_analysis(upload, semantics)
+    return semantics, compression_settings
+
+async def get_analysis_batch(items: List[BatchUpload]) -> None:
+    """Fill in analysis for a chunk of uploads; cache misses go to one vectorized worker call"""
+    misses = []
+    for item in items:
+        if item.error is not None:
+            continue
+        cached = analysis_cache.get(analysis_key(item.upload.digest))
+        if cached is not None:
+            item.semantics, item.compression_settings = _decode_analysis(cached)
+            _index_analysis(item.upload, item.semantics)
+        else:
+            misses.append(item)
+    
+    if not misses:
+        return
+    
+    results = await worker_pool.run(analyze_batch_task, [item.upload.path for item in misses])
+    for item, result in zip(misses, results):
+        if isinstance(result, str):
+            item.error = result
+            continue
+        # The chunk was analyzed in one call already; near-duplicates still report (and share)
+        # the earlier analysis, so a burst gets consistent results
+        semantics = result[0]
+        reused = reuse_near_duplicate(
+            item.upload, semantics.perceptual_hash, semantics.mean_color, semantics.luma_spread
         )
+        item.semantics, item.compression_settings = reused or result
+        analysis_cache.put(
+            analysis_key(item.upload.digest), _encode_analysis(item.semantics, item.compression_settings)
+        )
+        _index_analysis(item.upload, item.semantics)
+
+def _cached_output(key: str) -> Optional[Tuple[bytes, Optional[Dict[str, Any]]]]:
+    """Cached output and its perceptual quality (stored alongside as `{key}-quality`)"""
+    cached = output_cache.get(key)
+    cached_quality = output_cache.get(f"{key}-quality")
+    if cached is None or cached_quality is None:
+        return None
+    return cached, json.loads(cached_quality)
+
+def _cache_output(key: str, data: bytes, perceptual: Optional[Dict[str, Any]]) -> None:
+    output_cache.put(key, data)
+    output_cache.put(f"{key}-quality", json.dumps(perceptual).encode("utf-8"))
+
+def _read_upload(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def _passthrough_output(upload: SpooledUpload, outcome: str
+                              ) -> Tuple[bytes, Dict[str, Any], Dict[str, Any]]:
+    """The upload itself as the output; its MS-SSIM against itself is exact, so nothing is measured"""
+    PASSTHROUGH_DECISIONS.inc(1.0, outcome)
+    data = await asyncio.to_thread(_read_upload, upload.path)
+    report = {"source_quality": upload.jpeg.quality, "encode_skipped": outcome == "skipped"}
+    return data, asdict(PerceptualQuality(ms_ssim=1.0, ssim=1.0)), report
 
-    def apply_optimized_compression(self, image: Image.Image, 
-                                  settings: CompressionSettings) -> bytes:
-        """Apply optimized compression with SELIC-inspired settings"""
+async def get_compressed(upload: SpooledUpload, settings: CompressionSettings
+                         ) -> Tuple[bytes, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Compressed output, its MS-SSIM and a pass-through report (None unless the upload was returned as is)
+    
+    Outputs are served from cache when the same bytes and settings were seen before. A JPEG upload
+    comes back untouched when its header shows a re-encode cannot beat it, or when the encode
+    came out no smaller than the upload.
+    """
+    if PASSTHROUGH and skips_encode(upload.jpeg, settings):
+        return await _passthrough_output(upload, "skipped")
+    
+    key = output_key(upload, settings)
+    cached = _cached_output(key)
+    if cached is not None:
+        compressed_data, perceptual = cached
+    else:
+        compressed_data, perceptual = await worker_pool.run(compress_task, upload.path, settings)
+        perceptual = asdict(perceptual) if perceptual is not None else None
+        _cache_output(key, compressed_data, perceptual)
+    
+    if PASSTHROUGH and can_substitute(upload.jpeg, settings) and len(compressed_data) >= upload.size:
+        return await _passthrough_output(upload, "kept_original")
+    PASSTHROUGH_DECISIONS.inc(1.0, "encoded")
+    return compressed_data, perceptual, None
+
+async def get_renditions(upload: SpooledUpload, settings: CompressionSettings, widths: List[int]
+                         ) -> Tuple[bytes, List[Tuple[Dict[str, Any], bytes]], Optional[Dict[str, Any]]]:
+    """Full-size output, the rendition ladder and the full size's MS-SSIM; each rendition is its own cache entry"""
+    key = output_key(upload, settings, "renditions=" + ",".join(map(str, widths)))
+    cached_meta = output_cache.get(f"{key}-meta")
+    cached_full = _cached_output(f"{key}-0")
+    if cached_meta is not None and cached_full is not None:
+        meta = json.loads(cached_meta)
+        blobs = [output_cache.get(f"{key}-{i}") for i in range(1, len(meta) + 1)]
+        if all(blob is not None for blob in blobs):
+            return cached_full[0], list(zip(meta, blobs)), cached_full[1]
+    
+    compressed_data, renditions, perceptual = await worker_pool.run(
+        renditions_task, upload.path, settings, widths
+    )
+    perceptual = asdict(perceptual) if perceptual is not None else None
+    meta = [asdict(rendition) for rendition, _ in renditions]
+    _cache_output(f"{key}-0", compressed_data, perceptual)
+    for i, (_, data) in enumerate(renditions, start=1):
+        output_cache.put(f"{key}-{i}", data)
+    output_cache.put(f"{key}-meta", json.dumps(meta).encode("utf-8"))
+    return compressed_data, list(zip(meta, (data for _, data in renditions))), perceptual
+
+async def get_compressed_with_effort(upload: SpooledUpload, settings: CompressionSettings, effort: str,
+                                     deadline: Optional[float]
+                                     ) -> Tuple[bytes, Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Output at an effort tier, plus a report of the tier actually used and the output's MS-SSIM
+
+    Every tier, archival included, has its own cache entries: get_compressed may have stored a
+    baseline strip-path JPEG (SELIC_STRIP_MEMORY_BYTES) under the untagged key. Outputs from a
+    deadline fallback are not cached, so a later request with more time still gets the tier it
+    asked for.
+    """
+    key = output_key(upload, settings, f"effort={effort}")
+    cached = _cached_output(key)
+    if cached is not None:
+        return cached[0], {
+            "requested": effort, "used": effort, "budget_ms": None, "estimated_ms": None,
+            "elapsed_ms": 0.0, "fell_back": False, "cached": True
+        }, cached[1]
+    
+    compressed_data, result, perceptual = await worker_pool.run(
+        effort_compress_task, upload.path, settings, effort, deadline
+    )
+    perceptual = asdict(perceptual) if perceptual is not None else None
+    if not result.fell_back:
+        _cache_output(key, compressed_data, perceptual)
+    return compressed_data, dict(asdict(result), cached=False), perceptual
+
+def resolve_effort(request: Request, effort: Optional[str]) -> Tuple[Optional[str], Optional[float]]:
+    """Effort tier from ?effort= and an absolute deadline from the X-SELIC-Deadline-Ms header"""
+    if effort is not None and effort not in EFFORT_TIERS:
+        raise HTTPException(status_code=400, detail=f"effort must be one of: {', '.join(EFFORT_TIERS)}")
+    deadline = None
+    deadline_ms = request.headers.get(DEADLINE_HEADER)
+    if deadline_ms is not None:
         try:
-            # Pre-processing based on semantic analysis
-            processed_image = self._preprocess_image(image, settings)
-            
-            # Determine output format
-            output_format = "WEBP" if settings.format == "WEBP" else "JPEG"
-            
-            # Compression with optimized settings
-            output_buffer = io.BytesIO()
-            
-            if output_format == "WEBP":
-                processed_image.save(
-                    output_buffer,
-                    format="WEBP",
-                    quality=settings.quality,
-                    method=6,  # Maximum compression effort
-                    optimize=True
-                )
-            else:
-                processed_image.save(
-                    output_buffer,
-                    format="JPEG",
-                    quality=settings.quality,
-                    optimize=True,
-                    progressive=True
-                )
-            
-            return output_buffer.getvalue()
-            
-        except Exception as e:
-            logger.error(f"Compression failed: {e}")
-            raise HTTPException(status_code=500, detail=f"Compression failed: {str(e)}")
+            deadline_ms = float(deadline_ms)
+        except ValueError:
+            deadline_ms = -1
+        if not deadline_ms > 0:
+            raise HTTPException(status_code=400, detail=f"{DEADLINE_HEADER} must be a positive number of milliseconds")
+        received_at = getattr(request.state, "received_at", time.time())
+        deadline = received_at + deadline_ms / 1000
+    if effort is None and deadline is None:
+        return None, None
+    return effort or DEFAULT_EFFORT, deadline
 
-    def _preprocess_image(self, image: Image.Image, settings: CompressionSettings) -> Image.Image:
-        """Apply semantic-guided preprocessing"""
-        processed = image.copy()
-        
-        # Semantic-aware enhancements
-        if settings.optimization_level == "high":
-            # Subtle sharpening for complex images
-            enhancer = ImageEnhance.Sharpness(processed)
-            processed = enhancer.enhance(1.1)
-            
-            # Contrast adjustment based on content
-            contrast_enhancer = ImageEnhance.Contrast(processed)
-            processed = contrast_enhancer.enhance(1.05)
-        
-        return processed
+def parse_rendition_widths(renditions: Optional[str]) -> Optional[List[int]]:
+    """Widths from ?renditions= ("default" or a comma-separated list such as "320,640,1280")"""
+    if renditions is None:
+        return None
+    if renditions == "default":
+        return DEFAULT_RENDITION_WIDTHS
+    try:
+        widths = sorted({int(width) for width in renditions.split(",")}, reverse=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="renditions must be 'default' or comma-separated widths")
+    if len(widths) > MAX_RENDITIONS or any(width < MIN_RENDITION_WIDTH for width in widths):
+        raise HTTPException(
+            status_code=400,
+            detail=f"renditions takes up to {MAX_RENDITIONS} widths of at least {MIN_RENDITION_WIDTH}px"
+        )
+    return widths
+
+async def get_rate_controlled(upload: SpooledUpload, settings: CompressionSettings, target_bytes: int
+                              ) -> Tuple[bytes, Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Output searched to fit target_bytes, plus the rate-control report and MS-SSIM (cached together)"""
+    key = output_key(upload, settings, f"target={target_bytes}")
+    cached = _cached_output(key)
+    cached_report = output_cache.get(f"{key}-meta")
+    if cached is not None and cached_report is not None:
+        return cached[0], json.loads(cached_report), cached[1]
+    
+    compressed_data, result, perceptual = await worker_pool.run(
+        rate_controlled_compress_task, upload.path, settings, target_bytes
+    )
+    report = asdict(result)
+    perceptual = asdict(perceptual) if perceptual is not None else None
+    _cache_output(key, compressed_data, perceptual)
+    output_cache.put(f"{key}-meta", json.dumps(report).encode("utf-8"))
+    return compressed_data, report, perceptual
+
+async def get_min_quality(upload: SpooledUpload, settings: CompressionSettings,
+                          min_ms_ssim: float) -> Tuple[bytes, Dict[str, Any], Dict[str, Any]]:
+    """Smallest output reaching min_ms_ssim, plus the search report and its MS-SSIM (cached together)"""
+    key = output_key(upload, settings, f"min_ms_ssim={min_ms_ssim}")
+    cached = output_cache.get(key)
+    cached_report = output_cache.get(f"{key}-meta")
+    if cached is not None and cached_report is not None:
+        report = json.loads(cached_report)
+    else:
+        cached, result = await worker_pool.run(min_quality_compress_task, upload.path, settings, min_ms_ssim)
+        report = asdict(result)
+        output_cache.put(key, cached)
+        output_cache.put(f"{key}-meta", json.dumps(report).encode("utf-8"))
+    return cached, report, {"ms_ssim": report["ms_ssim"], "ssim": report["ssim"]}
+
+def resolve_target_bytes(upload: SpooledUpload, target_kb: Optional[float],
+                         target_bpp: Optional[float]) -> Optional[int]:
+    """Byte budget from ?target_kb= (KiB) or ?target_bpp= (bits per pixel), if either was given"""
+    if target_kb is not None and target_bpp is not None:
+        raise HTTPException(status_code=400, detail="Pass either target_kb or target_bpp, not both")
+    if target_kb is not None:
+        return int(target_kb * 1024)
+    if target_bpp is not None:
+        return int(target_bpp * upload.pixel_count / 8)
+    return None
+
+def semantic_identity(semantics: SemanticAnalysis) -> Dict[str, Any]:
+    """Perceptual hash, plus the upload whose analysis was reused when this one is a near-duplicate"""
+    identity: Dict[str, Any] = {"perceptual_hash": semantics.perceptual_hash}
+    if semantics.near_duplicate is not None:
+        identity["near_duplicate"] = semantics.near_duplicate
+    return identity
+
+def output_quality(compression_settings: CompressionSettings,
+                   passthrough: Optional[Dict[str, Any]]) -> Optional[int]:
+    """Quality the returned bytes are at: the source's own when the upload came back untouched
+    (None if its tables match no IJG quality), otherwise the quality they were encoded at"""
+    if passthrough is not None:
+        return passthrough["source_quality"]
+    return compression_settings.quality
+
+def build_analysis_response(semantics: SemanticAnalysis, compression_settings: CompressionSettings,
+                            upload: SpooledUpload) -> Dict[str, Any]:
+    """Response body shared by /analyze-image and /analyze-images"""
+    return {
+        "semantics": {
+            "description": semantics.description,
+            "confidence": semantics.confidence,
+            "complexity": semantics.complexity,
+            "brightness": semantics.brightness,
+            "dominant_colors": semantics.dominant_colors,
+            "estimated_quality": semantics.estimated_quality,
+            **semantic_identity(semantics)
+        },
+        "compression_settings": {
+            "quality": compression_settings.quality,
+            "format": compression_settings.format,
+            "optimization_level": compression_settings.optimization_level,
+            "bit_allocation": compression_settings.bit_allocation,
+            "priority_regions_count": len(compression_settings.priority_regions)
+        },
+        "image_info": {
+            "original_size": upload.size,
+            "dimensions": upload.dimensions,
+            "mode": upload.mode,
+            "format": upload.format
+        }
+    }
+
+def suggest_caption(semantics: SemanticAnalysis) -> Tuple[str, List[str]]:
+    """Suggested caption and hashtags derived from the semantic analysis"""
+    # Generate suggested caption
+    suggested_caption = f"✨ {semantics.description}"
+    
+    # Generate hashtags based on analysis
+    hashtags = []
+    if semantics.brightness > 0.7:
+        hashtags.append("#bright")
+    elif semantics.brightness < 0.3:
+        hashtags.append("#moody")
+    
+    if semantics.complexity > 0.4:
+        hashtags.append("#detailed")
+    
+    if "portrait" in semantics.description:
+        hashtags.append("#portrait")
+    elif "landscape" in semantics.description:
+        hashtags.append("#landscape")
+    
+    if hashtags:
+        suggested_caption += " " + " ".join(hashtags[:2])
+    
+    return suggested_caption, hashtags
+
+def build_suggestions(semantics: SemanticAnalysis, compression_settings: CompressionSettings) -> Dict[str, Any]:
+    suggested_caption, hashtags = suggest_caption(semantics)
+    return {
+        "caption": suggested_caption,
+        "hashtags": hashtags,
+        "optimal_quality": compression_settings.quality
+    }
+
+@asynccontextmanager
+async def admitted(upload: SpooledUpload, request: Request, full_resolution: bool = True):
+    """Hold admission for an upload's estimated cost (429 / 503 with Retry-After when saturated)"""
+    started = time.perf_counter()
+    async with admission.admit(estimate_cost(upload, full_resolution), client_id(request)):
+        record_stage("admission", time.perf_counter() - started)
+        yield
 
-# Global processor instance
-selic_processor = SELICProcessor()
+def encode_base64(data: bytes) -> str:
+    with timed_request_stage("base64"):
+        return base64.b64encode(data).decode('utf-8')
+
+def build_process_response(semantics: SemanticAnalysis, compression_settings: CompressionSettings,
+                           compressed_data: bytes, original_size: int,
+                           include_image: bool = True,
+                           renditions: Optional[List[Tuple[Dict[str, Any], bytes]]] = None,
+                           effort: Optional[Dict[str, Any]] = None,
+                           perceptual: Optional[Dict[str, Any]] = None,
+                           passthrough: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Response body shared by /process-image and /process-images (base64 image only in JSON mode)"""
+    # Statistics
+    compressed_size = len(compressed_data)
+    compression_ratio = original_size / compressed_size
+    size_savings = ((original_size - compressed_size) / original_size) * 100
+    
+    payload = {
+        "success": True,
+        "semantics": {
+            "description": semantics.description,
+            "confidence": semantics.confidence,
+            "complexity": semantics.complexity,
+            "brightness": semantics.brightness,
+            "dominant_colors": semantics.dominant_colors,
+            **semantic_identity(semantics)
+        },
+        "compression": {
+            "original_size": original_size,
+            "optimized_size": compressed_size,
+            "compression_ratio": round(compression_ratio, 2),
+            "size_savings_percent": round(size_savings, 1),
+            "quality": output_quality(compression_settings, passthrough),
+            "format": compression_settings.format,
+            "algorithm": "selic-inspired"
+        },
+        "suggestions": build_suggestions(semantics, compression_settings),
+        "enhanced_metadata": {
+            "semantic_description": semantics.description,
+            "semantic_confidence": semantics.confidence,
+            "estimated_complexity": semantics.complexity,
+            "brightness_level": semantics.brightness,
+            "dominant_colors": semantics.dominant_colors,
+            "compression_algorithm": "selic-inspired",
+            "optimized_quality": compression_settings.quality,
+            "compression_ratio": compression_ratio,
+            "size_savings_percent": size_savings,
+            "processed_at": datetime.now().isoformat()
+        }
+    }
+    
+    if perceptual is not None:
+        payload["compression"]["perceptual_quality"] = perceptual
+    if passthrough is not None:
+        payload["compression"]["passthrough"] = passthrough
+    if effort is not None:
+        payload["compression"]["effort"] = effort
+    
+    if renditions is not None:
+        payload["renditions"] = [
+            dict(meta, image=encode_base64(data)) if include_image else meta
+            for meta, data in renditions
+        ]
+    
+    if include_image:
+        # Encode compressed image
+        payload["processed_image"] = encode_base64(compressed_data)
+    return payload
+
+def build_compress_response(semantics: SemanticAnalysis, compression_settings: CompressionSettings,
+                            compressed_data: bytes, original_size: int,
+                            include_image: bool = True,
+                            rate_control: Optional[Dict[str, Any]] = None,
+                            effort: Optional[Dict[str, Any]] = None,
+                            min_quality: Optional[Dict[str, Any]] = None,
+                            perceptual: Optional[Dict[str, Any]] = None,
+                            passthrough: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Response body for /compress-image (base64 image only in JSON mode)"""
+    compressed_size = len(compressed_data)
+    
+    # Calculate compression ratio
+    compression_ratio = original_size / compressed_size
+    size_savings = ((original_size - compressed_size) / original_size) * 100
+    
+    payload = {
+        "semantics": {
+            "description": semantics.description,
+            "confidence": semantics.confidence,
+            "complexity": semantics.complexity,
+            "brightness": semantics.brightness,
+            **semantic_identity(semantics)
+        },
+        "compression_stats": {
+            "original_size": original_size,
+            "compressed_size": compressed_size,
+            "compression_ratio": round(compression_ratio, 2),
+            "size_savings_percent": round(size_savings, 1),
+            "quality_used": (rate_control or min_quality or {}).get(
+                "quality", output_quality(compression_settings, passthrough)
+            ),
+            "format_used": compression_settings.format
+        },
+        "enhanced_metadata": {
+            "semantic_description": semantics.description,
+            "semantic_confidence": semantics.confidence,
+            "estimated_complexity": semantics.complexity,
+            "dominant_colors": semantics.dominant_colors,
+            "brightness_level": semantics.brightness,
+            "compression_algorithm": "selic-inspired",
+            "optimized_quality": compression_settings.quality,
+            "optimization_level": compression_settings.optimization_level
+        }
+    }
+    
+    if rate_control is not None:
+        payload["compression_stats"]["rate_control"] = rate_control
+    if effort is not None:
+        payload["compression_stats"]["effort"] = effort
+    if min_quality is not None:
+        payload["compression_stats"]["min_quality"] = min_quality
+    if perceptual is not None:
+        payload["compression_stats"]["perceptual_quality"] = perceptual
+    if passthrough is not None:
+        payload["compression_stats"]["passthrough"] = passthrough
+    
+    if include_image:
+        # Encode compressed image as base64 for response
+        payload["compressed_image"] = encode_base64(compressed_data)
+    return payload
+
+def resolve_response_mode(request: Request, response_mode: Optional[str], streaming: bool = False) -> str:
+    """Pick json / binary / multipart from ?response_mode= or the Accept header (JSON by default)
+    
+    With `streaming`, ndjson and sse (Accept: application/x-ndjson / text/event-stream) too.
+    """
+    modes = RESPONSE_MODES + STREAM_MODES if streaming else RESPONSE_MODES
+    if response_mode is not None:
+        if response_mode not in modes:
+            raise HTTPException(
+                status_code=400,
+                detail=f"response_mode must be one of: {', '.join(modes)}"
+            )
+        return response_mode
+    
+    accept = request.headers.get("accept", "")
+    if streaming and "text/event-stream" in accept:
+        return "sse"
+    if streaming and "application/x-ndjson" in accept:
+        return "ndjson"
+    if "multipart/mixed" in accept:
+        return "multipart"
+    if any(media_type in accept for media_type in ("image/jpeg", "image/webp", "image/*")):
+        return "binary"
+    return "json"
+
+def render_image_response(payload: Dict[str, Any], compressed_data: bytes, 
+                          output_format: str, mode: str,
+                          renditions: Optional[List[Tuple[Dict[str, Any], bytes]]] = None) -> Response:
+    """Send the payload as JSON, raw image bytes with metadata headers, or multipart/mixed
+    
+    In multipart mode each rendition follows the full-size image as its own part.
+    """
+    if mode == "json":
+        return JSONResponse(payload)
+    
+    media_type = "image/webp" if output_format == "WEBP" else "image/jpeg"
+    
+    if mode == "binary":
+        stats = payload.get("compression_stats") or payload.get("compression") or {}
+        quality = stats.get("quality_used", stats.get("quality"))
+        headers = {
+            "X-SELIC-Original-Size": str(stats.get("original_size", "")),
+            "X-SELIC-Compression-Ratio": str(stats.get("compression_ratio", "")),
+            "X-SELIC-Quality": "" if quality is None else str(quality),
+            "X-SELIC-Format": output_format,
+            # ASCII-escaped JSON so it is a valid header value
+            "X-SELIC-Metadata": json.dumps(payload, separators=(",", ":"), ensure_ascii=True)
+        }
+        return Response(content=compressed_data, media_type=media_type, headers=headers)
+    
+    # multipart/mixed: JSON metadata part, then the image part streamed straight from the buffer
+    boundary = uuid.uuid4().hex
+    metadata = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    
+    def parts():
+        yield (
+            f"--{boundary}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(metadata)}\r\n\r\n"
+        ).encode("ascii") + metadata + b"\r\n"
+        yield (
+            f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+            f"Content-Length: {len(compressed_data)}\r\n\r\n"
+        ).encode("ascii")
+        yield compressed_data
+        for meta, data in renditions or []:
+            yield (
+                f"\r\n--{boundary}\r\nContent-Type: {media_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                f"X-SELIC-Rendition: {meta['width']}x{meta['height']}\r\n\r\n"
+            ).encode("ascii")
+            yield data
+        yield f"\r\n--{boundary}--\r\n".encode("ascii")
+    
+    return StreamingResponse(parts(), media_type=f"multipart/mixed; boundary={boundary}")
 
 @app.get("/")
 def root():
@@ -278,206 +817,571 @@ def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "processor_ready": selic_processor.initialized
+        "processor_ready": worker_pool.ready,
+        "worker_pool": worker_pool.stats(),
+        "analysis_batching": analysis_batcher.stats(),
+        "admission": admission.stats(),
+        "jobs": job_store.stats()
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition: stage / request latency histograms, in-flight, queue and byte counters"""
+    pool = worker_pool.stats()
+    caches = {"analysis": analysis_cache.stats(), "output": output_cache.stats()}
+    lines = []
+    for metric in (STAGE_DURATION, REQUEST_DURATION, STREAM_EVENT_LATENCY, REQUESTS, BYTES_IN, BYTES_OUT,
+                   PASSTHROUGH_DECISIONS):
+        lines += metric.render()
+    lines += render_samples(
+        "selic_requests_in_flight", "Requests being handled or streamed", "gauge",
+        {(): requests_in_flight}
+    )
+    lines += render_samples(
+        "selic_worker_queue_depth", "Tasks waiting for a worker slot", "gauge", {(): pool["queue_depth"]}
+    )
+    lines += render_samples(
+        "selic_worker_in_flight", "Tasks running on workers", "gauge", {(): pool["in_flight"]}
+    )
+    lines += render_samples(
+        "selic_worker_tasks_total", "Worker tasks finished", "counter",
+        {("completed",): pool["completed"], ("failed",): pool["failed"]}, ("outcome",)
+    )
+    transport = pool.get("transport")
+    if transport is not None:
+        lines += render_samples(
+            "selic_transport_directories", "Worker transport directories by state", "gauge",
+            {("live",): transport["live"], ("leaked",): transport["leaked"]}, ("state",)
+        )
+        lines += render_samples(
+            "selic_transport_bytes_total", "Bytes passed to / from workers through transport files", "counter",
+            {("to_workers",): transport["bytes_to_workers"], ("from_workers",): transport["bytes_from_workers"]},
+            ("direction",)
+        )
+    admission_stats = admission.stats()
+    lines += render_samples(
+        "selic_admission_active", "Requests holding admission", "gauge", {(): admission_stats["active"]}
+    )
+    lines += render_samples(
+        "selic_admission_waiting", "Requests queued for admission", "gauge", {(): admission_stats["waiting"]}
+    )
+    lines += render_samples(
+        "selic_admission_memory_bytes", "Estimated memory held by admitted requests", "gauge",
+        {(): admission_stats["memory_in_use"]}
+    )
+    lines += render_samples(
+        "selic_admission_pixels", "Pixels held by admitted requests", "gauge",
+        {(): admission_stats["pixels_in_use"]}
+    )
+    lines += render_samples(
+        "selic_admission_rejections_total", "Requests refused by admission control", "counter",
+        {
+            ("queue_full",): admission_stats["rejected_queue_full"],
+            ("timeout",): admission_stats["rejected_timeout"],
+            ("client_limit",): admission_stats["rejected_client_limit"],
+        },
+        ("reason",)
+    )
+    jobs = job_store.stats()
+    lines += render_samples(
+        "selic_jobs", "Background jobs held in the job store", "gauge",
+        {(status,): count for status, count in jobs["by_status"].items()}, ("status",)
+    )
+    lines += render_samples(
+        "selic_jobs_total", "Background jobs by outcome", "counter",
+        {
+            ("submitted",): jobs["submitted"],
+            ("succeeded",): jobs["succeeded"],
+            ("failed",): jobs["failed"],
+            ("evicted",): jobs["evicted"],
+            ("rejected_full",): jobs["rejected_full"],
+        },
+        ("outcome",)
+    )
+    lines += render_samples(
+        "selic_job_output_bytes", "Output bytes held by finished jobs", "gauge", {(): jobs["bytes_held"]}
+    )
+    batching = analysis_batcher.stats()
+    lines += render_samples(
+        "selic_analysis_batches_total", "Analysis micro-batches dispatched", "counter", {(): batching["batches"]}
+    )
+    lines += render_samples(
+        "selic_analysis_batch_items_total", "Requests analyzed through micro-batches", "counter",
+        {(): batching["items"]}
+    )
+    duplicates = near_duplicates.stats()
+    lines += render_samples(
+        "selic_near_duplicate_lookups_total", "Perceptual-hash lookups for near-duplicate uploads", "counter",
+        {("hit",): duplicates["hits"], ("miss",): duplicates["misses"]}, ("result",)
+    )
+    lines += render_samples(
+        "selic_cache_lookups_total", "Result cache lookups", "counter",
+        {
+            (name, result): stats[counter]
+            for name, stats in caches.items()
+            for result, counter in (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))
+        },
+        ("cache", "result")
+    )
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit/miss counters for the analysis and output caches and the near-duplicate index"""
+    return {
+        "processor_version": PROCESSOR_VERSION,
+        "analysis": analysis_cache.stats(),
+        "output": output_cache.stats(),
+        "near_duplicates": near_duplicates.stats()
     }
 
 @app.post("/analyze-image")
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(request: Request, file: UploadFile = File(...)):
     """Analyze image semantics using SELIC-inspired approach"""
+    upload = None
     try:
-        # Validate file type
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Read and process image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
-        original_size = len(image_data)
+        # Stream to a spooled file and validate from the header; decode happens in the worker pool
+        upload = await spool_upload(file)
         
-        # Perform semantic analysis
-        semantics = selic_processor.analyze_semantics(image)
+        # Perform semantic analysis and get optimization settings
+        async with admitted(upload, request, full_resolution=False):
+            semantics, compression_settings = await get_analysis(upload)
         
-        # Get optimization settings
-        compression_settings = selic_processor.optimize_compression(image, semantics)
-        
-        return {
-            "semantics": {
-                "description": semantics.description,
-                "confidence": semantics.confidence,
-                "complexity": semantics.complexity,
-                "brightness": semantics.brightness,
-                "dominant_colors": semantics.dominant_colors,
-                "estimated_quality": semantics.estimated_quality
-            },
-            "compression_settings": {
-                "quality": compression_settings.quality,
-                "format": compression_settings.format,
-                "optimization_level": compression_settings.optimization_level,
-                "bit_allocation": compression_settings.bit_allocation,
-                "priority_regions_count": len(compression_settings.priority_regions)
-            },
-            "image_info": {
-                "original_size": original_size,
-                "dimensions": image.size,
-                "mode": image.mode,
-                "format": image.format
-            }
-        }
+        return build_analysis_response(semantics, compression_settings, upload)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Image analysis failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if upload is not None:
+            upload.cleanup()
 
 @app.post("/compress-image")
-async def compress_image(file: UploadFile = File(...)):
-    """Compress image using SELIC-inspired optimization"""
+async def compress_image(request: Request, file: UploadFile = File(...), 
+                         response_mode: Optional[str] = Query(None),
+                         target_kb: Optional[float] = Query(None, gt=0),
+                         target_bpp: Optional[float] = Query(None, gt=0),
+                         effort: Optional[str] = Query(None),
+                         min_ms_ssim: Optional[float] = Query(None, gt=0, le=1)):
+    """Compress image using SELIC-inspired optimization
+    
+    Returns JSON with a base64 image by default; raw image bytes (`response_mode=binary` or
+    `Accept: image/*`) or multipart/mixed (`response_mode=multipart`) avoid the base64 overhead.
+    `target_kb` / `target_bpp` switch to rate control: quality is searched so the output fits the
+    budget, and `compression_stats.rate_control` reports how close it got.
+    `effort` (interactive / standard / archival) and the `X-SELIC-Deadline-Ms` header trade
+    encoder effort for latency; `compression_stats.effort` reports the tier used.
+    `min_ms_ssim` picks the lowest quality whose output still reaches that MS-SSIM against the
+    upload (`compression_stats.min_quality`). Every output's MS-SSIM is in
+    `compression_stats.perceptual_quality`. Without any of these, a JPEG upload that re-encoding
+    cannot beat is returned untouched and `compression_stats.passthrough` says so.
+    """
+    mode = resolve_response_mode(request, response_mode)
+    effort, deadline = resolve_effort(request, effort)
+    if min_ms_ssim is not None and effort is not None:
+        raise HTTPException(
+            status_code=400, detail=f"effort / {DEADLINE_HEADER} cannot be combined with min_ms_ssim"
+        )
+    upload = None
     try:
-        # Validate file type
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Read and process image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
-        original_size = len(image_data)
-        
-        # Perform semantic analysis
-        semantics = selic_processor.analyze_semantics(image)
-        
-        # Get optimization settings
-        compression_settings = selic_processor.optimize_compression(image, semantics)
-        
-        # Apply optimized compression
-        compressed_data = selic_processor.apply_optimized_compression(image, compression_settings)
-        compressed_size = len(compressed_data)
-        
-        # Calculate compression ratio
-        compression_ratio = original_size / compressed_size
-        size_savings = ((original_size - compressed_size) / original_size) * 100
+        # Stream to a spooled file and validate from the header; decode happens in the worker pool
+        upload = await spool_upload(file)
         
-        # Encode compressed image as base64 for response
-        compressed_b64 = base64.b64encode(compressed_data).decode('utf-8')
-        
-        return {
-            "compressed_image": compressed_b64,
-            "semantics": {
-                "description": semantics.description,
-                "confidence": semantics.confidence,
-                "complexity": semantics.complexity,
-                "brightness": semantics.brightness
-            },
-            "compression_stats": {
-                "original_size": original_size,
-                "compressed_size": compressed_size,
-                "compression_ratio": round(compression_ratio, 2),
-                "size_savings_percent": round(size_savings, 1),
-                "quality_used": compression_settings.quality,
-                "format_used": compression_settings.format
-            },
-            "enhanced_metadata": {
-                "semantic_description": semantics.description,
-                "semantic_confidence": semantics.confidence,
-                "estimated_complexity": semantics.complexity,
-                "dominant_colors": semantics.dominant_colors,
-                "brightness_level": semantics.brightness,
-                "compression_algorithm": "selic-inspired",
-                "optimized_quality": compression_settings.quality,
-                "optimization_level": compression_settings.optimization_level
-            }
-        }
+        target_bytes = resolve_target_bytes(upload, target_kb, target_bpp)
+        if target_bytes is not None and effort is not None:
+            raise HTTPException(
+                status_code=400, detail=f"effort / {DEADLINE_HEADER} cannot be combined with a size target"
+            )
+        if target_bytes is not None and min_ms_ssim is not None:
+            raise HTTPException(status_code=400, detail="Pass either a size target or min_ms_ssim, not both")
+        async with admitted(upload, request):
+            # Perform semantic analysis and get optimization settings
+            semantics, compression_settings = await get_analysis(upload)
+            
+            # Apply optimized compression, searching quality when a size or quality target was given
+            rate_control = effort_report = min_quality = passthrough = None
+            if effort is not None:
+                compressed_data, effort_report, perceptual = await get_compressed_with_effort(
+                    upload, compression_settings, effort, deadline
+                )
+            elif min_ms_ssim is not None:
+                compressed_data, min_quality, perceptual = await get_min_quality(
+                    upload, compression_settings, min_ms_ssim
+                )
+            elif target_bytes is None:
+                compressed_data, perceptual, passthrough = await get_compressed(upload, compression_settings)
+            else:
+                compressed_data, rate_control, perceptual = await get_rate_controlled(
+                    upload, compression_settings, target_bytes
+                )
+        payload = build_compress_response(
+            semantics, compression_settings, compressed_data, upload.size,
+            include_image=(mode == "json"), rate_control=rate_control, effort=effort_report,
+            min_quality=min_quality, perceptual=perceptual, passthrough=passthrough
+        )
+        return render_image_response(payload, compressed_data, compression_settings.format, mode)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Image compression failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if upload is not None:
+            upload.cleanup()
+
+def resolve_process_options(request: Request, renditions: Optional[str], effort: Optional[str]
+                            ) -> Tuple[Optional[List[int]], Optional[str], Optional[float]]:
+    """Rendition widths, effort tier and deadline for /process-image and /jobs (400 if they conflict)"""
+    widths = parse_rendition_widths(renditions)
+    effort, deadline = resolve_effort(request, effort)
+    if widths is not None and effort is not None:
+        raise HTTPException(status_code=400, detail=f"effort / {DEADLINE_HEADER} cannot be combined with renditions")
+    return widths, effort, deadline
+
+async def run_process_pipeline(upload: SpooledUpload, widths: Optional[List[int]] = None,
+                               effort: Optional[str] = None, deadline: Optional[float] = None,
+                               on_stage: Optional[Callable[[str], None]] = None) -> ProcessOutput:
+    """Analysis then compression, at an effort tier or with renditions (the caller holds admission)
+    
+    `on_stage` is called with "analysis" and "compress" as each step starts.
+    """
+    if on_stage is not None:
+        on_stage("analysis")
+    semantics, compression_settings = await get_analysis(upload)
+    
+    if on_stage is not None:
+        on_stage("compress")
+    return await run_compression(upload, semantics, compression_settings, widths, effort, deadline)
+
+async def run_compression(upload: SpooledUpload, semantics: SemanticAnalysis,
+                          compression_settings: CompressionSettings, widths: Optional[List[int]] = None,
+                          effort: Optional[str] = None, deadline: Optional[float] = None) -> ProcessOutput:
+    """The compression half of run_process_pipeline, once analysis is done"""
+    output = ProcessOutput(semantics, compression_settings, b"")
+    if effort is not None:
+        output.data, output.effort, output.perceptual = await get_compressed_with_effort(
+            upload, compression_settings, effort, deadline
+        )
+    elif widths is None:
+        output.data, output.perceptual, output.passthrough = await get_compressed(upload, compression_settings)
+    else:
+        output.data, output.renditions, output.perceptual = await get_renditions(
+            upload, compression_settings, widths
+        )
+    return output
 
 @app.post("/process-image")
-async def process_image_full(file: UploadFile = File(...)):
-    """Full SELIC-inspired processing pipeline"""
+async def process_image_full(request: Request, file: UploadFile = File(...), 
+                             response_mode: Optional[str] = Query(None),
+                             renditions: Optional[str] = Query(None),
+                             effort: Optional[str] = Query(None)):
+    """Full SELIC-inspired processing pipeline (response modes and effort as for /compress-image)
+    
+    `renditions=default` (or a list such as `320,640,1280`) adds a ladder of downscaled outputs
+    produced from the same decode, each resized from the previous step. `response_mode=ndjson`
+    or `sse` streams each stage's result as it completes (see stream_process_response).
+    """
+    mode = resolve_response_mode(request, response_mode, streaming=True)
+    widths, effort, deadline = resolve_process_options(request, renditions, effort)
+    if widths is not None and mode == "binary":
+        raise HTTPException(status_code=400, detail="renditions need response_mode=json or multipart")
+    upload = None
     try:
-        # Validate file type
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
+        # Stream to a spooled file and validate from the header; decode happens in the worker pool
+        upload = await spool_upload(file)
         
-        # Read and process image
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
-        original_size = len(image_data)
+        if mode in STREAM_MODES:
+            response = await stream_process_response(request, upload, mode, widths, effort, deadline)
+            # The stream owns the upload from here on
+            upload = None
+            return response
         
         # Full processing pipeline
-        semantics = selic_processor.analyze_semantics(image)
-        compression_settings = selic_processor.optimize_compression(image, semantics)
-        compressed_data = selic_processor.apply_optimized_compression(image, compression_settings)
-        
-        # Statistics
-        compressed_size = len(compressed_data)
-        compression_ratio = original_size / compressed_size
-        size_savings = ((original_size - compressed_size) / original_size) * 100
-        
-        # Generate suggested caption
-        suggested_caption = f"✨ {semantics.description}"
-        
-        # Generate hashtags based on analysis
-        hashtags = []
-        if semantics.brightness > 0.7:
-            hashtags.append("#bright")
-        elif semantics.brightness < 0.3:
-            hashtags.append("#moody")
-        
-        if semantics.complexity > 0.4:
-            hashtags.append("#detailed")
+        async with admitted(upload, request):
+            output = await run_process_pipeline(upload, widths, effort, deadline)
         
-        if "portrait" in semantics.description:
-            hashtags.append("#portrait")
-        elif "landscape" in semantics.description:
-            hashtags.append("#landscape")
-        
-        if hashtags:
-            suggested_caption += " " + " ".join(hashtags[:2])
-        
-        # Encode compressed image
-        compressed_b64 = base64.b64encode(compressed_data).decode('utf-8')
-        
-        return {
-            "success": True,
-            "processed_image": compressed_b64,
-            "semantics": {
-                "description": semantics.description,
-                "confidence": semantics.confidence,
-                "complexity": semantics.complexity,
-                "brightness": semantics.brightness,
-                "dominant_colors": semantics.dominant_colors
-            },
-            "compression": {
-                "original_size": original_size,
-                "optimized_size": compressed_size,
-                "compression_ratio": round(compression_ratio, 2),
-                "size_savings_percent": round(size_savings, 1),
-                "quality": compression_settings.quality,
-                "format": compression_settings.format,
-                "algorithm": "selic-inspired"
-            },
-            "suggestions": {
-                "caption": suggested_caption,
-                "hashtags": hashtags,
-                "optimal_quality": compression_settings.quality
-            },
-            "enhanced_metadata": {
-                "semantic_description": semantics.description,
-                "semantic_confidence": semantics.confidence,
-                "estimated_complexity": semantics.complexity,
-                "brightness_level": semantics.brightness,
-                "dominant_colors": semantics.dominant_colors,
-                "compression_algorithm": "selic-inspired",
-                "optimized_quality": compression_settings.quality,
-                "compression_ratio": compression_ratio,
-                "size_savings_percent": size_savings,
-                "processed_at": datetime.now().isoformat()
-            }
-        }
+        payload = build_process_response(
+            output.semantics, output.compression_settings, output.data, upload.size,
+            include_image=(mode == "json"), renditions=output.renditions, effort=output.effort,
+            perceptual=output.perceptual, passthrough=output.passthrough
+        )
+        return render_image_response(
+            payload, output.data, output.compression_settings.format, mode, renditions=output.renditions
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Full image processing failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if upload is not None:
+            upload.cleanup()
+
+async def stream_process_response(request: Request, upload: SpooledUpload, mode: str,
+                                  widths: Optional[List[int]], effort: Optional[str],
+                                  deadline: Optional[float]) -> StreamingResponse:
+    """/process-image as NDJSON lines or server-sent events, each sent as soon as its stage completes
+    
+    `analysis` (semantics, compression settings and suggestions) comes first, then `compression`
+    (the /process-image body without images, plus the request's stage timings) and `image` last
+    (the base64 output and any renditions). Every event carries `elapsed_ms` since the request
+    arrived. Admission is taken before the headers, so saturation is still a 429 / 503; failures
+    after that arrive as an `error` event.
+    """
+    stack = AsyncExitStack()
+    await stack.enter_async_context(admitted(upload, request))
+    timings = current_request_timings()
+    
+    async def release() -> None:
+        await stack.aclose()
+        upload.cleanup()
+    received_at = request.state.received_at
+    
+    def event(name: str, data: Dict[str, Any]) -> str:
+        elapsed = time.time() - received_at
+        STREAM_EVENT_LATENCY.observe(elapsed, name)
+        data = dict(data, elapsed_ms=round(elapsed * 1000, 1))
+        if mode == "sse":
+            return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+        return json.dumps({"event": name, **data}) + "\n"
+    
+    async def events():
+        try:
+            semantics, compression_settings = await get_analysis(upload)
+            yield event("analysis", dict(
+                build_analysis_response(semantics, compression_settings, upload),
+                suggestions=build_suggestions(semantics, compression_settings)
+            ))
+            
+            output = await run_compression(upload, semantics, compression_settings, widths, effort, deadline)
+            # Encoding is done; sending the image does not need the budget
+            await stack.aclose()
+            payload = build_process_response(
+                output.semantics, output.compression_settings, output.data, upload.size,
+                include_image=False, renditions=output.renditions, effort=output.effort,
+                perceptual=output.perceptual, passthrough=output.passthrough
+            )
+            yield event("compression", dict(
+                payload, timings_ms={stage: round(seconds * 1000, 1) for stage, seconds in (timings or {}).items()}
+            ))
+            
+            image = {"format": output.compression_settings.format, "processed_image": encode_base64(output.data)}
+            if output.renditions is not None:
+                image["renditions"] = [dict(meta, image=encode_base64(data)) for meta, data in output.renditions]
+            yield event("image", image)
+        except HTTPException as e:
+            yield event("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"Streamed image processing failed: {e}")
+            yield event("error", {"status_code": 500, "detail": str(e)})
+        finally:
+            await release()
+    
+    media_type = "text/event-stream" if mode == "sse" else "application/x-ndjson"
+    # release() also runs as a background task: a client that disconnects before the first event
+    # never starts the generator, so its finally would not
+    return StreamingResponse(
+        events(), media_type=media_type, background=BackgroundTask(release),
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def read_batch(files: List[UploadFile]) -> List[BatchUpload]:
+    """Spool batch uploads and validate headers; invalid items are marked instead of failing the batch"""
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} files per batch")
+    
+    items = []
+    for index, file in enumerate(files):
+        item = BatchUpload(index=index, filename=file.filename)
+        try:
+            item.upload = await spool_upload(file)
+        except HTTPException as e:
+            item.error = e.detail
+        items.append(item)
+    return items
+
+async def _batch_item_result(item: BatchUpload, analysis_task: asyncio.Task, compress: bool) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"index": item.index, "filename": item.filename}
+    try:
+        if item.error is None:
+            # The chunk's analysis is shared by every item in it
+            await asyncio.shield(analysis_task)
+        if item.error is not None:
+            result.update(success=False, error=item.error)
+        elif compress:
+            # Batch items share the global budgets but not the per-client limit
+            async with admission.admit(estimate_cost(item.upload)):
+                compressed_data, perceptual, passthrough = await get_compressed(
+                    item.upload, item.compression_settings
+                )
+            result.update(build_process_response(
+                item.semantics, item.compression_settings, compressed_data, item.upload.size,
+                perceptual=perceptual, passthrough=passthrough
+            ))
+        else:
+            result.update(build_analysis_response(item.semantics, item.compression_settings, item.upload))
+    except Exception as e:
+        logger.error(f"Batch item {item.index} failed: {e}")
+        result.update(success=False, error=str(e))
+    finally:
+        # Drop the spooled file as soon as the item has been answered
+        if item.upload is not None:
+            item.upload.cleanup()
+    return result
+
+async def stream_batch(items: List[BatchUpload], compress: bool):
+    """Analyze uploads in vectorized chunks and yield one NDJSON line per item as it completes"""
+    chunk_tasks = []
+    item_tasks = []
+    for start in range(0, len(items), BATCH_CHUNK_SIZE):
+        chunk = items[start:start + BATCH_CHUNK_SIZE]
+        analysis_task = asyncio.ensure_future(get_analysis_batch(chunk))
+        chunk_tasks.append(analysis_task)
+        item_tasks.extend(
+            asyncio.ensure_future(_batch_item_result(item, analysis_task, compress))
+            for item in chunk
+        )
+    
+    try:
+        for next_item in asyncio.as_completed(item_tasks):
+            yield json.dumps(await next_item) + "\n"
+    finally:
+        # Client went away or we are done; stop any remaining work and drop spooled files
+        for task in item_tasks + chunk_tasks:
+            task.cancel()
+        for item in items:
+            if item.upload is not None:
+                item.upload.cleanup()
+
+@app.post("/analyze-images")
+async def analyze_images(files: List[UploadFile] = File(...)):
+    """Batch semantic analysis; streams one NDJSON line per image (with its index) as results complete"""
+    items = await read_batch(files)
+    return StreamingResponse(stream_batch(items, compress=False), media_type="application/x-ndjson")
+
+@app.post("/process-images")
+async def process_images(files: List[UploadFile] = File(...)):
+    """Batch full SELIC pipeline; streams one NDJSON line per image (with its index) as results complete"""
+    items = await read_batch(files)
+    return StreamingResponse(stream_batch(items, compress=True), media_type="application/x-ndjson")
+
+# Progress reported for each job stage; compression is the bulk of the work
+JOB_PROGRESS = {"admission": 0.05, "analysis": 0.1, "compress": 0.3}
+
+async def run_job(job: Job, upload: SpooledUpload, widths: Optional[List[int]],
+                  effort: Optional[str], deadline: Optional[float]) -> JobOutput:
+    """Body of a background job: /process-image's pipeline, with progress and timings kept on the job"""
+    # The request that submitted the job has already been answered; collect into the job instead
+    job.timings = start_request_timings()
+    job.update("admission", JOB_PROGRESS["admission"])
+    started = time.perf_counter()
+    # Jobs share the global budgets but not the per-client limit, like batch items
+    async with admission.admit(estimate_cost(upload)):
+        record_stage("admission", time.perf_counter() - started)
+        output = await run_process_pipeline(
+            upload, widths, effort, deadline, on_stage=lambda stage: job.update(stage, JOB_PROGRESS[stage])
+        )
+    payload = build_process_response(
+        output.semantics, output.compression_settings, output.data, upload.size,
+        include_image=False, renditions=output.renditions, effort=output.effort, perceptual=output.perceptual,
+        passthrough=output.passthrough
+    )
+    return JobOutput(payload, output.data, output.compression_settings.format, output.renditions)
+
+def job_status(job: Job) -> Dict[str, Any]:
+    return dict(
+        job.to_dict(), status_url=f"/jobs/{job.id}", events_url=f"/jobs/{job.id}/events",
+        result_url=f"/jobs/{job.id}/result"
+    )
+
+def get_job(job_id: str) -> Job:
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: Request, file: UploadFile = File(...),
+                     renditions: Optional[str] = Query(None),
+                     effort: Optional[str] = Query(None)):
+    """Queue the /process-image pipeline in the background and return a job id straight away
+    
+    Poll `GET /jobs/{id}` or follow `GET /jobs/{id}/events` (server-sent events), then fetch the
+    output from `GET /jobs/{id}/result`. `renditions` and `effort` are as for /process-image.
+    """
+    widths, effort, deadline = resolve_process_options(request, renditions, effort)
+    # Stream to a spooled file and validate from the header; the job owns it from here on
+    upload = await spool_upload(file)
+    try:
+        job = job_store.submit(
+            lambda job: run_job(job, upload, widths, effort, deadline), cleanup=upload.cleanup
+        )
+    except JobStoreFull as e:
+        upload.cleanup()
+        raise HTTPException(
+            status_code=503, detail=f"Server busy: {e}", headers={"Retry-After": str(admission.retry_after())}
+        )
+    return JSONResponse(status_code=202, content=job_status(job), headers={"Location": f"/jobs/{job.id}"})
+
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str):
+    """Status, stage and progress of a job; `result` holds the /process-image body (without images) once it succeeded"""
+    return job_status(get_job(job_id))
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(request: Request, job_id: str, response_mode: Optional[str] = Query(None)):
+    """A finished job's output as /process-image would have returned it (409 until it has succeeded)"""
+    mode = resolve_response_mode(request, response_mode)
+    job = get_job(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+    if job.output is None:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    
+    output = job.output
+    if output.renditions is not None and mode == "binary":
+        raise HTTPException(status_code=400, detail="renditions need response_mode=json or multipart")
+    payload = output.payload
+    if mode == "json":
+        payload = dict(payload, processed_image=encode_base64(output.data))
+        if output.renditions is not None:
+            payload["renditions"] = [dict(meta, image=encode_base64(data)) for meta, data in output.renditions]
+    return render_image_response(payload, output.data, output.output_format, mode, renditions=output.renditions)
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(request: Request, job_id: str):
+    """Server-sent events: `progress` for each stage, then one `succeeded` or `failed` event
+    
+    Reconnecting with a `Last-Event-ID` header resumes after that event.
+    """
+    job = get_job(job_id)
+    last_event_id = request.headers.get("last-event-id", "")
+    after = int(last_event_id) if last_event_id.isdigit() else 0
+    
+    async def events():
+        async for event in job.follow(after):
+            if event is None:
+                yield ": keepalive\n\n"
+                continue
+            name = event.status if event.status in FINISHED_STATES else "progress"
+            data = json.dumps(dict(event.to_dict(), job_id=job.id))
+            yield f"id: {event.seq}\nevent: {name}\ndata: {data}\n\n"
+    
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/jobs/{job_id}", status_code=204)
+def delete_job(job_id: str):
+    """Cancel a job if it is still running and drop it and its output"""
+    if job_store.remove(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return Response(status_code=204)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,249 @@
+"""
+Memory-bounded strip processing for very large images
+Panoramas and 50+ MP frames are held in a disk-backed memory map instead of on the heap. Decode
+writes into the map a chunk at a time, preprocessing passes over it in horizontal strips (each
+strip reading the overlap its filters need from its neighbours), and the JPEG encoder reads it
+back row by row. The map's pages are dropped from the process as each step moves on, so peak
+RSS follows the strip height, sized from SELIC_STRIP_MEMORY_BYTES, rather than the pixel count.
+"""
+
+import io
+import logging
+import mmap
+import os
+import tempfile
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from selic_kernels import AnalysisKernel
+
+logger = logging.getLogger(__name__)
+
+# Frame maps go here (SELIC_STRIP_DIR, else the upload spool dir, else the system temp dir).
+# It should be disk-backed: on a tmpfs the frame would still occupy memory, only not ours.
+STRIP_DIR = os.getenv("SELIC_STRIP_DIR") or os.getenv("SELIC_SPOOL_DIR")
+
+# Peak working memory per pixel of a strip (overlap included), measured with
+# benchmarks/bench_strips.py: the strip, its filtered and smoothed copies, the smoothing mask
+# and the conversions into and out of the 4 bytes/pixel frame
+STRIP_BYTES_PER_PIXEL = 28
+# The block-level saliency map and mask, the only state that grows with the whole frame
+STRIP_SIDEBAND_BYTES_PER_PIXEL = 0.1
+# Peak of the in-memory path (selic_admission.COMPRESS_BYTES_PER_PIXEL; not imported so this
+# module stays free of FastAPI): images above the cap at this rate take the strip path
+FULL_FRAME_BYTES_PER_PIXEL = 17
+STRIP_MODES = ("RGB", "L")
+
+DECODE_CHUNK_BYTES = 1024 * 1024
+# Rows per copy when a format has to be decoded in one piece first
+COPY_ROWS = 256
+
+
+class MappedFrame:
+    """A frame in an unlinked temp file, mapped shared so dropped pages are re-read, not lost
+
+    `image` is a PIL view of the map; RGB frames are stored as RGBX, the layout PIL keeps RGB in
+    anyway. Use as a context manager: the file goes away with the map.
+    """
+
+    def __init__(self, mode: str, size: Tuple[int, int], directory: Optional[str] = STRIP_DIR):
+        self.mode = mode
+        self.size = size
+        self.frame_mode = "RGBX" if mode == "RGB" else mode
+        length = max(1, size[0] * size[1] * Image.getmodebands(self.frame_mode))
+        fd, path = tempfile.mkstemp(prefix="selic-strips-", dir=directory)
+        try:
+            # Unlinked straight away, so nothing is left behind even if the worker is killed
+            os.unlink(path)
+            os.ftruncate(fd, length)
+            self._map = mmap.mmap(fd, length)
+        finally:
+            os.close(fd)
+        self.image = Image.frombuffer(self.frame_mode, size, self._map, "raw", self.frame_mode, 0, 1)
+        # The map is writable: without this, paste() and save() would first copy it to the heap
+        self.image.readonly = 0
+
+    def rows(self, top: int, bottom: int) -> Image.Image:
+        """Rows [top, bottom) as a new image in the source mode"""
+        strip = self.image.crop((0, top, self.size[0], bottom))
+        return strip if strip.mode == self.mode else strip.convert(self.mode)
+
+    def write(self, top: int, strip: Image.Image) -> None:
+        """Overwrite rows from `top` with `strip` (full width)"""
+        if strip.mode != self.frame_mode:
+            strip = strip.convert(self.frame_mode)
+        self.image.paste(strip, (0, top))
+
+    def release(self) -> None:
+        """Drop the map's pages from this process; they stay in the file and are faulted back on use"""
+        if hasattr(mmap, "MADV_DONTNEED"):
+            self._map.madvise(mmap.MADV_DONTNEED)
+
+    def close(self) -> None:
+        # The PIL view holds a buffer export, which has to go before the map can close
+        self.image = None
+        try:
+            self._map.close()
+        except BufferError:
+            # Still referenced (by a decoder in an exception's traceback): it unmaps when that goes
+            pass
+
+    def __enter__(self) -> "MappedFrame":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def strip_rows(size: Tuple[int, int], memory_bytes: int, align: int) -> int:
+    """Strip height that keeps the working set within memory_bytes, as a multiple of `align`"""
+    width, height = size
+    budget = memory_bytes - width * height * STRIP_SIDEBAND_BYTES_PER_PIXEL
+    rows = int(budget // (width * STRIP_BYTES_PER_PIXEL)) // align * align
+    if rows < align:
+        logger.warning(f"{width} px wide strips exceed the {memory_bytes} byte cap; using {align} rows")
+    return max(align, rows)
+
+
+def strips(height: int, rows: int) -> Iterator[Tuple[int, int]]:
+    """(top, bottom) of each strip, top to bottom"""
+    for top in range(0, height, rows):
+        yield top, min(height, top + rows)
+
+
+def map_strips(frame: MappedFrame, rows: int, margin: int,
+               fn: Callable[[Image.Image, int, int, int], Image.Image]) -> None:
+    """Replace the frame strip by strip with fn(source, start, top, bottom)
+
+    `source` holds rows [start, ...) of the frame: the strip [top, bottom) plus up to `margin`
+    rows on either side, and fn returns the new rows [top, bottom). Each result is written back
+    only once the next strip has been read, so every strip sees its neighbours' original rows.
+    """
+    assert margin <= rows
+    height = frame.size[1]
+    pending = None
+    for top, bottom in strips(height, rows):
+        start = max(0, top - margin)
+        source = frame.rows(start, min(height, bottom + margin))
+        if pending is not None:
+            frame.write(*pending)
+        pending = (top, fn(source, start, top, bottom))
+        del source
+        frame.release()
+    if pending is not None:
+        frame.write(*pending)
+        frame.release()
+
+
+class StripSaliency:
+    """AnalysisKernel.block_saliency over a frame that arrives as strips, in order
+
+    Strips are reduced by `reduction` (their heights a multiple of it) and each one's saliency
+    is taken once the first reduced row of the next is known, so the vertical gradient at strip
+    edges matches a whole-frame pass.
+    """
+
+    def __init__(self, kernel: AnalysisKernel, reduction: int, block: int):
+        self.kernel = kernel
+        self.reduction = reduction
+        self.block = block
+        self._blocks: List[np.ndarray] = []
+        self._pending: Optional[np.ndarray] = None
+        self._above: Optional[np.ndarray] = None
+
+    def add(self, strip: Image.Image) -> None:
+        small = np.asarray(strip.reduce(self.reduction).convert("RGB"))
+        if self._pending is not None:
+            self._emit(small[:1])
+        self._pending = small
+
+    def result(self) -> np.ndarray:
+        """The (ceil(H / block), ceil(W / block)) saliency map of the whole frame"""
+        if self._pending is not None:
+            self._emit(None)
+            self._pending = None
+        return np.concatenate(self._blocks)
+
+    def _emit(self, below: Optional[np.ndarray]) -> None:
+        parts = [part for part in (self._above, self._pending, below) if part is not None]
+        margins = (int(self._above is not None), int(below is not None))
+        self._blocks.append(self.kernel.block_saliency(np.concatenate(parts), self.block, margins))
+        self._above = self._pending[-1:]
+
+
+def decode_frame(image: Image.Image, directory: Optional[str] = STRIP_DIR) -> MappedFrame:
+    """Decode a lazily opened RGB or L image into a new MappedFrame (and close the image)
+
+    JPEG is decoded straight into the map a chunk at a time, dropping pages as it goes; other
+    formats are loaded whole first (one heap copy of the frame during the decode) and copied
+    across. Progressive JPEGs stay bounded on our side, but libjpeg buffers their coefficients.
+    """
+    if image.mode not in STRIP_MODES:
+        raise ValueError(f"Strip processing does not handle mode {image.mode}")
+    frame = MappedFrame(image.mode, image.size, directory)
+    try:
+        if image.format == "JPEG" and len(image.tile) == 1:
+            _decode_jpeg(image, frame)
+        else:
+            image.load()
+            for top, bottom in strips(image.height, COPY_ROWS):
+                frame.write(top, image.crop((0, top, image.width, bottom)))
+                frame.release()
+    except BaseException:
+        frame.close()
+        raise
+    finally:
+        image.close()
+    return frame
+
+
+def _decode_jpeg(image: Image.Image, frame: MappedFrame) -> None:
+    """ImageFile.load's decode loop, aimed at the map instead of a heap image"""
+    decoder_name, extents, offset, args = image.tile[0]
+    decoder = Image._getdecoder(frame.frame_mode, decoder_name, args, image.decoderconfig)
+    image.fp.seek(offset)
+    data = b""
+    try:
+        decoder.setimage(frame.image.im, extents)
+        while True:
+            chunk = image.load_read(DECODE_CHUNK_BYTES)
+            if not chunk:
+                raise OSError("image file is truncated")
+            data += chunk
+            consumed, error = decoder.decode(data)
+            if consumed < 0:
+                break
+            data = data[consumed:]
+            frame.release()
+    finally:
+        decoder.cleanup()
+    frame.release()
+    if error < 0:
+        raise OSError(f"JPEG decoder error {error}")
+
+
+class _ReleasingBuffer(io.BytesIO):
+    """Encoder output that drops the frame's pages each time the encoder hands over data"""
+
+    def __init__(self, frame: MappedFrame):
+        super().__init__()
+        self.frame = frame
+
+    def write(self, data) -> int:
+        written = super().write(data)
+        self.frame.release()
+        return written
+
+
+def encode_jpeg(frame: MappedFrame, quality: int) -> bytes:
+    """Baseline JPEG straight from the map
+
+    Huffman optimization and progressive mode stay off: either makes libjpeg buffer every
+    coefficient of the frame before it writes anything.
+    """
+    # No fileno(), so PIL runs the encoder a buffer at a time through write()
+    output = _ReleasingBuffer(frame)
+    frame.image.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
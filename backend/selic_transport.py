@@ -0,0 +1,194 @@
+"""
+Out-of-band transport for large task arguments and results between the SELIC service and process workers
+Encoded outputs and analysis arrays are written to files in a per-task directory on tmpfs
+(/dev/shm when available) and only small descriptors are pickled through the executor's pipe.
+The service creates each directory before the task starts and removes it when the task ends,
+however it ends, so a failed, cancelled or crashed task cannot leave files behind.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Values smaller than this are cheaper to pickle than to write out
+MIN_TRANSPORT_BYTES = int(os.getenv("SELIC_TRANSPORT_MIN_BYTES", str(64 * 1024)))
+DIR_PREFIX = "selic-transport-"
+
+
+def default_transport_dir() -> str:
+    """SELIC_TRANSPORT_DIR, else /dev/shm (RAM-backed on Linux), else the system temp dir"""
+    configured = os.getenv("SELIC_TRANSPORT_DIR")
+    if configured:
+        return configured
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+@dataclass(frozen=True)
+class SpooledBytes:
+    """Descriptor pickled in place of a large bytes value"""
+    name: str
+    size: int
+
+
+@dataclass(frozen=True)
+class SpooledArray:
+    """Descriptor pickled in place of a large numpy array"""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class _Writer:
+    def __init__(self, directory: str, side: str):
+        self.directory = directory
+        self.side = side
+        self.count = 0
+        self.bytes = 0
+
+    def _path(self) -> Tuple[str, str]:
+        name = f"{self.side}-{self.count}"
+        self.count += 1
+        return name, os.path.join(self.directory, name)
+
+    def spool(self, value: Any) -> Any:
+        if isinstance(value, tuple):
+            return tuple(self.spool(item) for item in value)
+        if isinstance(value, list):
+            return [self.spool(item) for item in value]
+        if isinstance(value, bytes) and len(value) >= MIN_TRANSPORT_BYTES:
+            name, path = self._path()
+            with open(path, "wb") as f:
+                f.write(value)
+            self.bytes += len(value)
+            return SpooledBytes(name, len(value))
+        if isinstance(value, np.ndarray) and value.nbytes >= MIN_TRANSPORT_BYTES and value.dtype != object:
+            name, path = self._path()
+            np.ascontiguousarray(value).tofile(path)
+            self.bytes += value.nbytes
+            return SpooledArray(name, value.shape, value.dtype.str)
+        return value
+
+
+def spool_values(value: Any, directory: str, side: str) -> Tuple[Any, int]:
+    """Write large bytes / arrays inside (nested tuples and lists of) `value` into `directory`
+
+    Returns the value with descriptors in their place and the number of bytes written. `side`
+    keeps argument and result files apart.
+    """
+    writer = _Writer(directory, side)
+    return writer.spool(value), writer.bytes
+
+
+def load_values(value: Any, directory: str) -> Any:
+    """Inverse of spool_values: read every descriptor back (one copy out of the file)"""
+    if isinstance(value, tuple):
+        return tuple(load_values(item, directory) for item in value)
+    if isinstance(value, list):
+        return [load_values(item, directory) for item in value]
+    if isinstance(value, SpooledBytes):
+        with open(os.path.join(directory, value.name), "rb") as f:
+            return f.read()
+    if isinstance(value, SpooledArray):
+        return np.fromfile(os.path.join(directory, value.name), dtype=value.dtype).reshape(value.shape)
+    return value
+
+
+class Transport:
+    """Service-side owner of the per-task directories, with leak accounting
+
+    `live` counts directories of tasks still running. A directory that cannot be removed (a
+    worker still writing into it after its task was cancelled) is retried on later calls and
+    counted in `leaked` until it is gone. Directories left by service processes that no longer
+    exist are swept at startup.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._prefix = f"{DIR_PREFIX}{os.getpid()}-"
+        self._live = 0
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+
+        self.tasks = 0
+        self.bytes_to_workers = 0
+        self.bytes_from_workers = 0
+        self.swept = 0
+
+    def sweep(self) -> None:
+        """Remove directories left behind by service processes that have exited"""
+        try:
+            entries = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if not entry.startswith(DIR_PREFIX):
+                continue
+            pid = entry[len(DIR_PREFIX):].split("-", 1)[0]
+            if not pid.isdigit() or _process_exists(int(pid)):
+                continue
+            shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+            self.swept += 1
+        if self.swept:
+            logger.info(f"Removed {self.swept} transport directories left by exited processes")
+
+    def create_task_dir(self) -> str:
+        """A fresh directory for one task; pass it to remove_task_dir once no process uses it"""
+        path = tempfile.mkdtemp(prefix=self._prefix, dir=self.directory)
+        with self._lock:
+            self._live += 1
+            self.tasks += 1
+        return path
+
+    def remove_task_dir(self, path: str) -> None:
+        with self._lock:
+            self._live -= 1
+            self._pending.append(path)
+        self._remove_pending()
+
+    def _remove_pending(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        remaining = []
+        for path in pending:
+            shutil.rmtree(path, ignore_errors=True)
+            if os.path.exists(path):
+                remaining.append(path)
+        if remaining:
+            with self._lock:
+                self._pending.extend(remaining)
+
+    def close(self) -> None:
+        self._remove_pending()
+        if self._pending:
+            logger.warning(f"{len(self._pending)} transport directories could not be removed: {self._pending}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "live": self._live,
+            "leaked": len(self._pending),
+            "tasks": self.tasks,
+            "bytes_to_workers": self.bytes_to_workers,
+            "bytes_from_workers": self.bytes_from_workers,
+            "swept": self.swept,
+        }
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
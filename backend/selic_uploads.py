@@ -0,0 +1,150 @@
+"""
+Upload spooling for the SELIC service
+Uploads are streamed into a size-capped temp file (hashed on the way) and only ever opened
+lazily by path, so the body is never held as Python bytes. Size and pixel limits are
+enforced before any decode work starts.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image, UnidentifiedImageError
+
+from selic_passthrough import JpegSource, describe_jpeg
+
+logger = logging.getLogger(__name__)
+
+# Limits (SELIC_MAX_UPLOAD_BYTES / SELIC_MAX_PIXELS)
+MAX_UPLOAD_BYTES = int(os.getenv("SELIC_MAX_UPLOAD_BYTES", str(64 * 1024 * 1024)))
+MAX_PIXELS = int(os.getenv("SELIC_MAX_PIXELS", str(100_000_000)))
+SPOOL_DIR = os.getenv("SELIC_SPOOL_DIR")  # Defaults to the system temp dir
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class SpooledUpload:
+    """An upload written to disk, plus what its header says"""
+    path: str
+    size: int
+    digest: str
+    dimensions: Tuple[int, int]
+    mode: str
+    format: Optional[str]
+    jpeg: Optional[JpegSource] = None  # How an RGB / L JPEG was encoded, for pass-through
+
+    @property
+    def pixel_count(self) -> int:
+        return self.dimensions[0] * self.dimensions[1]
+
+    def cleanup(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def _copy_to_spool(source: BinaryIO, max_bytes: int) -> Tuple[str, int, str]:
+    """Copy a file object into a temp file in chunks, hashing as we go and enforcing max_bytes"""
+    fd, path = tempfile.mkstemp(prefix="selic-upload-", dir=SPOOL_DIR)
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = source.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                hasher.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, size, hasher.hexdigest()
+
+
+def hash_file(path: str) -> str:
+    """sha256 of a file on disk, read in chunks"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _read_header(path: str) -> Tuple[Tuple[int, int], str, str, Optional[JpegSource]]:
+    """Dimensions, mode, format and JPEG encoding of an image file, from the header alone"""
+    # PIL does not decode pixels until load()
+    with Image.open(path) as image:
+        return image.size, image.mode, image.format, describe_jpeg(image)
+
+
+def describe_file(path: str, digest: Optional[str] = None, max_pixels: int = MAX_PIXELS) -> SpooledUpload:
+    """Describe an image already on disk (e.g. for offline reprocessing) without copying it
+
+    Hashes the file unless `digest` is given. Raises ValueError for unreadable images and pixel
+    counts over `max_pixels`. The result points at the caller's file: never call cleanup() on it.
+    """
+    size = os.path.getsize(path)
+    try:
+        dimensions, mode, image_format, jpeg = _read_header(path)
+    except UnidentifiedImageError:
+        raise ValueError("Could not read image: unrecognized format")
+    except Exception as e:
+        raise ValueError(f"Could not read image: {e}")
+
+    upload = SpooledUpload(path, size, digest or hash_file(path), dimensions, mode, image_format, jpeg)
+    if upload.pixel_count > max_pixels:
+        raise ValueError(f"Image has {upload.pixel_count} pixels (limit {max_pixels})")
+    return upload
+
+
+async def spool_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                       max_pixels: int = MAX_PIXELS) -> SpooledUpload:
+    """Stream an UploadFile to disk and validate it from the header alone
+
+    Raises HTTPException 400 for non-images and 413 for oversized bodies or pixel counts.
+    """
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+
+    try:
+        # Blocking file IO and hashing run off the event loop
+        path, size, digest = await asyncio.to_thread(_copy_to_spool, file.file, max_bytes)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+
+    try:
+        # Header parse only, but it reads the file and fits the JPEG tables: off the event loop too
+        dimensions, mode, image_format, jpeg = await asyncio.to_thread(_read_header, path)
+    except UnidentifiedImageError:
+        os.unlink(path)
+        raise HTTPException(status_code=400, detail="Could not read image: unrecognized format")
+    except Exception as e:
+        os.unlink(path)
+        raise HTTPException(status_code=400, detail=f"Could not read image: {e}")
+
+    upload = SpooledUpload(path, size, digest, dimensions, mode, image_format, jpeg)
+    if upload.pixel_count > max_pixels:
+        upload.cleanup()
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image has {upload.pixel_count} pixels (limit {max_pixels})"
+        )
+    return upload
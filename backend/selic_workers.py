@@ -0,0 +1,417 @@
+"""
+Worker pool for CPU-bound SELIC stages
+Runs decode, analysis and encode outside the event loop (process-based by default)
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from selic_decode import DecodeBackend, ImageSource, get_decode_backend
+from selic_metrics import collect_timings, record_stages, timed, timed_request_stage
+from selic_processor import (
+    SELICProcessor, SemanticAnalysis, CompressionSettings, EffortReport, MinQualityResult, PerceptualQuality,
+    RateControlResult, Rendition
+)
+from selic_transport import Transport, default_transport_dir, load_values, spool_values
+
+logger = logging.getLogger(__name__)
+
+# Per-worker processor; threading.local so thread pools also get one processor per worker
+_worker_state = threading.local()
+
+
+DEFAULT_DECODE_BACKEND = "pil-draft"
+
+
+def _init_worker(decode_backend: str = DEFAULT_DECODE_BACKEND,
+                 processor_options: Optional[Dict[str, Any]] = None) -> None:
+    """Load the processor and decode backend once when a worker starts"""
+    _worker_state.processor = SELICProcessor(**(processor_options or {}))
+    _worker_state.decoder = get_decode_backend(decode_backend)
+
+
+def _get_processor() -> SELICProcessor:
+    if getattr(_worker_state, "processor", None) is None:
+        _init_worker()
+    return _worker_state.processor
+
+
+def _get_decoder() -> DecodeBackend:
+    if getattr(_worker_state, "decoder", None) is None:
+        _init_worker()
+    return _worker_state.decoder
+
+
+def _decode_full(source: ImageSource):
+    """Open and decode at full resolution up front, so decode time is not charged to preprocessing"""
+    with timed("decode"):
+        image = _get_decoder().open_full(source)
+        image.load()
+    return image
+
+
+def _run_collecting(fn: Callable[..., Any], *args: Any) -> Tuple[Any, Dict[str, float]]:
+    """Worker-side wrapper: run fn and return its result with the stage timings it recorded"""
+    with collect_timings() as timings:
+        return fn(*args), timings
+
+
+def _run_spooled(transport_dir: str, fn: Callable[..., Any],
+                 *args: Any) -> Tuple[Any, Dict[str, float], int]:
+    """Like _run_collecting, with large arguments and results passed through `transport_dir`
+
+    Also returns the number of result bytes written there.
+    """
+    with collect_timings() as timings:
+        with timed("transport"):
+            args = load_values(args, transport_dir)
+        result = fn(*args)
+        with timed("transport"):
+            result, written = spool_values(result, transport_dir, "result")
+        return result, timings, written
+
+
+def analyze_task(source: ImageSource) -> Tuple[SemanticAnalysis, CompressionSettings]:
+    """Reduced-scale decode + semantic analysis + compression settings (runs in a worker)"""
+    processor = _get_processor()
+    with timed("decode"):
+        image, original_size = _get_decoder().decode_for_analysis(source)
+        image.load()
+    semantics = processor.analyze_semantics(image, original_size)
+    compression_settings = processor.optimize_compression(image, semantics)
+    return semantics, compression_settings
+
+
+def prepare_task(source: ImageSource) -> Tuple[np.ndarray, Tuple[int, int], Dict[str, Any]]:
+    """Reduced-scale decode + resize to the 224x224 analysis array (the per-image half of analysis)
+    
+    Also returns the array's image signature (perceptual hash, mean colour, luma spread), so
+    near-duplicates can be found before the model step.
+    """
+    processor = _get_processor()
+    with timed("decode"):
+        image, original_size = _get_decoder().decode_for_analysis(source)
+        image.load()
+    img_array = processor.prepare_analysis_array(image)
+    image.close()
+    return img_array, original_size, processor.image_signature(img_array)
+
+
+def analyze_arrays_task(img_arrays: List[np.ndarray],
+                        sizes: List[Tuple[int, int]]) -> List[Tuple[SemanticAnalysis, CompressionSettings]]:
+    """Batched model half of analysis over arrays from prepare_task (one call per micro-batch)"""
+    processor = _get_processor()
+    batch_semantics = processor.analyze_semantics_batch(img_arrays, sizes)
+    return [(semantics, processor.optimize_compression(None, semantics)) for semantics in batch_semantics]
+
+
+def analyze_batch_task(sources: List[ImageSource]) -> List[Union[Tuple[SemanticAnalysis, CompressionSettings], str]]:
+    """Vectorized analysis over many uploads; failed items come back as an error string"""
+    processor = _get_processor()
+    decoder = _get_decoder()
+    results: List[Union[Tuple[SemanticAnalysis, CompressionSettings], str]] = [None] * len(sources)
+    
+    # Decode one image at a time and keep only its 224x224 array so the batch stays small
+    positions, images, sizes, arrays = [], [], [], []
+    for index, source in enumerate(sources):
+        try:
+            with timed("decode"):
+                image, original_size = decoder.decode_for_analysis(source)
+                image.load()
+            arrays.append(processor.prepare_analysis_array(image))
+            image.close()
+            positions.append(index)
+            images.append(image)
+            sizes.append(original_size)
+        except Exception as e:
+            results[index] = f"Could not decode image: {e}"
+    
+    if arrays:
+        batch_semantics = processor.analyze_semantics_batch(arrays, sizes)
+        for index, image, semantics in zip(positions, images, batch_semantics):
+            results[index] = (semantics, processor.optimize_compression(image, semantics))
+    return results
+
+
+def compress_task(source: ImageSource, settings: CompressionSettings) -> Tuple[bytes, Optional[PerceptualQuality]]:
+    """Full-resolution decode + preprocessing + encode, plus the output's MS-SSIM (runs in a worker)
+    
+    Images the in-memory path would hold over the processor's strip_memory_bytes are decoded
+    and processed in strips instead.
+    """
+    processor = _get_processor()
+    image = _get_decoder().open_full(source)
+    if processor.use_strips(image, settings):
+        return processor.apply_strip_compression(image, settings)
+    with timed("decode"):
+        image.load()
+    return processor.apply_optimized_compression(image, settings)
+
+
+def effort_compress_task(source: ImageSource, settings: CompressionSettings, effort: str,
+                         deadline: Optional[float]) -> Tuple[bytes, EffortReport, Optional[PerceptualQuality]]:
+    """Like compress_task, at an effort tier (dropping to faster tiers when the deadline is near)"""
+    processor = _get_processor()
+    image = _decode_full(source)
+    return processor.apply_compression_with_effort(image, settings, effort, deadline)
+
+
+def renditions_task(source: ImageSource, settings: CompressionSettings, widths: List[int]
+                    ) -> Tuple[bytes, List[Tuple[Rendition, bytes]], Optional[PerceptualQuality]]:
+    """Full-size output plus downscaled renditions, all from a single decode (MS-SSIM of the full size)"""
+    processor = _get_processor()
+    image = _decode_full(source)
+    return processor.apply_compression_with_renditions(image, settings, widths)
+
+
+def rate_controlled_compress_task(source: ImageSource, settings: CompressionSettings, target_bytes: int
+                                  ) -> Tuple[bytes, RateControlResult, Optional[PerceptualQuality]]:
+    """Like compress_task, but searches quality so the output fits in target_bytes"""
+    processor = _get_processor()
+    image = _decode_full(source)
+    return processor.apply_rate_controlled_compression(image, settings, target_bytes)
+
+
+def min_quality_compress_task(source: ImageSource, settings: CompressionSettings,
+                              min_ms_ssim: float) -> Tuple[bytes, MinQualityResult]:
+    """Like compress_task, at the lowest quality that still reaches min_ms_ssim (measured as it searches)"""
+    processor = _get_processor()
+    image = _decode_full(source)
+    return processor.apply_min_quality_compression(image, settings, min_ms_ssim)
+
+
+class WorkerPool:
+    """Executor wrapper that bounds concurrency and tracks queue depth / in-flight work"""
+
+    def __init__(self, max_workers: int, kind: str = "process",
+                 decode_backend: str = DEFAULT_DECODE_BACKEND,
+                 processor_options: Optional[Dict[str, Any]] = None,
+                 transport_dir: Optional[str] = None):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown worker pool kind: {kind}")
+        self.processor_options = processor_options or {}
+        # Fail at startup rather than in every worker if the configuration is unusable
+        get_decode_backend(decode_backend)
+        SELICProcessor(**self.processor_options)
+        self.max_workers = max_workers
+        self.kind = kind
+        self.decode_backend = decode_backend
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self._executor: Executor = None
+        # Held while a broken process pool is swapped for a new one
+        self._executor_lock = threading.Lock()
+        self.restarts = 0
+        self._slots: asyncio.Semaphore = None
+        # Threads share memory with the service, so only process pools need the transport
+        self.transport: Optional[Transport] = None
+        if kind == "process" and transport_dir is not None:
+            self.transport = Transport(transport_dir)
+
+    def start(self) -> None:
+        """Create the executor; workers load their processor via the initializer"""
+        if self._executor is not None:
+            return
+        if self.kind == "process":
+            self._executor = self._process_executor()
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_worker,
+                initargs=(self.decode_backend, self.processor_options),
+                thread_name_prefix="selic-worker"
+            )
+        self._slots = asyncio.Semaphore(self.max_workers)
+        if self.transport is not None:
+            self.transport.sweep()
+        logger.info(
+            f"SELIC worker pool started ({self.kind}, {self.max_workers} workers, "
+            f"{self.decode_backend} decode)"
+        )
+
+    def _process_executor(self) -> ProcessPoolExecutor:
+        executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(self.decode_backend, self.processor_options)
+        )
+        # Start every worker now rather than on first use: a fork while another thread holds
+        # a lock (e.g. the import lock during a PIL plugin import in a to_thread header parse)
+        # leaves the child deadlocked on it
+        for _ in range(self.max_workers):
+            executor.submit(os.getpid)
+        return executor
+
+    def _replace_broken(self, broken: Executor) -> None:
+        """Swap a process pool that lost a worker (killed, e.g. by the OOM killer) for a new one
+
+        Every task the broken pool still held has failed; in-flight counts and slots are settled
+        by their done callbacks, so only the executor is replaced.
+        """
+        with self._executor_lock:
+            if self._executor is not broken:
+                # Already replaced by another caller that saw the same failure
+                return
+            logger.error("A SELIC worker process died; replacing the worker pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._process_executor()
+            self.restarts += 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self._slots = None
+        if self.transport is not None:
+            self.transport.close()
+
+    @property
+    def cache_tag(self) -> str:
+        """Worker configuration that affects results, for use in cache keys"""
+        options = ",".join(f"{k}={v}" for k, v in sorted(self.processor_options.items()))
+        return f"{self.decode_backend};{options}"
+
+    @property
+    def ready(self) -> bool:
+        """Started, and (for process pools) not broken by a worker that died"""
+        return self._executor is not None and not getattr(self._executor, "_broken", False)
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) on a worker, waiting for a free slot first"""
+        if self._executor is None:
+            self.start()
+
+        # Work waits here rather than inside the executor so queue depth is observable
+        self.queued += 1
+        queued_at = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        record_stages({"queue": time.perf_counter() - queued_at})
+
+        transport, directory = self.transport, None
+        try:
+            if transport is None:
+                future = self._submit(_run_collecting, fn, *args)
+            else:
+                directory = transport.create_task_dir()
+                with timed_request_stage("transport"):
+                    args, written = spool_values(args, directory, "arg")
+                transport.bytes_to_workers += written
+                future = self._submit(_run_spooled, directory, fn, *args)
+            # The pool that took the task (_submit may have replaced a broken one)
+            executor = self._executor
+        except BaseException:
+            self._slots.release()
+            if directory is not None:
+                transport.remove_task_dir(directory)
+            raise
+
+        try:
+            if transport is None:
+                result, timings = await asyncio.wrap_future(future)
+            else:
+                result, timings, written = await asyncio.wrap_future(future)
+                transport.bytes_from_workers += written
+                with timed_request_stage("transport"):
+                    result = load_values(result, directory)
+        except BrokenProcessPool:
+            # This task was in the pool when a worker died, so it fails; the next ones get a new pool
+            self._replace_broken(executor)
+            raise
+        except asyncio.CancelledError:
+            if directory is not None and not future.done():
+                # The worker still reads and writes the directory: it goes when the task ends
+                future.add_done_callback(lambda _, path=directory: transport.remove_task_dir(path))
+                directory = None
+            raise
+        finally:
+            if directory is not None:
+                transport.remove_task_dir(directory)
+        record_stages(timings)
+        return result
+
+    def _submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """Submit to the executor; the task holds the caller's slot until the worker is done with it
+
+        A cancelled caller stops waiting, but a task that has started runs to the end. Until then
+        it still counts as in flight and keeps its slot, so queueing and admission see the real load.
+        A pool found broken at submit time is replaced and the task submitted to the new one.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._replace_broken(executor)
+            executor = self._executor
+            future = executor.submit(fn, *args)
+        self.in_flight += 1
+        # Done callbacks run on an executor thread; the counters and the slot belong to the loop
+        future.add_done_callback(lambda done: self._call_in_loop(loop, self._task_done, done))
+        return future
+
+    @staticmethod
+    def _call_in_loop(loop: asyncio.AbstractEventLoop, callback: Callable[..., None], *args: Any) -> None:
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # The loop has closed (shut down with tasks still running): there is nothing left to update
+            pass
+
+    def _task_done(self, future: Future) -> None:
+        if not future.cancelled():
+            if future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        self.in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "decode_backend": self.decode_backend,
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+        }
+        if self.transport is not None:
+            stats["transport"] = self.transport.stats()
+        return stats
+
+
+def pool_from_env() -> WorkerPool:
+    """Build the pool from SELIC_* environment variables"""
+    max_workers = int(os.getenv("SELIC_WORKERS", str(os.cpu_count() or 1)))
+    kind = os.getenv("SELIC_POOL_KIND", "process")
+    decode_backend = os.getenv("SELIC_DECODE_BACKEND", DEFAULT_DECODE_BACKEND)
+    processor_options = {
+        "dominant_color_method": os.getenv("SELIC_DOMINANT_COLORS", "histogram"),
+        "region_aware": os.getenv("SELIC_REGION_AWARE", "1") != "0",
+        "quality_metric": os.getenv("SELIC_QUALITY_METRIC", "1") != "0",
+        "strip_memory_bytes": int(os.getenv("SELIC_STRIP_MEMORY_BYTES", "0"))
+    }
+    transport_dir = default_transport_dir() if os.getenv("SELIC_TRANSPORT", "1") != "0" else None
+    return WorkerPool(
+        max_workers=max(1, max_workers),
+        kind=kind,
+        decode_backend=decode_backend,
+        processor_options=processor_options,
+        transport_dir=transport_dir
+    )